@@ -0,0 +1,392 @@
+'''
+Benchmarks for temporalimage operations
+
+Measures the wall time and peak memory (as tracked by tracemalloc, which
+includes numpy array allocations) of TemporalImage operations and the nipype
+interfaces over a grid of image sizes, frame counts, data types and
+compression, and saves the results to a JSON file. Two result files can then
+be compared to find performance regressions between versions.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --sizes 64 128 --frames 40 \\
+        --dtypes int16 --compression nii.gz --bench dynamic_mean
+    python benchmarks/run_benchmarks.py --compare old.json new.json
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from tempfile import mkdtemp
+from shutil import rmtree
+from statistics import median
+
+import numpy as np
+import nibabel as nib
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                os.pardir)))
+import temporalimage
+
+TIMING_FORMATS = ('csv', 'sif', 'json')
+
+def make_study(dirname, size, numFrames, dtype, compression):
+    '''
+    Write a synthetic 4D image, a label image, and its frame timing in each
+    timing file format
+
+    Args:
+        dirname (str): directory to write the files in
+        size (int): number of voxels along each spatial dimension
+        numFrames (int): number of time frames
+        dtype (str): on-disk data type of the 4D image
+        compression (str): 'nii' or 'nii.gz'
+
+    Returns:
+        study (dict): paths to the files ('img', 'label', and one entry per
+                      timing file format)
+    '''
+    rng = np.random.default_rng(0)
+
+    frameDuration = np.linspace(1, 10, numFrames)
+    frameEnd = np.cumsum(frameDuration)
+    frameStart = frameEnd - frameDuration
+
+    # tissue-like time activity curves with noise
+    tac = 100*np.exp(-frameStart/frameEnd[-1])
+    data = rng.normal(1, 0.1, (size, size, size, 1)).astype(np.float32) * \
+           tac.astype(np.float32)
+
+    img = nib.Nifti1Image(data, np.eye(4))
+    img.set_data_dtype(dtype)
+    study = {'img': os.path.join(dirname, 'img.' + compression)}
+    nib.save(img, study['img'])
+
+    label = np.zeros((size,)*3, dtype=np.int16)
+    label[:, :, size//3:] = 1
+    label[:, :, 2*size//3:] = 2
+    study['label'] = os.path.join(dirname, 'label.nii.gz')
+    nib.save(nib.Nifti1Image(label, np.eye(4)), study['label'])
+
+    for timingFormat in TIMING_FORMATS:
+        study[timingFormat] = os.path.join(dirname, 'timing.' + timingFormat)
+
+    with open(study['csv'], 'w') as f:
+        f.write('Duration of time frame (min),Elapsed time (min)\n')
+        for duration, end in zip(frameDuration, frameEnd):
+            f.write('{},{}\n'.format(duration, end))
+
+    with open(study['sif'], 'w') as f:
+        f.write('01/01/2000 00:00:00 {} 4 1 synthetic\n'.format(numFrames))
+        for start, end in zip(frameStart, frameEnd):
+            f.write('{} {} 0 0\n'.format(60*start, 60*end))
+
+    with open(study['json'], 'w') as f:
+        json.dump({'FrameTimesStart': (60*frameStart).tolist(),
+                   'FrameDuration': (60*frameDuration).tolist()}, f)
+
+    return study
+
+def _midTime(ti):
+    return ti.get_frameStart()[ti.get_numFrames()//2]
+
+def _load(study, timingFormat='csv'):
+    return temporalimage.load(study['img'], study[timingFormat], cache=False)
+
+def bench_load(study, timingFormat):
+    return lambda: _load(study, timingFormat).get_fdata()
+
+def bench_save(study, timingFormat):
+    ti = _load(study)
+    ti.get_fdata()
+    outdir = os.path.dirname(study['img'])
+    ext = '.nii.gz' if study['img'].endswith('.gz') else '.nii'
+    return lambda: temporalimage.save(ti, os.path.join(outdir, 'out' + ext),
+                                      os.path.join(outdir,
+                                                   'out.' + timingFormat))
+
+def bench_extractTime(study):
+    ti = _load(study)
+    return lambda: ti.extractTime(_midTime(ti), ti.get_endTime()).get_fdata()
+
+def bench_splitTime(study):
+    ti = _load(study)
+    return lambda: [img.get_fdata() for img in ti.splitTime(_midTime(ti))]
+
+def bench_roi_timeseries(study):
+    ti = _load(study)
+    mask = nib.load(study['label']).get_fdata()>0
+    return lambda: ti.roi_timeseries(mask=mask)
+
+def bench_label_timeseries(study):
+    ti = _load(study)
+    return lambda: ti.label_timeseries(study['label'], [0, 1, 2], [[1, 2]])
+
+def bench_dynamic_mean(study):
+    ti = _load(study)
+    return lambda: ti.dynamic_mean(weights='frameduration')
+
+def bench_gaussian_filter(study):
+    ti = _load(study)
+    return lambda: ti.gaussian_filter(sigma=2)
+
+def _nipype_runner(interface):
+    def run():
+        cwd = os.getcwd()
+        os.chdir(os.path.dirname(interface.inputs.timeSeriesImgFile))
+        try:
+            interface.run()
+        finally:
+            os.chdir(cwd)
+    return run
+
+def bench_nipype_ExtractTimeSeries(study):
+    from temporalimage.nipype_wrapper import ExtractTimeSeries
+    return _nipype_runner(ExtractTimeSeries(timeSeriesImgFile=study['img'],
+                                            frameTimingFile=study['csv'],
+                                            startTime=0, endTime=60))
+
+def bench_nipype_DynamicMean(study):
+    from temporalimage.nipype_wrapper import DynamicMean
+    return _nipype_runner(DynamicMean(timeSeriesImgFile=study['img'],
+                                      frameTimingFile=study['csv'],
+                                      startTime=0, endTime=60,
+                                      weights='frameduration'))
+
+def bench_nipype_ROI_TACs_to_spreadsheet(study):
+    from temporalimage.nipype_wrapper import ROI_TACs_to_spreadsheet
+    return _nipype_runner(ROI_TACs_to_spreadsheet(
+                            timeSeriesImgFile=study['img'],
+                            frameTimingFile=study['csv'],
+                            labelImgFile=study['label'],
+                            ROI_list=[0, 1, 2], ROI_names=['a', 'b', 'c'],
+                            additionalROIs=[[1, 2]],
+                            additionalROI_names=['bc']))
+
+def get_benchmarks():
+    '''
+    Get the available benchmarks
+
+    Returns:
+        benchmarks (dict): maps benchmark names to functions that take a
+            study (see make_study), do any untimed setup, and return the
+            function to be timed
+    '''
+    benchmarks = {}
+    for timingFormat in TIMING_FORMATS:
+        benchmarks['load_' + timingFormat] = \
+            lambda study, fmt=timingFormat: bench_load(study, fmt)
+        benchmarks['save_' + timingFormat] = \
+            lambda study, fmt=timingFormat: bench_save(study, fmt)
+
+    benchmarks.update({
+        'extractTime': bench_extractTime,
+        'splitTime': bench_splitTime,
+        'roi_timeseries': bench_roi_timeseries,
+        'label_timeseries': bench_label_timeseries,
+        'dynamic_mean': bench_dynamic_mean,
+        'gaussian_filter': bench_gaussian_filter,
+    })
+
+    try:
+        import temporalimage.nipype_wrapper
+        benchmarks.update({
+            'nipype_ExtractTimeSeries': bench_nipype_ExtractTimeSeries,
+            'nipype_DynamicMean': bench_nipype_DynamicMean,
+            'nipype_ROI_TACs_to_spreadsheet':
+                bench_nipype_ROI_TACs_to_spreadsheet,
+        })
+    except ImportError:
+        pass
+
+    return benchmarks
+
+def measure(setup, study, repeat):
+    '''
+    Measure the wall time and peak memory of a benchmark
+
+    Args:
+        setup (function): benchmark setup function (see get_benchmarks)
+        study (dict): study to run the benchmark on
+        repeat (int): number of timed runs
+
+    Returns:
+        result (dict): minimum and median wall time (s) across runs, and
+                       peak memory (bytes) allocated during a separate run
+    '''
+    times = []
+    for _ in range(repeat):
+        func = setup(study)
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    func = setup(study)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'time_min': min(times), 'time_median': median(times),
+            'peak_memory': peak}
+
+def get_metadata():
+    '''
+    Get information about the software and machine the benchmarks ran on
+    '''
+    import subprocess
+    import scipy
+
+    try:
+        from importlib.metadata import version
+        ti_version = version('temporalimage')
+    except Exception:
+        ti_version = None
+
+    try:
+        commit = subprocess.check_output(
+                    ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                    cwd=os.path.dirname(os.path.abspath(__file__))
+                 ).decode().strip()
+    except Exception:
+        commit = None
+
+    return {'temporalimage': ti_version, 'commit': commit,
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'nibabel': nib.__version__, 'scipy': scipy.__version__,
+            'machine': platform.machine(), 'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def run(sizes, frames, dtypes, compressions, names=None, repeat=3,
+        verbose=True):
+    '''
+    Run the benchmarks over a grid of study parameters
+
+    Args:
+        sizes (list of int): numbers of voxels along each spatial dimension
+        frames (list of int): numbers of time frames
+        dtypes (list of str): on-disk data types
+        compressions (list of str): 'nii' and/or 'nii.gz'
+        names (list of str): run only benchmarks whose name contains one of
+                             these strings. If None, run all benchmarks.
+        repeat (int): number of timed runs per benchmark
+        verbose (bool): print each result as it is obtained
+
+    Returns:
+        results (dict): metadata and one record per benchmark and parameter
+                        combination
+    '''
+    import warnings
+
+    benchmarks = get_benchmarks()
+    if names:
+        benchmarks = {name: setup for name, setup in benchmarks.items()
+                      if any(n in name for n in names)}
+
+    records = []
+    for size in sizes:
+        for numFrames in frames:
+            for dtype in dtypes:
+                for compression in compressions:
+                    tmpdirname = mkdtemp()
+                    try:
+                        study = make_study(tmpdirname, size, numFrames,
+                                           dtype, compression)
+                        for name, setup in benchmarks.items():
+                            with warnings.catch_warnings():
+                                warnings.simplefilter('ignore')
+                                result = measure(setup, study, repeat)
+                            record = {'benchmark': name, 'size': size,
+                                      'frames': numFrames, 'dtype': dtype,
+                                      'compression': compression,
+                                      'repeat': repeat}
+                            record.update(result)
+                            records.append(record)
+                            if verbose:
+                                print(('{benchmark:32s} size={size:<4d} '
+                                       'frames={frames:<4d} {dtype:8s} '
+                                       '{compression:7s} '
+                                       '{time_min:9.4f} s '
+                                       '{peak_memory:>12,d} B').format(**record))
+                    finally:
+                        rmtree(tmpdirname)
+
+    return {'metadata': get_metadata(), 'results': records}
+
+def _key(record):
+    return (record['benchmark'], record['size'], record['frames'],
+            record['dtype'], record['compression'])
+
+def compare(old, new, threshold=0.2):
+    '''
+    Compare two sets of benchmark results
+
+    Args:
+        old (dict): baseline results (see run)
+        new (dict): new results
+        threshold (float): relative increase in time or peak memory that
+                           is reported as a regression
+
+    Returns:
+        regressions (list of tuple): (key, metric, old value, new value) for
+                                     each regression
+    '''
+    oldRecords = {_key(r): r for r in old['results']}
+    regressions = []
+    for record in new['results']:
+        oldRecord = oldRecords.get(_key(record))
+        if oldRecord is None:
+            continue
+        for metric in ('time_min', 'peak_memory'):
+            if oldRecord[metric]>0 and \
+               record[metric]>(1+threshold)*oldRecord[metric]:
+                regressions.append((_key(record), metric,
+                                    oldRecord[metric], record[metric]))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1],
+                        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 64])
+    parser.add_argument('--frames', type=int, nargs='+', default=[10, 40])
+    parser.add_argument('--dtypes', nargs='+', default=['float32', 'int16'])
+    parser.add_argument('--compression', nargs='+', default=['nii', 'nii.gz'],
+                        choices=['nii', 'nii.gz'])
+    parser.add_argument('--bench', nargs='+',
+                        help='only run benchmarks whose name contains one of '
+                             'these strings')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files instead of running')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative increase reported as a regression')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0], 'r') as f:
+            old = json.load(f)
+        with open(args.compare[1], 'r') as f:
+            new = json.load(f)
+        regressions = compare(old, new, args.threshold)
+        for key, metric, oldValue, newValue in regressions:
+            print('{} {}: {:.4g} -> {:.4g} ({:+.0%})'.format(
+                  ' '.join(str(k) for k in key), metric, oldValue, newValue,
+                  newValue/oldValue - 1))
+        return 1 if regressions else 0
+
+    results = run(args.sizes, args.frames, args.dtypes, args.compression,
+                  names=args.bench, repeat=args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
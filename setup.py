@@ -10,12 +10,15 @@ setup(name='temporalimage',
       packages=['temporalimage'],
       install_requires=[
           'nibabel',
-          'pandas',
           'scipy',
           'numpy',
           'pint',
       ],
       zip_safe=False,
       test_suite='nose.collector',
-      tests_require=['nose'],
-      extras_require={'nipype': ['nipype']})
+      tests_require=['nose', 'pandas'],
+      extras_require={'nipype': ['nipype'],
+                      'seekindex': ['indexed_gzip'],
+                      'test': ['pandas']},
+      entry_points={'console_scripts':
+                        ['temporalimage-batch=temporalimage.batch:main']})
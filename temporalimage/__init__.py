@@ -1,17 +1,47 @@
+import threading
+
+# The pint unit registry (unitreg, Quantity) takes a while to build, and the
+# nipype wrappers pull in nipype, so both are only loaded on first access.
+_unitreg_lock = threading.Lock()
+
+def _init_unitreg():
+    global unitreg, Quantity
+
+    with _unitreg_lock:
+        if 'Quantity' in globals():
+            return
+
+        from pint import UnitRegistry, UnitStrippedWarning
+        import warnings
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UnitStrippedWarning)
+            _unitreg = UnitRegistry()
+            _unitreg.Quantity([])
+
+        unitreg = _unitreg
+        Quantity = _unitreg.Quantity
+
+def __getattr__(name):
+    if name in ('unitreg', 'Quantity'):
+        _init_unitreg()
+        return globals()[name]
+
+    if name=='nipype_wrapper':
+        from importlib import import_module
+        try:
+            return import_module('.nipype_wrapper', __name__)
+        except ImportError as e:
+            raise ImportError(('Install temporalimage using nipype option if '
+                               'you would like to use temporalimage nipype '
+                               'wrappers.')) from e
+
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
 # import main class
-from pint import UnitRegistry, UnitStrippedWarning
-import warnings
-
-with warnings.catch_warnings():
-    warnings.simplefilter("ignore", UnitStrippedWarning)
-    unitreg = UnitRegistry()
-    Quantity = unitreg.Quantity
-    Quantity([])
-
-from .t4d import TemporalImage, load, save
-
-try:
-    import temporalimage.nipype_wrapper
-except ImportError:
-    print(('Install temporalimage using nipype option if you would like to use '
-           'temporalimage nipype wrappers.'))
+from .timeline import FrameTimeline
+from .cache import DecompressedImageCache, ResultCache
+from .t4d import TemporalImage, load, save, set_computeDtype, get_computeDtype
+from .masked import MaskedTemporalImage
+from .atlas import AtlasIndex
+from .fused import summarize_windows
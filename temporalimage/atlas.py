@@ -0,0 +1,356 @@
+import os
+import numpy as np
+
+class AtlasIndex(object):
+    '''
+    Precomputed index of the voxels of each label of a label image (atlas)
+
+    The flat (C order) indices of the voxels of each label are stored
+    contiguously, grouped by label, so that the time activity curves (TACs)
+    of all labels of any temporal image in the same space can be computed by
+    gathering the labeled voxels and summing each group, without comparing
+    the label image to each label. Composite ROIs (unions of labels) can be
+    stored along with the index.
+
+    Atlas indices are usually created with from_label_image, and can be
+    saved to and loaded from .npz files (see save, load and cached).
+
+    Args:
+        labels (numpy.ndarray): increasing label values
+        voxelIndex (numpy.ndarray): flat voxel indices, grouped by label
+        offsets (numpy.ndarray): voxels of labels[i] are
+                                 voxelIndex[offsets[i]:offsets[i+1]]
+        gridShape (tuple): shape of the label image
+        affine (numpy.ndarray): affine of the label image, or None
+        composites (list of list): labels whose union forms each composite ROI
+        sourceHash (str): content hash of the label image file, if the index
+                          was built from a file
+        indexedLabels (list): labels requested when building the index, or
+                              None if every label in the image was indexed
+    '''
+
+    def __init__(self, labels, voxelIndex, offsets, gridShape, affine=None,
+                 composites=None, sourceHash='', indexedLabels=None):
+        if not len(offsets)==len(labels)+1:
+            raise ValueError('There should be one more offset than labels')
+
+        self.labels = np.asarray(labels)
+        self.voxelIndex = np.asarray(voxelIndex, dtype=np.intp)
+        self.offsets = np.asarray(offsets, dtype=np.intp)
+        self.gridShape = tuple(int(n) for n in gridShape)
+        self.affine = None if affine is None else np.asarray(affine)
+        self.composites = [list(c) for c in composites] if composites else []
+        self.sourceHash = sourceHash
+        self.indexedLabels = None if indexedLabels is None \
+                             else sorted(set(np.asarray(indexedLabels).tolist()))
+
+    @classmethod
+    def from_label_image(klass, label_img, labels=None, composites=None):
+        '''
+        Build the index of a label image
+
+        Args:
+            label_img (str or numpy.ndarray or nibabel image): label image
+                file name, 3D label data matrix, or label image
+            labels (list): labels to index. If None, every label in the image
+                           (including 0) is indexed.
+            composites (list of list of int): each inner list specifies the
+                                              labels whose union forms a
+                                              composite ROI
+
+        Returns:
+            atlasIndex (temporalimage.atlas.AtlasIndex): index of label_img
+        '''
+        sourceHash = ''
+        affine = None
+        if isinstance(label_img, str):
+            from nibabel import load as nibload
+            from .cache import _hash_file
+
+            sourceHash = _hash_file(label_img)
+            label_img = nibload(label_img)
+
+        if hasattr(label_img, 'dataobj'):
+            affine = label_img.affine
+            # keep the stored data type (usually integer) instead of float64
+            label_img = np.asanyarray(label_img.dataobj)
+        else:
+            label_img = np.asanyarray(label_img)
+
+        if not label_img.ndim==3:
+            raise ValueError('Label image must be 3D')
+
+        labelvec = label_img.ravel()
+        if labels is None:
+            voxelIndex = np.argsort(labelvec, kind='stable')
+        else:
+            voxelIndex = np.flatnonzero(np.isin(labelvec, labels))
+            voxelIndex = voxelIndex[np.argsort(labelvec[voxelIndex],
+                                               kind='stable')]
+
+        uniqueLabels, counts = np.unique(labelvec[voxelIndex],
+                                         return_counts=True)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        return klass(uniqueLabels, voxelIndex, offsets, label_img.shape,
+                     affine, composites, sourceHash, labels)
+
+    def save(self, filename):
+        '''
+        Save the index to a .npz file
+
+        Args:
+            filename (str): output file name
+        '''
+        compositeLabels = np.concatenate(
+            [np.asarray(c, dtype=self.labels.dtype) for c in self.composites]) \
+            if self.composites else np.empty(0, dtype=self.labels.dtype)
+        compositeOffsets = np.concatenate(
+            ([0], np.cumsum([len(c) for c in self.composites], dtype=np.intp)))
+
+        arrays = {'labels': self.labels, 'voxelIndex': self.voxelIndex,
+                  'offsets': self.offsets, 'gridShape': np.array(self.gridShape),
+                  'compositeLabels': compositeLabels,
+                  'compositeOffsets': compositeOffsets,
+                  'sourceHash': np.array(self.sourceHash)}
+        if self.affine is not None:
+            arrays['affine'] = self.affine
+        if self.indexedLabels is not None:
+            arrays['indexedLabels'] = np.array(self.indexedLabels,
+                                               dtype=self.labels.dtype)
+
+        # write to a temporary file first, so that concurrent readers never
+        # see a partially written index
+        tmpname = filename + '.' + str(os.getpid()) + '.tmp'
+        with open(tmpname, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmpname, filename)
+
+    @classmethod
+    def load(klass, filename):
+        '''
+        Load an index saved with save
+
+        Args:
+            filename (str): .npz file name
+
+        Returns:
+            atlasIndex (temporalimage.atlas.AtlasIndex): loaded index
+        '''
+        with np.load(filename) as f:
+            compositeLabels = f['compositeLabels']
+            compositeOffsets = f['compositeOffsets']
+            composites = [compositeLabels[start:stop].tolist() for start, stop
+                          in zip(compositeOffsets[:-1], compositeOffsets[1:])]
+            return klass(f['labels'], f['voxelIndex'], f['offsets'],
+                         f['gridShape'],
+                         f['affine'] if 'affine' in f.files else None,
+                         composites, str(f['sourceHash']),
+                         f['indexedLabels'] if 'indexedLabels' in f.files
+                         else None)
+
+    @classmethod
+    def cached(klass, labelfilename, indexfilename, labels=None,
+               composites=None):
+        '''
+        Load the index of a label image file from an index file, building and
+        saving it first if the index file does not exist, was built from a
+        different label image, does not index all of labels, or stores
+        different composite ROIs
+
+        Args:
+            labelfilename (str): label image file name
+            indexfilename (str): .npz index file name
+            labels (list): labels to index. If None, every label in the image
+                           is indexed.
+            composites (list of list of int): composite ROIs to store with
+                                              the index. If None, the
+                                              composite ROIs of an existing
+                                              index are kept.
+
+        Returns:
+            atlasIndex (temporalimage.atlas.AtlasIndex): index of the labels
+                                                         of the label image
+        '''
+        from .cache import _hash_file
+
+        if os.path.exists(indexfilename):
+            try:
+                atlasIndex = klass.load(indexfilename)
+            except (IOError, ValueError, KeyError):
+                atlasIndex = None
+            if atlasIndex is not None and \
+               atlasIndex.sourceHash==_hash_file(labelfilename) and \
+               atlasIndex._indexes(labels) and \
+               (composites is None or
+                [sorted(c) for c in atlasIndex.composites]==
+                [sorted(c) for c in composites]):
+                return atlasIndex
+
+        atlasIndex = klass.from_label_image(labelfilename, labels=labels,
+                                            composites=composites)
+        atlasIndex.save(indexfilename)
+        return atlasIndex
+
+    def _indexes(self, labels=None):
+        '''
+        Check whether the index was built for all of some labels
+
+        Args:
+            labels (list): labels. If None, every label in the image.
+        '''
+        if self.indexedLabels is None:
+            return True
+        if labels is None:
+            return False
+        return set(np.asarray(labels).tolist()).issubset(self.indexedLabels)
+
+    def get_counts(self):
+        ''' Get the number of voxels of each label
+        '''
+        return np.diff(self.offsets)
+
+    def timeseries(self, img, labels=None, composites=None,
+                   return_counts=False):
+        '''
+        Get the mean time activity curves (TACs) within labels and composite
+        ROIs of a temporal image in the space of the atlas
+        (see TemporalImage.label_timeseries)
+
+        Args:
+            img (temporalimage.TemporalImage or
+                 temporalimage.MaskedTemporalImage): temporal image
+            labels (list): labels for which to compute TACs.
+                           If None, all indexed labels are used.
+            composites (list of list): each inner list specifies the labels
+                                       whose union forms a composite ROI.
+                                       If None, the composite ROIs stored
+                                       with the index are used.
+            return_counts (bool): also return the number of voxels in each ROI
+
+        Returns:
+            timeseries (numpy.ndarray): 2D matrix with one row per element of
+                                        labels followed by one row per element
+                                        of composites, and one column per time
+                                        frame. Rows of ROIs with no voxels are
+                                        NaN.
+            counts (numpy.ndarray): number of voxels in each ROI
+                                    (only if return_counts is True)
+        '''
+        rois, needed = self._rois(labels, composites)
+        self._check_image(img)
+
+        numFrames = img.get_numFrames()
+        labelSums = np.zeros((len(self.labels), numFrames))
+        labelCounts = self.get_counts()
+        if needed:
+            voxelIndex, groupStarts = self._voxels(needed)
+
+            # only voxels with TACs in the image (e.g., within the mask of a
+            # masked image) are included in the ROIs
+            inImage = img._in_image(voxelIndex)
+            if not inImage.all():
+                groupCounts = np.add.reduceat(inImage.astype(np.intp),
+                                              groupStarts)
+                labelCounts = labelCounts.copy()
+                labelCounts[needed] = groupCounts
+                voxelIndex = voxelIndex[inImage]
+                groupStarts = (np.cumsum(groupCounts) - groupCounts)[groupCounts>0]
+                needed = [p for p, n in zip(needed, groupCounts) if n>0]
+
+            if needed:
+                # accumulate in float64, as in TemporalImage.label_timeseries
+                labelSums[needed] = np.add.reduceat(img._voxel_tacs(voxelIndex),
+                                                    groupStarts, axis=0,
+                                                    dtype=np.float64)
+
+        timeseries, counts = self._roi_means(labelSums, rois, labelCounts)
+        if return_counts:
+            return timeseries, counts
+        return timeseries
+
+    def _check_image(self, img):
+        '''
+        Check that a temporal image is in the space of the atlas
+        '''
+        if not tuple(img._grid_shape())==self.gridShape:
+            raise ValueError(('Atlas is not of the same size as the 3D images '
+                              'in temporal image!'))
+        if self.affine is not None and \
+           not np.allclose(self.affine, img.affine, atol=1e-4):
+            raise ValueError('Atlas and temporal image are not in the same space')
+
+    def _rois(self, labels=None, composites=None):
+        '''
+        Find the positions in the index of the labels of each ROI
+
+        Args:
+            labels (list): labels, each forming an ROI.
+                           If None, all indexed labels are used.
+            composites (list of list): labels of each composite ROI.
+                                       If None, the stored composites are used.
+
+        Returns:
+            rois (list of list): positions of the indexed labels of each ROI
+                                 (labels with no voxels are left out)
+            needed (list): sorted positions of all labels used by the ROIs
+        '''
+        if labels is None:
+            labels = self.labels.tolist()
+        if composites is None:
+            composites = self.composites
+
+        def _positions(roi):
+            positions = np.searchsorted(self.labels, np.unique(roi))
+            found = positions<len(self.labels)
+            found[found] = self.labels[positions[found]]==np.unique(roi)[found]
+            return positions[found].tolist()
+
+        rois = [_positions([label]) for label in labels] + \
+               [_positions(c) for c in composites]
+        needed = sorted({p for roi in rois for p in roi})
+        return rois, needed
+
+    def _voxels(self, needed):
+        '''
+        Get the voxels of some of the indexed labels
+
+        Args:
+            needed (list): sorted positions of the labels in the index
+
+        Returns:
+            voxelIndex (numpy.ndarray): flat voxel indices, grouped by label
+            groupStarts (numpy.ndarray): start of the voxels of each label
+        '''
+        groups = [self.voxelIndex[self.offsets[p]:self.offsets[p+1]]
+                  for p in needed]
+        groupStarts = np.concatenate(([0], np.cumsum([len(g) for g in groups])))
+        return np.concatenate(groups), groupStarts[:-1]
+
+    def _roi_means(self, labelSums, rois, labelCounts=None):
+        '''
+        Combine the summed TACs of the indexed labels into mean ROI TACs
+
+        Args:
+            labelSums (numpy.ndarray): summed TAC of each indexed label
+            rois (list of list): positions of the labels of each ROI
+                                 (see _rois)
+            labelCounts (numpy.ndarray): number of voxels summed for each
+                                         indexed label. If None, all voxels
+                                         of each label were summed.
+
+        Returns:
+            timeseries (numpy.ndarray): mean TAC of each ROI (NaN if empty)
+            counts (numpy.ndarray): number of voxels in each ROI
+        '''
+        if labelCounts is None:
+            labelCounts = self.get_counts()
+        sums = np.empty((len(rois), labelSums.shape[1]))
+        counts = np.zeros(len(rois), dtype=int)
+        for i, positions in enumerate(rois):
+            sums[i] = labelSums[positions].sum(axis=0)
+            counts[i] = labelCounts[positions].sum()
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            timeseries = sums / counts[:,np.newaxis]
+        return timeseries, counts
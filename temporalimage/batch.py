@@ -0,0 +1,431 @@
+import os
+import os.path as op
+import json
+import time
+import numpy as np
+
+# name of the file that marks a manifest row as done (see run_batch)
+SUMMARY_FILE = 'summary.json'
+
+def read_manifest(filename):
+    '''
+    Read a cohort manifest
+
+    The manifest is a csv file with a header row and one row per temporal
+    image. The image and timing columns are required, and hold the 4D image
+    file and its frame timing file. The optional labels column holds a label
+    image file for ROI TACs, and the optional id column a unique identifier of
+    each row (by default, the image file name without extension). Relative
+    paths are relative to the directory of the manifest.
+
+    Args:
+        filename (str): manifest file name
+
+    Returns:
+        rows (list of dict): id, image, timing and labels (or None) of each row
+    '''
+    import csv
+
+    manifestdir = op.dirname(op.abspath(filename))
+    with open(filename, newline='') as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames is None or \
+           not {'image', 'timing'}.issubset(reader.fieldnames):
+            raise ValueError('Manifest must have image and timing columns')
+
+        rows = []
+        for row in reader:
+            paths = {column: op.join(manifestdir, row[column])
+                             if row.get(column) else None
+                     for column in ('image', 'timing', 'labels')}
+            if paths['image'] is None or paths['timing'] is None:
+                raise ValueError('Every manifest row needs an image and a timing file')
+
+            rowId = row.get('id') or op.basename(paths['image']).split('.')[0]
+            rows.append(dict(paths, id=rowId))
+
+    ids = [row['id'] for row in rows]
+    if not len(set(ids))==len(ids):
+        raise ValueError('Manifest row ids must be unique')
+    return rows
+
+def _file_signature(filename):
+    stat = os.stat(filename)
+    return [op.abspath(filename), stat.st_size, stat.st_mtime_ns]
+
+def _row_signature(row, config):
+    ''' Identify the inputs and configuration of a manifest row
+    '''
+    return {'inputs': [_file_signature(row[column]) if row[column] else None
+                       for column in ('image', 'timing', 'labels')],
+            'config': config}
+
+def _estimate_memory(row, config):
+    '''
+    Estimate the peak memory use of processing a manifest row, in bytes,
+    from the image header
+
+    The frames read at once (see memoryLimit), the window means, and the
+    voxel index of the label image are taken into account.
+    '''
+    from nibabel import load as nibload
+    from .t4d import _check_computeDtype, get_computeDtype
+
+    img = nibload(row['image'])
+    numVoxels = int(np.prod(img.shape[:3]))
+    numFrames = img.shape[3] if len(img.shape)>3 else 1
+
+    computeDtype = _check_computeDtype(config['computeDtype'])
+    if computeDtype is None:
+        computeDtype = get_computeDtype()
+    # native compute data types are at most float64
+    itemsize = 8 if isinstance(computeDtype, str) else computeDtype.itemsize
+
+    frameBytes = numVoxels * itemsize
+    if config['memoryLimit'] is None:
+        chunkBytes = frameBytes * numFrames
+    else:
+        chunkBytes = frameBytes * max(1, min(numFrames,
+                                             config['memoryLimit'] // frameBytes))
+
+    numWindows = max(1, len(config['windows'] or []))
+    meanBytes = numVoxels * itemsize * numWindows if config['means'] else 0
+    labelBytes = numVoxels * np.dtype(np.intp).itemsize * 2 \
+                 if row['labels'] else 0
+    return chunkBytes + meanBytes + labelBytes
+
+def _atlas_index(labelfilename, outputDir):
+    '''
+    Get the atlas index of a label image, shared by all rows that use it
+    '''
+    from hashlib import blake2b
+    from .atlas import AtlasIndex
+
+    indexdir = op.join(outputDir, 'atlas_index')
+    os.makedirs(indexdir, exist_ok=True)
+    name = blake2b(op.abspath(labelfilename).encode(), digest_size=10).hexdigest()
+    return AtlasIndex.cached(labelfilename, op.join(indexdir, name + '.npz'))
+
+def process_row(row, outputDir, config):
+    '''
+    Extract time windows, their means, and ROI TACs of one manifest row
+    (see run_batch), and mark the row as done
+
+    Returns:
+        summary (dict): id, output files, and time spent in each stage
+                        (load, summarize, write) of the row
+    '''
+    from . import Quantity
+    from .t4d import load
+    from .fused import summarize_windows, write_ROI_TACs
+    from .writer import save_image
+    import nibabel as nib
+
+    timings = {}
+    rowdir = op.join(outputDir, row['id'])
+    os.makedirs(rowdir, exist_ok=True)
+
+    tic = time.perf_counter()
+    ti = load(row['image'], row['timing'], computeDtype=config['computeDtype'])
+    if config['windows']:
+        windows = [(Quantity(startTime, 'minute'), Quantity(endTime, 'minute'))
+                   for startTime, endTime in config['windows']]
+    else:
+        windows = [(ti.get_startTime(), ti.get_endTime())]
+    # resolve the windows against the frame timing, to name the output files
+    sliceObjs = [ti._window_frames(startTime, endTime)
+                 for startTime, endTime in windows]
+    windows = [(ti.frameStart[sliceObj][0], ti.frameEnd[sliceObj][-1])
+               for sliceObj in sliceObjs]
+    prefixes = [op.join(rowdir, row['id']+'_'+
+                        '{:02.2f}'.format(startTime.to('minute').magnitude)+
+                        'to'+'{:02.2f}'.format(endTime.to('minute').magnitude))
+                for startTime, endTime in windows]
+
+    atlas = None
+    labels = config['labels']
+    if row['labels']:
+        atlas = _atlas_index(row['labels'], outputDir)
+        if labels is None:
+            labels = [label for label in atlas.labels.tolist() if not label==0]
+    timings['load'] = time.perf_counter() - tic
+
+    ext = '.nii.gz' if config['compress'] else '.nii'
+    outputs = {}
+    kwargs = {}
+    if config['saveImages']:
+        outputs['imgFiles'] = kwargs['imgFiles'] = \
+            [prefix+'min'+ext for prefix in prefixes]
+        outputs['timingFiles'] = kwargs['timingFiles'] = \
+            [prefix+'.csv' for prefix in prefixes]
+
+    tic = time.perf_counter()
+    summaries = summarize_windows(ti, windows, means=config['means'],
+                                  weights=config['weights'], atlas=atlas,
+                                  labels=labels,
+                                  memoryLimit=config['memoryLimit'],
+                                  dtype=config['dtype'],
+                                  compresslevel=config['compresslevel'],
+                                  **kwargs)
+    timings['summarize'] = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    if config['means']:
+        outputs['meanImgFiles'] = [prefix+'min_mean'+ext for prefix in prefixes]
+        for meanImgFile, summary in zip(outputs['meanImgFiles'], summaries):
+            meanImg = nib.Nifti1Image(summary['mean'], ti.affine, ti.header)
+            if config['dtype'] is not None:
+                meanImg.set_data_dtype(config['dtype'])
+            save_image(meanImg, meanImgFile,
+                       compresslevel=config['compresslevel'])
+    if atlas is not None:
+        outputs['csvFiles'] = [prefix+'_ROI_TACs.csv' for prefix in prefixes]
+        for csvFile, summary in zip(outputs['csvFiles'], summaries):
+            write_ROI_TACs(csvFile, [str(label) for label in labels],
+                           summary['tacs'], summary['counts'])
+    timings['write'] = time.perf_counter() - tic
+
+    summary = {'id': row['id'], 'outputs': outputs, 'timings': timings,
+               'signature': _row_signature(row, config)}
+
+    # the summary file is written last, so that it marks the row as done
+    summaryfile = op.join(rowdir, SUMMARY_FILE)
+    tmpname = summaryfile + '.' + str(os.getpid()) + '.tmp'
+    with open(tmpname, 'w') as f:
+        json.dump(summary, f)
+    os.replace(tmpname, summaryfile)
+
+    return summary
+
+def _is_done(row, outputDir, config):
+    '''
+    Check whether a manifest row was processed with the same inputs and
+    configuration by an earlier run
+    '''
+    try:
+        with open(op.join(outputDir, row['id'], SUMMARY_FILE)) as f:
+            summary = json.load(f)
+        signature = _row_signature(row, config)
+    except (IOError, ValueError):
+        return False
+    # round trip through JSON so that tuples compare equal to lists
+    return summary.get('signature')==json.loads(json.dumps(signature))
+
+def run_batch(manifest, outputDir, windows=None, saveImages=True, means=True,
+              weights=None, labels=None, memoryLimit=None, memoryBudget=None,
+              numProcesses=None, resume=True, computeDtype=None, compress=True,
+              compresslevel=1, dtype=None, progress=None):
+    '''
+    Process a cohort of temporal images listed in a manifest
+    (see read_manifest): extract time windows, compute their dynamic means,
+    and compute ROI TACs within the labels of each row's label image, reading
+    the frames of each image once (see temporalimage.fused.summarize_windows).
+
+    Rows are processed in parallel processes. Each row is only started if the
+    estimated memory use of all running rows (see _estimate_memory) stays
+    within memoryBudget, so that large images do not oversubscribe the memory.
+    The outputs of each row are written to a directory named after the row
+    id, along with a summary file that marks the row as done; with resume,
+    rows that were done with the same inputs and options are skipped. Rows
+    that fail are reported, and do not stop the other rows.
+
+    Args:
+        manifest (str or list of dict): manifest file name, or rows as
+                                        returned by read_manifest
+        outputDir (str): output directory
+        windows (list): (startTime, endTime) pairs in minutes. If None, the
+                        whole time series is a single window.
+        saveImages (bool): save the 4D image of each window
+        means (bool): save the 3D mean image of each window
+        weights (str): { None, 'frameduration' } weighting of the frames in
+                       the means (see TemporalImage.dynamic_mean)
+        labels (list of int): labels for which to compute TACs. If None, all
+                              nonzero labels of each label image are used.
+        memoryLimit (int): maximum number of bytes of image data that each row
+                           reads at once (see TemporalImage._iter_frame_chunks)
+        memoryBudget (int): maximum total estimated memory use of the rows
+                            that run at the same time, in bytes. If None, the
+                            memory use is not limited.
+        numProcesses (int): number of worker processes. If None, the number
+                            of CPUs is used. If 1, rows are processed in this
+                            process.
+        resume (bool): skip rows that were done by an earlier run
+        computeDtype (str): floating point data type used for computations
+                            (see set_computeDtype)
+        compress (bool): gzip-compress the output images
+        compresslevel (int): gzip compression level
+        dtype (str): on-disk data type of the output images (see save)
+        progress (callable): function called with the id of each row, its
+                             status ('done', 'skipped', or 'failed'), and the
+                             number of rows finished so far
+
+    Returns:
+        report (dict): lists of done, skipped, and failed row ids, errors of
+                       failed rows, elapsed wall time in seconds, throughput
+                       in images per minute, and total time spent in each
+                       stage (see format_report)
+    '''
+    from collections import deque
+
+    if numProcesses is None:
+        numProcesses = os.cpu_count() or 1
+    if numProcesses<1:
+        raise ValueError('Number of processes should be positive')
+
+    rows = read_manifest(manifest) if isinstance(manifest, str) else manifest
+    outputDir = op.abspath(outputDir)
+    os.makedirs(outputDir, exist_ok=True)
+
+    config = {'windows': [list(window) for window in windows] if windows
+                         else None,
+              'saveImages': saveImages, 'means': means, 'weights': weights,
+              'labels': labels, 'memoryLimit': memoryLimit,
+              'computeDtype': computeDtype, 'compress': compress,
+              'compresslevel': compresslevel, 'dtype': dtype}
+
+    report = {'done': [], 'skipped': [], 'failed': [], 'errors': {},
+              'stageTimes': {}}
+    start = time.perf_counter()
+
+    def _finish(row, status, summary=None, error=None):
+        report[status].append(row['id'])
+        if summary is not None:
+            for stage, seconds in summary['timings'].items():
+                report['stageTimes'][stage] = \
+                    report['stageTimes'].get(stage, 0) + seconds
+        if error is not None:
+            report['errors'][row['id']] = repr(error)
+        if progress:
+            progress(row['id'], status, len(report['done']) +
+                     len(report['skipped']) + len(report['failed']))
+
+    pending = deque()
+    for row in rows:
+        if resume and _is_done(row, outputDir, config):
+            _finish(row, 'skipped')
+            continue
+        try:
+            pending.append((row, _estimate_memory(row, config)))
+        except Exception as e:
+            _finish(row, 'failed', error=e)
+
+    if numProcesses==1:
+        for row, _ in pending:
+            try:
+                summary = process_row(row, outputDir, config)
+            except Exception as e:
+                _finish(row, 'failed', error=e)
+            else:
+                _finish(row, 'done', summary)
+    elif pending:
+        from concurrent.futures import ProcessPoolExecutor, wait, \
+                                       FIRST_COMPLETED
+
+        running = {}
+        with ProcessPoolExecutor(max_workers=min(numProcesses,
+                                                 len(pending))) as executor:
+            while pending or running:
+                # start the first rows that fit into the memory budget; a row
+                # that does not fit on its own is started when nothing else runs
+                usedMemory = sum(memory for _, memory in running.values())
+                for job in list(pending):
+                    if len(running)>=numProcesses:
+                        break
+                    row, memory = job
+                    if memoryBudget is None or not running or \
+                       usedMemory + memory<=memoryBudget:
+                        pending.remove(job)
+                        future = executor.submit(process_row, row, outputDir,
+                                                 config)
+                        running[future] = job
+                        usedMemory += memory
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    row, _ = running.pop(future)
+                    try:
+                        summary = future.result()
+                    except Exception as e:
+                        _finish(row, 'failed', error=e)
+                    else:
+                        _finish(row, 'done', summary)
+
+    report['elapsed'] = time.perf_counter() - start
+    report['imagesPerMinute'] = 60 * len(report['done']) / report['elapsed'] \
+                                if report['elapsed']>0 else 0.0
+    return report
+
+def format_report(report):
+    '''
+    Format the report of run_batch as text
+
+    Args:
+        report (dict): report returned by run_batch
+
+    Returns:
+        text (str): summary of the run, with throughput and stage timing
+    '''
+    numDone = len(report['done'])
+    lines = ['Processed %d images (%d skipped, %d failed) in %.1f s' %
+             (numDone, len(report['skipped']), len(report['failed']),
+              report['elapsed']),
+             'Throughput: %.2f images per minute' % report['imagesPerMinute']]
+    for stage, seconds in report['stageTimes'].items():
+        lines.append('  %-10s %8.2f s total, %8.2f s per image' %
+                     (stage, seconds, seconds / max(1, numDone)))
+    for rowId in report['failed']:
+        lines.append('Failed %s: %s' % (rowId, report['errors'].get(rowId, '')))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    '''
+    Command line interface of run_batch (temporalimage-batch)
+    '''
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+        prog='temporalimage-batch',
+        description=('Extract time windows, window means, and ROI TACs for '
+                     'a cohort of 4D images listed in a manifest csv file '
+                     '(columns: image, timing, and optionally labels, id)'))
+    parser.add_argument('manifest', help='manifest csv file')
+    parser.add_argument('outputDir', help='output directory')
+    parser.add_argument('--window', nargs=2, type=float, action='append',
+                        metavar=('START', 'END'), dest='windows',
+                        help=('time window in minutes (can be repeated); '
+                              'default: the whole time series'))
+    parser.add_argument('--no-images', action='store_false', dest='saveImages',
+                        help='do not save the 4D image of each window')
+    parser.add_argument('--no-means', action='store_false', dest='means',
+                        help='do not save the mean image of each window')
+    parser.add_argument('--weights', choices=['frameduration'],
+                        help='weighting of the frames in the means')
+    parser.add_argument('--labels', nargs='+', type=int,
+                        help='labels for ROI TACs (default: all nonzero labels)')
+    parser.add_argument('--memory-limit', type=int, dest='memoryLimit',
+                        help='bytes of image data read at once per image')
+    parser.add_argument('--memory-budget', type=int, dest='memoryBudget',
+                        help='total estimated bytes of images processed at once')
+    parser.add_argument('--processes', type=int, dest='numProcesses',
+                        help='number of worker processes (default: CPU count)')
+    parser.add_argument('--no-resume', action='store_false', dest='resume',
+                        help='process rows that were done by an earlier run')
+    parser.add_argument('--compute-dtype', dest='computeDtype',
+                        choices=['float64', 'float32', 'native'],
+                        help='floating point data type used for computations')
+    parser.add_argument('--no-compress', action='store_false', dest='compress',
+                        help='write uncompressed .nii images')
+    parser.add_argument('--compresslevel', type=int, default=1,
+                        choices=range(10), help='gzip compression level')
+    parser.add_argument('--dtype', choices=['float32', 'float64', 'int16'],
+                        help='on-disk data type of the output images')
+    args = parser.parse_args(argv)
+
+    def _progress(rowId, status, numFinished):
+        sys.stderr.write('[%d] %s %s\n' % (numFinished, rowId, status))
+        sys.stderr.flush()
+
+    report = run_batch(progress=_progress, **vars(args))
+    print(format_report(report))
+    return 1 if report['failed'] else 0
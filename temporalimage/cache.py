@@ -0,0 +1,458 @@
+import os
+import os.path as op
+import json
+
+# environment variables that enable the default decompressed image cache
+CACHE_DIR_ENV = 'TEMPORALIMAGE_CACHE_DIR'
+CACHE_SIZE_ENV = 'TEMPORALIMAGE_CACHE_SIZE'
+
+# environment variables that enable the default result cache
+RESULT_CACHE_DIR_ENV = 'TEMPORALIMAGE_RESULT_CACHE_DIR'
+RESULT_CACHE_SIZE_ENV = 'TEMPORALIMAGE_RESULT_CACHE_SIZE'
+
+def _hash_array(arr):
+    '''
+    Compute the hash of the data type, shape and contents of an array
+
+    Returns:
+        digest (str): hexadecimal BLAKE2b digest
+    '''
+    from hashlib import blake2b
+    import numpy as np
+
+    arr = np.ascontiguousarray(arr)
+    h = blake2b(digest_size=20)
+    h.update(repr((arr.dtype.str, arr.shape)).encode())
+    h.update(memoryview(arr).cast('B'))
+    return h.hexdigest()
+
+def _hash_file(filename, blocksize=2**20):
+    '''
+    Compute the hash of the contents of a file
+
+    Args:
+        filename (str): path to file
+        blocksize (int): number of bytes to read at a time
+
+    Returns:
+        digest (str): hexadecimal BLAKE2b digest of the file contents
+    '''
+    from hashlib import blake2b
+
+    h = blake2b(digest_size=20)
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+class _FileCache(object):
+    '''
+    Size-limited directory of cached files with least recently used eviction,
+    along with an index of the content hashes of input files
+
+    Args:
+        directory (str): cache directory (created if it does not exist)
+        maxSize (int): maximum total size of cached files in bytes.
+                       If None, the cache is not size-limited.
+    '''
+
+    # file name extension of the cached files
+    suffix = ''
+
+    def __init__(self, directory, maxSize=None):
+        self.directory = op.abspath(directory)
+        self.maxSize = maxSize
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _index_file(self):
+        return op.join(self.directory, 'index.json')
+
+    def _usage_file(self):
+        return op.join(self.directory, 'usage.json')
+
+    def _read_json(self, filename):
+        try:
+            with open(filename, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_json(self, filename, content):
+        tmpname = filename + '.' + str(os.getpid()) + '.tmp'
+        with open(tmpname, 'w') as f:
+            json.dump(content, f)
+        os.replace(tmpname, filename)
+
+    def _read_index(self):
+        return self._read_json(self._index_file())
+
+    def _write_index(self, index):
+        self._write_json(self._index_file(), index)
+
+    def _mark_used(self, cachedfile):
+        '''
+        Record the time a cached file was used. Use times are kept in a
+        separate file instead of the modification times of the cached files,
+        so that the stored content hashes of cached files (e.g., of
+        decompressed images that results are keyed on) remain valid.
+        '''
+        import time
+
+        usage = self._read_json(self._usage_file())
+        usage[op.basename(cachedfile)] = time.time()
+        self._write_json(self._usage_file(), usage)
+
+    def _content_hash(self, filename):
+        '''
+        Get the content hash of a file, re-using the stored hash if the file
+        size and modification time have not changed
+        '''
+        stat = os.stat(filename)
+        index = self._read_index()
+
+        entry = index.get(filename)
+        if entry is not None and entry['size']==stat.st_size and \
+           entry['mtime_ns']==stat.st_mtime_ns:
+            return entry['hash']
+
+        digest = _hash_file(filename)
+        index[filename] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                           'hash': digest}
+        self._write_index(index)
+        return digest
+
+    def get_size(self):
+        '''
+        Get the total size of the cached files in bytes
+        '''
+        return sum(op.getsize(f) for f in self._cached_files())
+
+    def _cached_files(self):
+        return [op.join(self.directory, f) for f in os.listdir(self.directory)
+                if f.endswith(self.suffix)]
+
+    def evict(self, keep=None):
+        '''
+        Remove least recently used files until the cache fits in maxSize
+
+        Args:
+            keep (str): cached file that should not be removed
+        '''
+        if self.maxSize is None:
+            return
+
+        # files that were never marked as used were last used when written
+        usage = self._read_json(self._usage_file())
+        cachedfiles = sorted(self._cached_files(),
+                             key=lambda f: usage.get(op.basename(f),
+                                                     op.getmtime(f)))
+        totalSize = sum(op.getsize(f) for f in cachedfiles)
+        removed = False
+        for cachedfile in cachedfiles:
+            if totalSize<=self.maxSize:
+                break
+            if cachedfile==keep:
+                continue
+            totalSize -= op.getsize(cachedfile)
+            usage.pop(op.basename(cachedfile), None)
+            removed = True
+            try:
+                os.remove(cachedfile)
+            except FileNotFoundError:
+                # removed by another process
+                pass
+
+        if removed:
+            self._write_json(self._usage_file(), usage)
+
+    def clear(self):
+        '''
+        Remove all cached files
+        '''
+        for cachedfile in self._cached_files():
+            os.remove(cachedfile)
+        for filename in (self._index_file(), self._usage_file()):
+            if op.exists(filename):
+                os.remove(filename)
+
+class DecompressedImageCache(_FileCache):
+    '''
+    On-disk cache of decompressed copies of gzipped NIfTI images
+
+    The first time a .nii.gz image is requested, it is decompressed into an
+    uncompressed .nii file in the cache directory, which can then be
+    memory-mapped by nibabel instead of being decompressed again.
+    Cached files are keyed by the hash of the compressed file contents, so
+    copies of the same image share a cache entry. The content hash of each
+    input file is remembered along with its size and modification time, so
+    unchanged inputs are not re-hashed.
+
+    When the cache grows beyond maxSize, the least recently used cached
+    images are removed.
+
+    Args:
+        directory (str): cache directory (created if it does not exist)
+        maxSize (int): maximum total size of cached images in bytes.
+                       If None, the cache is not size-limited.
+    '''
+
+    suffix = '.nii'
+
+    def get(self, filename):
+        '''
+        Get the path to a decompressed copy of a gzipped image, decompressing
+        it into the cache if necessary
+
+        Args:
+            filename (str): path to .nii.gz image
+
+        Returns:
+            cachedfilename (str): path to decompressed .nii image
+        '''
+        import gzip
+        import shutil
+
+        filename = op.abspath(filename)
+        if not filename.endswith('.nii.gz'):
+            raise ValueError('Only .nii.gz images can be cached')
+
+        cachedfilename = op.join(self.directory,
+                                 self._content_hash(filename) + '.nii')
+
+        if op.exists(cachedfilename):
+            self._mark_used(cachedfilename)
+        else:
+            # decompress into a temporary file first, so that concurrent
+            # readers never see a partially written image
+            tmpname = cachedfilename + '.' + str(os.getpid()) + '.tmp'
+            with gzip.open(filename, 'rb') as fin, open(tmpname, 'wb') as fout:
+                shutil.copyfileobj(fin, fout, 2**24)
+            os.replace(tmpname, cachedfilename)
+
+            self.evict(keep=cachedfilename)
+
+        return cachedfilename
+
+def get_default_cache():
+    '''
+    Get the default decompressed image cache, which is enabled by setting the
+    TEMPORALIMAGE_CACHE_DIR environment variable to the cache directory
+    (and optionally TEMPORALIMAGE_CACHE_SIZE to its maximum size in bytes).
+    Using environment variables makes the cache available to nipype nodes
+    that run in separate processes.
+
+    Returns:
+        cache (temporalimage.cache.DecompressedImageCache): default cache,
+            or None if it is not enabled
+    '''
+    directory = os.environ.get(CACHE_DIR_ENV)
+    if not directory:
+        return None
+
+    maxSize = os.environ.get(CACHE_SIZE_ENV)
+    return DecompressedImageCache(directory,
+                                  None if not maxSize else int(maxSize))
+
+class ResultCache(_FileCache):
+    '''
+    On-disk cache of results derived from temporal images, such as dynamic
+    means and ROI time activity curves
+
+    Results are keyed by the image data, the frame timing, the name of the
+    operation and its parameters, so that re-running an analysis on unchanged
+    images returns the stored results without reading the images. The data of
+    images loaded from a file (or extracted from one) are identified by the
+    content hash of the file and the time frames used, which is remembered
+    along with the file size and modification time; the data of other images
+    are hashed. Mask and label image file parameters are identified by their
+    content hash as well.
+
+    When the cache grows beyond maxSize, the least recently used results are
+    removed.
+
+    Args:
+        directory (str): cache directory (created if it does not exist)
+        maxSize (int): maximum total size of cached results in bytes.
+                       If None, the cache is not size-limited.
+    '''
+
+    suffix = '.npz'
+
+    def _param_key(self, value):
+        '''
+        Convert an operation parameter into a JSON serializable key
+        '''
+        import numpy as np
+
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        if isinstance(value, str):
+            return value
+        if isinstance(value, (np.integer, np.floating, np.bool_)):
+            return value.item()
+        if hasattr(value, 'magnitude') and hasattr(value, 'units'):
+            # time quantities are compared in seconds
+            return ['quantity', self._param_key(value.to('sec').magnitude)]
+        if isinstance(value, np.ndarray):
+            return ['array', _hash_array(value)]
+        if isinstance(value, (list, tuple)):
+            return [self._param_key(v) for v in value]
+        if isinstance(value, dict):
+            return {str(k): self._param_key(v) for k, v in value.items()}
+        if hasattr(value, 'voxelIndex') and hasattr(value, 'offsets'):
+            # atlas index
+            return ['atlas', _hash_array(value.labels),
+                    _hash_array(value.voxelIndex), _hash_array(value.offsets),
+                    list(value.gridShape), self._param_key(value.composites)]
+        raise TypeError('Cannot use a %s as a cache key' % type(value).__name__)
+
+    def _file_param_key(self, value):
+        '''
+        Convert an operation parameter that may be a file name into a JSON
+        serializable key, identifying files by their content hash
+        '''
+        if isinstance(value, str):
+            return ['file', self._content_hash(op.abspath(value))]
+        return self._param_key(value)
+
+    def key(self, img, operation, params, fileParams=()):
+        '''
+        Get the cache key of an operation on a temporal image
+
+        Args:
+            img (temporalimage.TemporalImage): temporal image
+            operation (str): name of the operation
+            params (dict): parameters of the operation that affect its result
+            fileParams (tuple of str): names of the parameters that may be
+                                       file names (e.g., of mask or label
+                                       images); when they are, they are
+                                       identified by the file contents.
+                                       Other strings are keyed by value.
+
+        Returns:
+            key (str): hexadecimal BLAKE2b digest
+        '''
+        from hashlib import blake2b
+
+        paramKeys = {name: self._file_param_key(value) if name in fileParams
+                           else self._param_key(value)
+                     for name, value in params.items()}
+        description = [img._data_key(self._content_hash),
+                       self._param_key(img.frameStart),
+                       self._param_key(img.frameEnd),
+                       str(img.get_computeDtype()),
+                       operation, paramKeys]
+        h = blake2b(digest_size=20)
+        h.update(json.dumps(description, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def _result_file(self, key):
+        return op.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        '''
+        Get a cached result
+
+        Args:
+            key (str): cache key (see key)
+
+        Returns:
+            result (numpy.ndarray or tuple): cached array, or tuple of arrays,
+                                             or None if there is none
+        '''
+        import numpy as np
+        from zipfile import BadZipFile
+
+        resultfile = self._result_file(key)
+        try:
+            with np.load(resultfile) as f:
+                arrays = [f['arr_%d' % i] for i in range(len(f.files) - 1)]
+                isTuple = bool(f['isTuple'])
+        except (IOError, ValueError, KeyError, BadZipFile):
+            return None
+
+        self._mark_used(resultfile)
+        return tuple(arrays) if isTuple else arrays[0]
+
+    def put(self, key, result):
+        '''
+        Store a result in the cache
+
+        Args:
+            key (str): cache key (see key)
+            result (numpy.ndarray or tuple): array or tuple of arrays
+        '''
+        import numpy as np
+
+        isTuple = isinstance(result, tuple)
+        arrays = result if isTuple else (result,)
+
+        resultfile = self._result_file(key)
+        # write to a temporary file first, so that concurrent readers never
+        # see a partially written result
+        tmpname = resultfile + '.' + str(os.getpid()) + '.tmp'
+        with open(tmpname, 'wb') as f:
+            np.savez(f, *arrays, isTuple=isTuple)
+        os.replace(tmpname, resultfile)
+
+        self.evict(keep=resultfile)
+
+def get_default_result_cache():
+    '''
+    Get the default result cache, which is enabled by setting the
+    TEMPORALIMAGE_RESULT_CACHE_DIR environment variable to the cache
+    directory (and optionally TEMPORALIMAGE_RESULT_CACHE_SIZE to its maximum
+    size in bytes), so that nipype nodes share it (see get_default_cache).
+
+    Returns:
+        cache (temporalimage.cache.ResultCache): default result cache,
+            or None if it is not enabled
+    '''
+    directory = os.environ.get(RESULT_CACHE_DIR_ENV)
+    if not directory:
+        return None
+
+    maxSize = os.environ.get(RESULT_CACHE_SIZE_ENV)
+    return ResultCache(directory, None if not maxSize else int(maxSize))
+
+def cached_result(img, cache, operation, params, compute, fileParams=()):
+    '''
+    Get the result of an operation on a temporal image from a result cache,
+    computing and storing it if it is not cached
+
+    Args:
+        img (temporalimage.TemporalImage): temporal image
+        cache (temporalimage.cache.ResultCache or str or bool): result cache
+            (or cache directory). If None, the default result cache is used
+            if it is enabled (see get_default_result_cache). If True, the
+            default result cache is used, and must be enabled. If False, no
+            cache is used.
+        operation (str): name of the operation
+        params (dict): parameters of the operation that affect its result
+        compute (callable): function that computes the result (an array or a
+                            tuple of arrays)
+        fileParams (tuple of str): names of the parameters that may be file
+                                   names (see ResultCache.key)
+
+    Returns:
+        result (numpy.ndarray or tuple): result of the operation
+    '''
+    if cache is None or cache is True:
+        required = cache is True
+        cache = get_default_result_cache()
+        if required and cache is None:
+            raise ValueError(('The default result cache is not enabled: set '
+                              'the %s environment variable to the cache '
+                              'directory') % RESULT_CACHE_DIR_ENV)
+    elif isinstance(cache, str):
+        cache = ResultCache(cache)
+
+    if not cache:
+        return compute()
+
+    key = cache.key(img, operation, params, fileParams)
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        cache.put(key, result)
+    return result
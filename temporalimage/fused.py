@@ -0,0 +1,228 @@
+import os
+import numpy as np
+
+def summarize_windows(img, windows, imgFiles=None, timingFiles=None,
+                      means=False, weights=None, mask=None, atlas=None,
+                      labels=None, composites=None, memoryLimit=None,
+                      time_unit=None, dtype=None, compresslevel=1,
+                      numThreads=None):
+    '''
+    Compute several outputs for each of a set of time windows of a temporal
+    image in a single pass over its time frames: the extracted 4D image of
+    each window (saved to disk), the dynamic mean of each window, and the
+    mean time activity curves (TACs) within labels of an atlas.
+
+    The frames spanned by all windows are read once, in chunks of frames, and
+    every chunk is used for all outputs before the next one is read, so that
+    the extracted images are never fully held in memory. Images saved to an
+    integer data type that requires scaling (e.g., int16 images with a scaling
+    slope) are spooled to a temporary uncompressed file next to the output
+    image while the range of their data is tracked, and are then scaled and
+    written from that file, so that the input image is still read only once.
+
+    Args:
+        img (temporalimage.TemporalImage): temporal image
+        windows (list): list of (startTime, endTime) pairs, where startTime
+                        (temporalimage.Quantity) is inclusive and endTime
+                        (temporalimage.Quantity) is exclusive. Windows are
+                        resolved against the frame timing as in extractTime.
+        imgFiles (list of str): output image file name of each window.
+                                If None, the extracted images are not saved.
+        timingFiles (list of str): output frame timing file name of each
+                                   window (required if imgFiles is specified)
+        means (bool): compute the dynamic mean of each window
+        weights (str): { None, 'frameduration' } weighting of the frames in
+                       the dynamic means (see TemporalImage.dynamic_mean)
+        mask (str or numpy.ndarray): mask file name or 3D mask data matrix.
+            If specified, means are only computed within the bounding box of
+            the mask, and are 0 outside of it.
+        atlas (str or numpy.ndarray or temporalimage.atlas.AtlasIndex):
+            label image file name, 3D label data matrix, or atlas index.
+            If None, no TACs are computed.
+        labels (list): labels for which to compute TACs.
+                       If None, all labels of the atlas are used.
+        composites (list of list): each inner list specifies the labels whose
+                                   union forms a composite ROI
+        memoryLimit (int): maximum number of bytes of image data to read at
+                           once (see TemporalImage._iter_frame_chunks).
+                           If None, all frames are read at once.
+        time_unit (str): units of time to be used in the timing files
+        dtype (numpy.dtype): on-disk data type of the saved images
+                             (see temporalimage.save)
+        compresslevel (int): gzip compression level of .nii.gz images
+        numThreads (int): number of threads to gzip-compress images with
+
+    Returns:
+        summaries (list of dict): one dict per window, with the possibly
+            modified startTime and endTime of the window, and, if computed,
+            mean (3D matrix), tacs (2D matrix with one row per element of
+            labels followed by one row per element of composites, and one
+            column per time frame of the window; see
+            TemporalImage.label_timeseries) and counts (number of voxels in
+            each ROI)
+    '''
+    from contextlib import ExitStack
+    from .atlas import AtlasIndex
+    from .t4d import _needs_data_range
+    from .timing import write_frameTiming
+    from .writer import TemporalImageWriter
+
+    if len(windows)==0:
+        raise ValueError('At least one time window must be specified')
+    if imgFiles is not None and \
+       not (timingFiles is not None and
+            len(imgFiles)==len(timingFiles)==len(windows)):
+        raise ValueError(('There should be one image file and one timing file '
+                          'per time window'))
+
+    sliceObjs = [img._window_frames(startTime, endTime)
+                 for startTime, endTime in windows]
+    windowImgs = [img._slice_frames(sliceObj) for sliceObj in sliceObjs]
+
+    startIndex = min(sliceObj.start for sliceObj in sliceObjs)
+    endIndex = max(sliceObj.stop for sliceObj in sliceObjs)
+    span = img._slice_frames(slice(startIndex, endIndex))
+
+    computeDtype = img.get_computeDtype()
+    if weights is None:
+        delta = np.ones(img.get_numFrames(), dtype=computeDtype)
+    elif weights=='frameduration':
+        delta = img.get_frameDuration().magnitude.astype(computeDtype)
+    else:
+        raise ValueError('Weights should be None or frameduration')
+
+    if means:
+        bbox = img.mask_bbox(mask) if mask is not None \
+               else tuple(slice(0, n) for n in img.shape[:3])
+        meanSums = [np.zeros(tuple(b.stop - b.start for b in bbox),
+                             dtype=computeDtype) for _ in windows]
+
+    if atlas is not None:
+        if not isinstance(atlas, AtlasIndex):
+            atlas = AtlasIndex.from_label_image(atlas)
+        atlas._check_image(img)
+        rois, needed = atlas._rois(labels, composites)
+        labelSums = np.zeros((len(atlas.labels), endIndex - startIndex))
+        if needed:
+            voxelIndex, groupStarts = atlas._voxels(needed)
+            voxelCoords = np.unravel_index(voxelIndex, img.shape[:3])
+
+    # images that must be scaled to an integer type are spooled to a
+    # temporary file, and written once the range of their data is known
+    spooled = {}
+    dataRanges = {}
+    with ExitStack() as stack:
+        writers = [None] * len(windows)
+        windowDtypes = [None] * len(windows)
+        if imgFiles is not None:
+            for w, windowImg in enumerate(windowImgs):
+                windowDtypes[w] = windowImg.get_data_dtype() if dtype is None \
+                                  else np.dtype(dtype)
+                if _needs_data_range(windowImg, windowDtypes[w]):
+                    spoolname = imgFiles[w] + '.' + str(os.getpid()) + '.npy'
+                    stack.callback(_remove_file, spoolname)
+                    spooled[w] = np.lib.format.open_memmap(
+                                     spoolname, mode='w+', dtype=computeDtype,
+                                     shape=windowImg.shape, fortran_order=True)
+                    dataRanges[w] = (np.inf, -np.inf)
+                    continue
+                writers[w] = stack.enter_context(TemporalImageWriter(
+                                 imgFiles[w], windowImg.shape, img.affine,
+                                 header=img.header, dtype=windowDtypes[w],
+                                 compresslevel=compresslevel,
+                                 numThreads=numThreads))
+
+        for chunkSlice, chunk in span._iter_frame_chunks(memoryLimit):
+            chunkStart = startIndex + chunkSlice.start
+            chunkStop = startIndex + chunkSlice.stop
+
+            for w, sliceObj in enumerate(sliceObjs):
+                # frames of the chunk that are in the window
+                start = max(sliceObj.start, chunkStart)
+                stop = min(sliceObj.stop, chunkStop)
+                if not start<stop:
+                    continue
+                frames = chunk[:,:,:,start-chunkStart:stop-chunkStart]
+                if writers[w] is not None:
+                    writers[w].write(frames)
+                elif w in spooled:
+                    spooled[w][...,start-sliceObj.start:stop-sliceObj.start] = frames
+                    dataRanges[w] = (min(dataRanges[w][0], np.nanmin(frames)),
+                                     max(dataRanges[w][1], np.nanmax(frames)))
+                if means:
+                    for t in range(start, stop):
+                        meanSums[w] += chunk[bbox + (t-chunkStart,)] * delta[t]
+
+            if atlas is not None and needed:
+                labelSums[needed, chunkSlice] = np.add.reduceat(
+                                                    chunk[voxelCoords],
+                                                    groupStarts, axis=0,
+                                                    dtype=np.float64)
+
+        for w, spool in spooled.items():
+            frameBytes = spool[...,0].nbytes
+            framesPerChunk = spool.shape[3] if memoryLimit is None \
+                             else int(max(1, memoryLimit // frameBytes))
+            with TemporalImageWriter(imgFiles[w], spool.shape, img.affine,
+                                     header=img.header, dtype=windowDtypes[w],
+                                     dataRange=dataRanges[w],
+                                     compresslevel=compresslevel,
+                                     numThreads=numThreads) as writer:
+                for start in range(0, spool.shape[3], framesPerChunk):
+                    writer.write(spool[...,start:start+framesPerChunk])
+
+    summaries = []
+    for w, (sliceObj, windowImg) in enumerate(zip(sliceObjs, windowImgs)):
+        summary = {'startTime': windowImg.get_startTime(),
+                   'endTime': windowImg.get_endTime()}
+
+        if imgFiles is not None:
+            write_frameTiming(windowImg.frameStart, windowImg.frameEnd,
+                              timingFiles[w], time_unit=time_unit,
+                              sif_header=windowImg.sif_header,
+                              json_dict=windowImg.json_dict)
+
+        if means:
+            meanSums[w] /= delta[sliceObj].sum()
+            summary['mean'] = img.uncrop(meanSums[w], bbox)
+
+        if atlas is not None:
+            summary['tacs'], summary['counts'] = atlas._roi_means(
+                labelSums[:,sliceObj.start-startIndex:sliceObj.stop-startIndex],
+                rois)
+
+        summaries.append(summary)
+
+    return summaries
+
+def _remove_file(filename):
+    if os.path.exists(filename):
+        os.remove(filename)
+
+def write_ROI_TACs(csvfile, names, ROI_TACs, ROI_counts):
+    '''
+    Write ROI TACs to a spreadsheet, with rows corresponding to ROIs and
+    columns to time frames. The first column is populated with ROI names,
+    and the first row is a 0-indexed counter of time frame no. ROIs with no
+    voxels are left out.
+
+    Args:
+        csvfile (str): output csv file name
+        names (list of str): name of each ROI
+        ROI_TACs (numpy.ndarray): 2D matrix with one row per ROI and one
+                                  column per time frame
+        ROI_counts (numpy.ndarray): number of voxels in each ROI
+    '''
+    import csv
+
+    with open(csvfile, mode='w') as wf:
+        writer = csv.writer(wf, delimiter=',',
+                            quotechar='"', quoting=csv.QUOTE_MINIMAL)
+
+        row_content = ['ROI'] + list(range(ROI_TACs.shape[1]))
+        writer.writerow(row_content)
+
+        for name, ROI_stat, ROI_count in zip(names, ROI_TACs, ROI_counts):
+            if ROI_count>0:
+                row_content = [name] + ROI_stat.tolist()
+                writer.writerow(row_content)
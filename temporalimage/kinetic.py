@@ -0,0 +1,596 @@
+import numpy as np
+
+def _frame_weights(timeline, weights):
+    '''
+    Get the weight of each time frame for weighted least squares fits
+
+    Args:
+        timeline (temporalimage.FrameTimeline): frame timing
+        weights (str): { None, 'frameduration' }
+
+    Returns:
+        w (numpy.ndarray): weight of each time frame
+    '''
+    if weights is None:
+        return np.ones(len(timeline))
+    elif weights=='frameduration':
+        return timeline.duration / timeline.duration.sum()
+    else:
+        raise ValueError('Weights should be None or frameduration')
+
+def _frame_average_conv(timeline, refTAC, rates, samplesPerFrame=10):
+    '''
+    Compute the frame averages of the convolution of a reference TAC with
+    decaying exponentials, exp(-rate * t), for several rates.
+
+    The reference TAC is linearly interpolated between frame mid-times onto a
+    fine time grid (constant before the first and after the last mid-time),
+    each convolution is computed on this grid with a first order recursive
+    filter, and the result is averaged within each frame.
+
+    Args:
+        timeline (temporalimage.FrameTimeline): frame timing
+        refTAC (numpy.ndarray): reference TAC, one value per time frame
+        rates (numpy.ndarray): rates of the exponentials, in 1/min
+        samplesPerFrame (int): number of grid samples in the shortest frame
+
+    Returns:
+        conv (numpy.ndarray): 2D matrix with one row per time frame and one
+                              column per rate
+    '''
+    from scipy.signal import lfilter
+    from . import Quantity # via pint
+
+    toMinutes = Quantity(1, timeline.unit).to('min').magnitude
+    start = timeline.start * toMinutes
+    end = timeline.end * toMinutes
+    midTime = timeline.midTime * toMinutes
+
+    dt = (end - start).min() / samplesPerFrame
+    numSamples = int(np.ceil((end[-1] - start[0]) / dt))
+    t = start[0] + (np.arange(numSamples) + 0.5) * dt
+
+    refFine = np.interp(t, midTime, refTAC)
+
+    # grid samples outside of all frames (gaps) are not averaged
+    frameIndex = timeline.time_to_frame(Quantity(t / toMinutes, timeline.unit))
+    inFrame = frameIndex>=0
+    samplesInFrame = np.bincount(frameIndex[inFrame], minlength=len(timeline))
+
+    conv = np.empty((len(timeline), len(rates)))
+    for i, rate in enumerate(rates):
+        # y[n] = exp(-rate*dt) * y[n-1] + dt * x[n]
+        convFine = lfilter([dt], [1, -np.exp(-rate * dt)], refFine)
+        conv[:,i] = np.bincount(frameIndex[inFrame], weights=convFine[inFrame],
+                                minlength=len(timeline)) / samplesInFrame
+    return conv
+
+def srtm_basis(timeline, refTAC, k2aRange=(0.001, 1.0), numBasis=100):
+    '''
+    Compute the basis functions of the simplified reference tissue model
+    (SRTM) on a frame timeline (Gunn et al., NeuroImage 1997)
+
+    SRTM expresses the target TAC as
+        Ct = R1 * Cref + (k2 - R1 * k2a) * (Cref conv exp(-k2a * t)),
+    where k2a = k2 / DVR. For fixed k2a, this is linear in R1 and k2, so
+    the model is fit by linear least squares for each k2a on a grid.
+
+    Args:
+        timeline (temporalimage.FrameTimeline): frame timing
+        refTAC (numpy.ndarray): reference TAC, one value per time frame
+        k2aRange (tuple): smallest and largest k2a (in 1/min); the grid is
+                          logarithmically spaced between these values
+        numBasis (int): number of basis functions
+
+    Returns:
+        k2a (numpy.ndarray): k2a of each basis function, in 1/min
+        basis (numpy.ndarray): 2D matrix with one row per time frame and one
+                               column per basis function
+    '''
+    if not 0<k2aRange[0]<=k2aRange[1]:
+        raise ValueError('k2a range should be positive and increasing')
+    if numBasis<1:
+        raise ValueError('There should be at least one basis function')
+
+    k2a = np.geomspace(k2aRange[0], k2aRange[1], numBasis)
+    return k2a, _frame_average_conv(timeline, refTAC, k2a)
+
+def fit_srtm(tacs, refTAC, k2a, basis, weights=None):
+    '''
+    Fit SRTM to many TACs at once using precomputed basis functions
+    (see srtm_basis)
+
+    For each basis function, the weighted least squares fit of all TACs is a
+    single matrix product; each TAC keeps the fit with the smallest residual
+    sum of squares.
+
+    Args:
+        tacs (numpy.ndarray): 2D matrix with one row per time frame and one
+                              column per TAC
+        refTAC (numpy.ndarray): reference TAC, one value per time frame
+        k2a (numpy.ndarray): k2a of each basis function, in 1/min
+        basis (numpy.ndarray): 2D matrix with one row per time frame and one
+                               column per basis function
+        weights (numpy.ndarray): weight of each time frame
+
+    Returns:
+        results (dict): R1, k2 (in 1/min), k2a (in 1/min), BPND and DVR of
+                        each TAC
+    '''
+    numFrames, numTACs = tacs.shape
+    if not len(refTAC)==numFrames or not basis.shape[0]==numFrames:
+        raise ValueError(('Reference TAC and basis functions should have one '
+                          'value per time frame'))
+
+    if weights is None:
+        weights = np.ones(numFrames)
+    sqrtw = np.sqrt(weights).astype(tacs.dtype)
+
+    y = tacs * sqrtw[:,np.newaxis]
+    yy = np.einsum('ij,ij->j', y, y)
+
+    bestRSS = np.full(numTACs, np.inf, dtype=tacs.dtype)
+    bestTheta = np.zeros((2, numTACs), dtype=tacs.dtype)
+    bestBasis = np.zeros(numTACs, dtype=int)
+
+    for i in range(len(k2a)):
+        A = np.column_stack((refTAC, basis[:,i])) * sqrtw[:,np.newaxis]
+        Q, R = np.linalg.qr(A.astype(tacs.dtype))
+
+        proj = Q.T @ y
+        rss = yy - np.einsum('ij,ij->j', proj, proj)
+
+        better = rss<bestRSS
+        if not better.any():
+            continue
+        bestRSS[better] = rss[better]
+        bestTheta[:,better] = np.linalg.pinv(R) @ proj[:,better]
+        bestBasis[better] = i
+
+    R1 = bestTheta[0]
+    k2a_best = k2a[bestBasis]
+    DVR = R1 + bestTheta[1] / k2a_best
+
+    return {'R1': R1,
+            'k2': bestTheta[1] + R1 * k2a_best,
+            'k2a': k2a_best.astype(tacs.dtype),
+            'BPND': DVR - 1,
+            'DVR': DVR}
+
+def running_integral(timeline, tacs):
+    '''
+    Compute the integrals of TACs from the start of the first frame up to the
+    mid-time of each frame, with a cumulative sum over frame durations.
+
+    Frame values are taken to be constant within each frame, and the TACs
+    are taken to be zero before the first frame and during gaps between
+    frames.
+
+    Args:
+        timeline (temporalimage.FrameTimeline): frame timing
+        tacs (numpy.ndarray): TAC (one value per time frame), or 2D matrix with
+                              one row per time frame and one column per TAC
+
+    Returns:
+        integral (numpy.ndarray): running integrals, with the same shape as
+                                  tacs, in units of the TACs times minutes
+    '''
+    from . import Quantity # via pint
+
+    duration = timeline.duration * Quantity(1, timeline.unit).to('min').magnitude
+    if tacs.ndim>1:
+        duration = duration.reshape((-1,) + (1,)*(tacs.ndim-1))
+
+    area = tacs * duration
+    return np.cumsum(area, axis=0) - area / 2
+
+def _linear_regression(x, y, weights):
+    '''
+    Weighted least squares regression of y on x, separately for each column
+
+    Args:
+        x (numpy.ndarray): 2D matrix of regressors, one column per regression
+        y (numpy.ndarray): 2D matrix of responses, one column per regression
+        weights (numpy.ndarray): weight of each row
+
+    Returns:
+        slope (numpy.ndarray): slope of each regression
+        intercept (numpy.ndarray): intercept of each regression
+    '''
+    w = (weights / weights.sum()).reshape((-1, 1))
+    xMean = (w * x).sum(axis=0)
+    yMean = (w * y).sum(axis=0)
+    xc = x - xMean
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (w * xc * (y - yMean)).sum(axis=0) / (w * xc * xc).sum(axis=0)
+    return slope, yMean - slope * xMean
+
+def _graphical_frames(timeline, tStar):
+    '''
+    Find the first frame of the linear phase of a graphical analysis
+
+    Args:
+        timeline (temporalimage.FrameTimeline): frame timing
+        tStar (temporalimage.Quantity): time after which the plot is linear
+
+    Returns:
+        startIndex (int): first frame that starts at or after tStar
+    '''
+    startIndex = int(timeline._first_index(timeline.start,
+                                           timeline.to_magnitude(tStar),
+                                           inclusive=True))
+    if len(timeline) - startIndex < 2:
+        raise ValueError(('At least two time frames should start at or after '
+                          't* for graphical analysis'))
+    return startIndex
+
+def fit_logan(tacs, refTAC, timeline, tStar, k2prime=None, weights=None):
+    '''
+    Estimate DVR for many TACs at once with the reference region Logan plot
+    (Logan et al., J Cereb Blood Flow Metab 1996):
+        int(Ct)/Ct = DVR * (int(Cref) + Cref/k2prime)/Ct + intercept
+    for frames that start at or after tStar.
+
+    Args:
+        tacs (numpy.ndarray): 2D matrix with one row per time frame and one
+                              column per TAC
+        refTAC (numpy.ndarray): reference TAC, one value per time frame
+        timeline (temporalimage.FrameTimeline): frame timing
+        tStar (temporalimage.Quantity): time after which the plot is linear
+        k2prime (float): reference region efflux rate constant (in 1/min).
+                         If None, the Cref/k2prime term is omitted.
+        weights (numpy.ndarray): weight of each time frame
+
+    Returns:
+        results (dict): DVR, BPND and intercept of each TAC
+    '''
+    startIndex = _graphical_frames(timeline, tStar)
+    if weights is None:
+        weights = np.ones(len(timeline))
+
+    refIntegral = running_integral(timeline, refTAC)
+    if k2prime is not None:
+        refIntegral = refIntegral + refTAC / k2prime
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        y = running_integral(timeline, tacs)[startIndex:] / tacs[startIndex:]
+        x = refIntegral[startIndex:,np.newaxis] / tacs[startIndex:]
+
+    DVR, intercept = _linear_regression(x, y, weights[startIndex:])
+
+    return {'DVR': DVR,
+            'BPND': DVR - 1,
+            'intercept': intercept}
+
+def fit_patlak(tacs, inputTAC, timeline, tStar, weights=None):
+    '''
+    Estimate the net influx rate Ki for many TACs at once with the Patlak plot
+    (Patlak et al., J Cereb Blood Flow Metab 1983):
+        Ct/Cin = Ki * int(Cin)/Cin + intercept
+    for frames that start at or after tStar, where the input Cin is either
+    a plasma input function or a reference region TAC.
+
+    Args:
+        tacs (numpy.ndarray): 2D matrix with one row per time frame and one
+                              column per TAC
+        inputTAC (numpy.ndarray): input TAC, one value per time frame
+        timeline (temporalimage.FrameTimeline): frame timing
+        tStar (temporalimage.Quantity): time after which the plot is linear
+        weights (numpy.ndarray): weight of each time frame
+
+    Returns:
+        results (dict): Ki (in 1/min) and intercept of each TAC
+    '''
+    startIndex = _graphical_frames(timeline, tStar)
+    if weights is None:
+        weights = np.ones(len(timeline))
+
+    inputIntegral = running_integral(timeline, inputTAC)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = np.broadcast_to((inputIntegral / inputTAC)[startIndex:,np.newaxis],
+                            tacs[startIndex:].shape)
+        y = tacs[startIndex:] / inputTAC[startIndex:,np.newaxis]
+
+    Ki, intercept = _linear_regression(x, y, weights[startIndex:])
+
+    return {'Ki': Ki,
+            'intercept': intercept}
+
+class VoxelwiseModels(object):
+    '''
+    Voxelwise kinetic modeling methods shared by temporal images
+
+    Classes using these methods provide the frame timing as a timeline
+    attribute (temporalimage.FrameTimeline), an in_memory attribute (whether
+    the image data are in memory), as well as get_numFrames,
+    get_computeDtype, _grid_shape (shape of the 3D images), _mask_voxels
+    (flat C order indices of the voxels in a 3D mask) and _voxel_tacs (TACs
+    of voxels, given their flat indices, optionally reading the image data
+    in chunks of at most memoryLimit bytes and writing the TACs into out).
+    '''
+
+    def _iter_voxel_chunks(self, mask=None, memoryLimit=None):
+        '''
+        Iterate over the time activity curves (TACs) of the voxels in a mask,
+        in chunks of voxels
+
+        If memoryLimit is specified and the TACs do not fit in a single chunk,
+        image data that are not in memory are read once, in chunks of at most
+        memoryLimit bytes of time frames, and the TACs of all voxels in the
+        mask are gathered into a temporary voxel by frame file, from which the
+        chunks of voxels are then read. Memory use thus stays bounded by about
+        twice memoryLimit (plus the fit results), and the image data are not
+        read (or decompressed) again for each chunk of voxels.
+
+        Args:
+            mask (numpy.ndarray): 3D mask data matrix consisting of bool.
+                                  If None, all voxels are included.
+            memoryLimit (int): maximum number of bytes of TAC data (in the
+                               compute data type) in each chunk, and of image
+                               data read at once. At least one voxel (and one
+                               time frame) is always included. If None, all
+                               voxels are in a single chunk, and all data are
+                               loaded.
+
+        Yields:
+            voxelIndex (numpy.ndarray): flat (C order) indices of the voxels
+                                        in the chunk
+            tacs (numpy.ndarray): 2D matrix with one row per time frame and
+                                  one column per voxel in the chunk
+        '''
+        import os
+        import tempfile
+
+        numFrames = self.get_numFrames()
+        computeDtype = self.get_computeDtype()
+        voxelIndex = self._mask_voxels(mask)
+
+        if memoryLimit is None:
+            voxelsPerChunk = max(1, len(voxelIndex))
+        else:
+            voxelsPerChunk = int(max(1, memoryLimit //
+                                        (numFrames * computeDtype.itemsize)))
+
+        if self.in_memory or len(voxelIndex)<=voxelsPerChunk:
+            for start in range(0, len(voxelIndex), voxelsPerChunk):
+                chunkIndex = voxelIndex[start:start+voxelsPerChunk]
+                yield chunkIndex, np.ascontiguousarray(
+                                      self._voxel_tacs(chunkIndex,
+                                                       memoryLimit).T)
+            return
+
+        fd, spoolname = tempfile.mkstemp(suffix='.npy')
+        os.close(fd)
+        tacs = None
+        try:
+            tacs = np.lib.format.open_memmap(spoolname, mode='w+',
+                                             dtype=computeDtype,
+                                             shape=(len(voxelIndex), numFrames))
+            self._voxel_tacs(voxelIndex, memoryLimit, out=tacs)
+            for start in range(0, len(voxelIndex), voxelsPerChunk):
+                yield voxelIndex[start:start+voxelsPerChunk], \
+                      np.ascontiguousarray(tacs[start:start+voxelsPerChunk].T)
+        finally:
+            # the file must be unmapped before it can be removed on Windows
+            tacs = None
+            os.remove(spoolname)
+
+    def srtm(self, refTAC, mask=None, weights='frameduration',
+             k2aRange=(0.001, 1.0), numBasis=100, memoryLimit=None):
+        '''
+        Compute parametric images of the simplified reference tissue model
+        (SRTM) with the basis function method (see kinetic.srtm_basis).
+
+        The basis functions are computed once on the frame timeline, and the
+        voxels are fit in chunks with batched linear least squares.
+
+        Args:
+            refTAC (numpy.ndarray): reference region TAC, one value per time
+                                    frame (e.g., from roi_timeseries)
+            mask (numpy.ndarray): 3D mask data matrix consisting of bool.
+                                  Voxels outside the mask are NaN in the
+                                  parametric images. If None, all voxels are
+                                  fit.
+            weights (str): { None, 'frameduration' }
+                If weights=='frameduration', each frame is weighted
+                proportionally to its duration.
+            k2aRange (tuple): smallest and largest k2a = k2/DVR (in 1/min)
+            numBasis (int): number of basis functions
+            memoryLimit (int): maximum number of bytes of TAC data to fit,
+                               and of image data to read, at once
+                               (see _iter_voxel_chunks).
+                               If None, all voxels are fit at once.
+
+        Returns:
+            results (dict): 3D parametric images R1, k2 (in 1/min),
+                            k2a (in 1/min), BPND and DVR
+        '''
+        refTAC = self._check_inputTAC(refTAC)
+
+        k2a, basis = srtm_basis(self.timeline, refTAC, k2aRange, numBasis)
+        w = _frame_weights(self.timeline, weights)
+
+        return self._voxelwise_maps(
+                    lambda tacs: fit_srtm(tacs, refTAC, k2a, basis, w),
+                    mask, memoryLimit)
+
+    def _check_inputTAC(self, inputTAC):
+        ''' Validate an input TAC for kinetic modeling
+        '''
+        inputTAC = np.asarray(inputTAC, dtype=np.float64)
+        if not inputTAC.shape==(self.get_numFrames(),):
+            raise ValueError(('Input TAC should have one value per time '
+                              'frame'))
+        return inputTAC
+
+    def _voxelwise_maps(self, fit, mask=None, memoryLimit=None):
+        '''
+        Apply a voxelwise model fit in chunks of voxels and assemble the
+        resulting parametric images
+
+        Args:
+            fit (callable): function that takes a 2D matrix of TACs (one row
+                            per time frame, one column per voxel) and returns a
+                            dict of parameter values, one per voxel
+            mask (numpy.ndarray): 3D mask data matrix consisting of bool.
+                                  Voxels outside the mask are NaN.
+            memoryLimit (int): maximum number of bytes of TAC data to fit,
+                               and of image data to read, at once
+                               (see _iter_voxel_chunks)
+
+        Returns:
+            results (dict): 3D parametric images
+        '''
+        results = {}
+        for voxelIndex, tacs in self._iter_voxel_chunks(mask, memoryLimit):
+            self._fill_maps(results, voxelIndex, fit(tacs), tacs.dtype)
+
+        return {name: values.reshape(self._grid_shape())
+                for name, values in results.items()}
+
+    def _fill_maps(self, maps, voxelIndex, results, dtype):
+        '''
+        Write the fit results of some voxels into flat parametric images,
+        creating the images (filled with NaN) as needed
+        '''
+        for name, values in results.items():
+            if name not in maps:
+                maps[name] = np.full(int(np.prod(self._grid_shape())), np.nan,
+                                     dtype=np.promote_types(dtype, np.float32))
+            maps[name][voxelIndex] = values
+
+    def map_voxels(self, func, mask=None, args=(), kwargs={},
+                   numProcesses=None, chunkSize=1024, progress=None,
+                   seed=None, memoryLimit=None):
+        '''
+        Compute parametric images with a voxelwise model fit that is run on
+        chunks of voxels in parallel processes (see parallel.map_voxels), for
+        fits that cannot be vectorized across voxels (e.g., non-linear fits
+        or bootstrap).
+
+        The TACs of the voxels in the mask are written into shared memory
+        once, directly from the image data, so the image itself is never sent
+        to the worker processes and the TACs are not held in memory twice.
+        Voxels are split into chunks of chunkSize voxels in a fixed order, so
+        the results do not depend on the number of processes.
+
+        Args:
+            func (callable): module-level function that takes a 2D matrix of
+                             TACs (one row per time frame, one column per
+                             voxel), followed by args and kwargs, and returns
+                             a dict of parameter values, one per voxel
+            mask (numpy.ndarray): 3D mask data matrix consisting of bool.
+                                  Voxels outside the mask are NaN in the
+                                  parametric images. If None, all voxels are
+                                  fit.
+            args (tuple): additional positional arguments to func
+                          (e.g., a reference TAC and frame mid-times)
+            kwargs (dict): additional keyword arguments to func
+            numProcesses (int): number of worker processes. If None, the
+                                number of CPUs is used. If 1, voxels are fit
+                                in this process.
+            chunkSize (int): number of voxels per chunk
+            progress (callable or bool): function called with the number of
+                chunks done and the total number of chunks. If True, progress
+                is printed to stderr.
+            seed (int): if not None, func is also passed rng, a
+                numpy.random.Generator seeded with seed and the chunk index
+            memoryLimit (int): maximum number of bytes of image data to read
+                               at once while gathering the TACs. If None, all
+                               time frames are read at once.
+
+        Returns:
+            results (dict): 3D parametric images
+        '''
+        from .parallel import _map_voxels
+
+        voxelIndex = self._mask_voxels(mask)
+        computeDtype = self.get_computeDtype()
+
+        results = _map_voxels(func, (len(voxelIndex), self.get_numFrames()),
+                              computeDtype,
+                              lambda out: self._voxel_tacs(voxelIndex,
+                                                           memoryLimit, out),
+                              args=args, kwargs=kwargs,
+                              numProcesses=numProcesses, chunkSize=chunkSize,
+                              progress=progress, seed=seed)
+
+        maps = {}
+        self._fill_maps(maps, voxelIndex, results, computeDtype)
+        return {name: values.reshape(self._grid_shape())
+                for name, values in maps.items()}
+
+    def logan(self, refTAC, tStar, k2prime=None, mask=None, weights=None,
+              memoryLimit=None):
+        '''
+        Compute parametric DVR images with the reference region Logan plot
+        (see kinetic.fit_logan).
+
+        Running integrals of the TACs are computed with a cumulative sum over
+        the frames, and the regression of each voxel is solved in closed
+        form, in chunks of voxels.
+
+        Args:
+            refTAC (numpy.ndarray): reference region TAC, one value per time
+                                    frame (e.g., from roi_timeseries)
+            tStar (temporalimage.Quantity): time after which the plot is
+                linear; frames that start at or after tStar are used
+            k2prime (float): reference region efflux rate constant (in 1/min).
+                             If None, the Cref/k2prime term is omitted.
+            mask (numpy.ndarray): 3D mask data matrix consisting of bool.
+                                  Voxels outside the mask are NaN in the
+                                  parametric images. If None, all voxels are
+                                  fit.
+            weights (str): { None, 'frameduration' }
+                If weights=='frameduration', each frame is weighted
+                proportionally to its duration.
+            memoryLimit (int): maximum number of bytes of TAC data to fit,
+                               and of image data to read, at once
+                               (see _iter_voxel_chunks).
+                               If None, all voxels are fit at once.
+
+        Returns:
+            results (dict): 3D parametric images DVR, BPND and intercept
+        '''
+        refTAC = self._check_inputTAC(refTAC)
+        w = _frame_weights(self.timeline, weights)
+
+        return self._voxelwise_maps(
+                    lambda tacs: fit_logan(tacs, refTAC, self.timeline, tStar,
+                                           k2prime, w),
+                    mask, memoryLimit)
+
+    def patlak(self, inputTAC, tStar, mask=None, weights=None,
+               memoryLimit=None):
+        '''
+        Compute parametric net influx rate (Ki) images with the Patlak plot
+        (see kinetic.fit_patlak).
+
+        Args:
+            inputTAC (numpy.ndarray): plasma input function or reference region
+                                      TAC, one value per time frame
+            tStar (temporalimage.Quantity): time after which the plot is
+                linear; frames that start at or after tStar are used
+            mask (numpy.ndarray): 3D mask data matrix consisting of bool.
+                                  Voxels outside the mask are NaN in the
+                                  parametric images. If None, all voxels are
+                                  fit.
+            weights (str): { None, 'frameduration' }
+                If weights=='frameduration', each frame is weighted
+                proportionally to its duration.
+            memoryLimit (int): maximum number of bytes of TAC data to fit,
+                               and of image data to read, at once
+                               (see _iter_voxel_chunks).
+                               If None, all voxels are fit at once.
+
+        Returns:
+            results (dict): 3D parametric images Ki (in 1/min) and intercept
+        '''
+        inputTAC = self._check_inputTAC(inputTAC)
+        w = _frame_weights(self.timeline, weights)
+
+        return self._voxelwise_maps(
+                    lambda tacs: fit_patlak(tacs, inputTAC, self.timeline,
+                                            tStar, w),
+                    mask, memoryLimit)
@@ -0,0 +1,362 @@
+import numpy as np
+from .kinetic import VoxelwiseModels
+
+class MaskedTemporalImage(VoxelwiseModels):
+    '''
+    Compact representation of the voxels of a 4D temporal image within a mask
+
+    Only the in-mask voxels are stored, as a contiguous matrix with one row
+    per voxel and one column per time frame, along with the flat (C order)
+    indices of these voxels in the 3D image grid. Results computed on the
+    in-mask voxels can be scattered back to 3D with unmask.
+
+    Masked temporal images are usually created with TemporalImage.masked.
+
+    Args:
+        data (numpy.ndarray): 2D matrix with one row per in-mask voxel and
+                              one column per time frame
+        voxelIndex (numpy.ndarray): increasing flat (C order) indices of the
+                                    in-mask voxels in the 3D image grid
+        gridShape (tuple): shape of the 3D images
+        affine (numpy.ndarray): 4-by-4 affine array relating array coordinates
+                                from the 3D image grid to coordinates in some
+                                RAS+ world coordinate system
+        timeline (temporalimage.FrameTimeline): frame timing
+        header (nibabel.nifti1.Nifti1Header): header with image metadata
+        sif_header (str): First row of Scan Information File (SIF)
+        json_dict (dict): PET-BIDS json dictionary
+    '''
+
+    def __init__(self, data, voxelIndex, gridShape, affine, timeline,
+                 header=None, sif_header='', json_dict={}):
+        data = np.asanyarray(data)
+        voxelIndex = np.asarray(voxelIndex, dtype=np.intp)
+        gridShape = tuple(gridShape)
+
+        if not len(gridShape)==3:
+            raise ValueError('Image grid must be 3D')
+        if not data.ndim==2:
+            raise ValueError('Data must be a voxel by frame matrix')
+        if not data.shape[0]==len(voxelIndex):
+            raise ValueError(('Number of rows of data must match the number of '
+                              'voxel indices'))
+        if not data.shape[1]==len(timeline):
+            raise ValueError(('Number of columns of data must match the number '
+                              'of time frames'))
+        if np.any(np.diff(voxelIndex)<=0) or \
+           (len(voxelIndex)>0 and
+            not 0<=voxelIndex[0]<=voxelIndex[-1]<np.prod(gridShape)):
+            raise ValueError(('Voxel indices must be increasing and within the '
+                              'image grid'))
+
+        self.data = data
+        self.voxelIndex = voxelIndex
+        self.gridShape = gridShape
+        self.affine = affine
+        self.timeline = timeline
+        self.header = header
+        self.sif_header = sif_header
+        self.json_dict = json_dict
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def get_mask(self):
+        ''' Get the 3D mask of the voxels in the image
+        '''
+        mask = np.zeros(self.gridShape, dtype=bool)
+        mask.flat[self.voxelIndex] = True
+        return mask
+
+    def get_computeDtype(self):
+        ''' Get the floating point data type of the image data
+        '''
+        return self.data.dtype
+
+    def get_numFrames(self):
+        ''' Get number of time frames
+        '''
+        return self.data.shape[1]
+
+    def get_numVoxels(self):
+        ''' Get number of voxels in the mask
+        '''
+        return self.data.shape[0]
+
+    @property
+    def in_memory(self):
+        ''' The data of a masked temporal image are always in memory
+        '''
+        return True
+
+    @property
+    def frameStart(self):
+        return self.timeline.get_frameStart()
+
+    @property
+    def frameEnd(self):
+        return self.timeline.get_frameEnd()
+
+    def get_frameStart(self):
+        ''' Get the array of starting times for each frame
+        '''
+        return self.timeline.get_frameStart()
+
+    def get_frameEnd(self):
+        ''' Get the array of ending times for each frame
+        '''
+        return self.timeline.get_frameEnd()
+
+    def get_startTime(self):
+        ''' Get the starting time of first frame
+        '''
+        return self.frameStart[0]
+
+    def get_endTime(self):
+        ''' Get the ending time of last frame
+        '''
+        return self.frameEnd[-1]
+
+    def get_frameDuration(self):
+        ''' Get the array of durations for each frame
+        '''
+        return self.timeline.get_frameDuration()
+
+    def get_midTime(self):
+        ''' Get the array of mid-time point for each frame
+        '''
+        return self.timeline.get_midTime()
+
+    def _slice_frames(self, sliceObj):
+        return MaskedTemporalImage(self.data[:,sliceObj], self.voxelIndex,
+                                   self.gridShape, self.affine,
+                                   self.timeline[sliceObj], self.header,
+                                   sif_header=self.sif_header,
+                                   json_dict=self.json_dict)
+
+    def extractTime(self, startTime, endTime):
+        '''
+        Extract a masked temporal image from a longer-duration one
+        (see TemporalImage.extractTime). The extracted image is a view into
+        the data of this image.
+
+        Args:
+            startTime (temporalimage.Quantity): time at which to begin, inclusive
+            endTime (temporalimage.Quantity): time at which to stop, exclusive
+
+        Returns:
+            extractedImg (temporalimage.MaskedTemporalImage): extracted image
+        '''
+        return self._slice_frames(self.timeline.resolve_window(startTime,
+                                                               endTime))
+
+    def extractTimes(self, windows):
+        '''
+        Extract several masked temporal images, one per time window
+        (see extractTime)
+
+        Args:
+            windows (list): list of (startTime, endTime) pairs
+
+        Returns:
+            extractedImgs (list): extracted images, in the order of the windows
+        '''
+        return [self.extractTime(startTime, endTime)
+                for startTime, endTime in windows]
+
+    def splitTime(self, splitTime):
+        '''
+        Split the masked temporal image into two (see TemporalImage.splitTime)
+
+        Args:
+            splitTime (temporalimage.Quantity): time at which to split
+
+        Returns:
+            firstImg (temporalimage.MaskedTemporalImage): first of the two
+                split images (doesn't include splitTime)
+            secondImg (temporalimage.MaskedTemporalImage): second of the two
+                split images (includes splitTime)
+        '''
+        firstImg = self.extractTime(self.frameStart[0], splitTime)
+        if firstImg.get_numFrames()==self.get_numFrames():
+            raise ValueError(('Start time for the second of the split images '
+                              'is beyond the time covered by the time series data!'))
+
+        secondImg = self._slice_frames(slice(firstImg.get_numFrames(),
+                                             self.get_numFrames()))
+        return firstImg, secondImg
+
+    def _grid_shape(self):
+        return self.gridShape
+
+    def _mask_voxels(self, mask=None):
+        '''
+        Get the flat (C order) indices of the voxels of this image that are
+        within a 3D mask
+
+        Args:
+            mask (numpy.ndarray): 3D mask data matrix consisting of bool.
+                                  If None, all voxels are included.
+
+        Returns:
+            voxelIndex (numpy.ndarray): indices of the voxels in both masks
+        '''
+        if mask is None:
+            return self.voxelIndex
+
+        mask = np.asanyarray(mask).astype(bool)
+        if not self.gridShape==mask.shape:
+            raise ValueError(('Mask is not of the same size as the 3D '
+                              'images in temporal image!'))
+        return self.voxelIndex[mask.flat[self.voxelIndex]]
+
+    def _voxel_tacs(self, voxelIndex, memoryLimit=None, out=None):
+        '''
+        Get the TACs of some of the voxels of this image
+
+        Args:
+            voxelIndex (numpy.ndarray): flat (C order) voxel indices, which
+                                        must be in the mask of this image
+                                        (see _in_image)
+            memoryLimit (int): ignored, since the data are in memory
+            out (numpy.ndarray): matrix to write the TACs into
+
+        Returns:
+            tacs (numpy.ndarray): 2D matrix with one row per voxel and one
+                                  column per time frame
+        '''
+        if voxelIndex is self.voxelIndex:
+            tacs = self.data
+        else:
+            inMask, positions = self._find_voxels(voxelIndex)
+            if not inMask.all():
+                raise ValueError(('Voxels must be within the mask of the '
+                                  'masked image'))
+            if out is not None:
+                return np.take(self.data, positions, axis=0, out=out)
+            tacs = self.data[positions]
+
+        if out is None:
+            return tacs
+        out[...] = tacs
+        return out
+
+    def _find_voxels(self, voxelIndex):
+        '''
+        Find voxels in the mask of this image
+
+        Args:
+            voxelIndex (numpy.ndarray): flat (C order) voxel indices
+
+        Returns:
+            inMask (numpy.ndarray): whether each voxel is in the mask
+            positions (numpy.ndarray): rows of data holding the TACs of the
+                                       voxels (only valid where inMask)
+        '''
+        voxelIndex = np.asarray(voxelIndex)
+        positions = np.searchsorted(self.voxelIndex, voxelIndex)
+        inMask = positions<len(self.voxelIndex)
+        inMask[inMask] = self.voxelIndex[positions[inMask]]==voxelIndex[inMask]
+        return inMask, positions
+
+    def _in_image(self, voxelIndex):
+        ''' Check which voxels have TACs in this image (i.e., are in the mask)
+        '''
+        return self._find_voxels(voxelIndex)[0]
+
+    def roi_timeseries(self, maskfile=None, mask=None):
+        '''
+        Get the mean time activity curve (TAC) within a region of interest
+        (ROI). Only the voxels of the ROI that are within the mask of this
+        image are included.
+
+        Args:
+            maskfile (str): mask file name
+                            (mutually exclusive argument: mask)
+            mask (numpy.ndarray): 3D mask data matrix consisting of bool
+                                  (mutually exclusive argument: maskfile)
+
+        Returns:
+            timeseries (numpy.ndarray): mean time activity curve within mask
+        '''
+        # Either mask or maskfile must be specified, not both
+        if not (mask is None) ^ (maskfile is None):
+            raise TypeError('Either mask or maskfile must be specified')
+
+        if mask is None:
+            from nibabel import load as nibload
+            mask = nibload(maskfile).get_fdata()
+
+        mask = np.asanyarray(mask)
+        if not mask.ndim==3:
+            raise ValueError('Mask must be 3D')
+
+        voxelIndex = self._mask_voxels(mask)
+        if len(voxelIndex)<1:
+            raise ValueError(('Mask should include as least one >0 voxel '
+                              'within the mask of the masked image'))
+
+        return np.mean(self._voxel_tacs(voxelIndex), axis=0)
+
+    def dynamic_mean(self, weights=None):
+        '''
+        Compute the weighted dynamic mean of the in-mask voxels
+        (see TemporalImage.dynamic_mean)
+
+        Args:
+            weights (str): { None, 'frameduration' }
+                If weights=='frameduration', each frame is weighted
+                proportionally to its duration (inverse variance weighting).
+
+        Returns:
+            dyn_mean (numpy.ndarray): 3D matrix, NaN outside the mask
+        '''
+        if weights is None:
+            delta = None
+        elif weights=='frameduration':
+            delta = self.timeline.duration.astype(self.data.dtype)
+        else:
+            raise ValueError('Weights should be None or frameduration')
+
+        return self.unmask(np.average(self.data, axis=1, weights=delta))
+
+    def unmask(self, values, fill=np.nan):
+        '''
+        Scatter values of the in-mask voxels back to the 3D image grid
+
+        Args:
+            values (numpy.ndarray): one value per in-mask voxel, or 2D matrix
+                                    with one row per in-mask voxel
+            fill (float): value outside the mask
+
+        Returns:
+            unmasked (numpy.ndarray): 3D matrix, or 4D if values is 2D
+        '''
+        values = np.asanyarray(values)
+        if not values.shape[0]==self.get_numVoxels():
+            raise ValueError('There should be one value per in-mask voxel')
+
+        dtype = np.result_type(values, fill)
+
+        unmasked = np.full((int(np.prod(self.gridShape)),) + values.shape[1:],
+                           fill, dtype=dtype)
+        unmasked[self.voxelIndex] = values
+        return unmasked.reshape(self.gridShape + values.shape[1:])
+
+    def to_image(self, fill=0):
+        '''
+        Convert to a temporal image on the full 3D image grid
+
+        Args:
+            fill (float): value of the voxels outside the mask
+
+        Returns:
+            img (temporalimage.TemporalImage): 4D temporal image
+        '''
+        from .t4d import TemporalImage
+
+        return TemporalImage(self.unmask(self.data, fill=fill), self.affine,
+                             self.frameStart, self.frameEnd, self.header,
+                             sif_header=self.sif_header,
+                             json_dict=self.json_dict)
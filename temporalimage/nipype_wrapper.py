@@ -7,9 +7,48 @@ from nipype.utils.filemanip import split_filename
 
 from .t4d import load as ti_load
 from .t4d import save as ti_save
+from .fused import write_ROI_TACs
 from . import unitreg, Quantity
 
-class ExtractTimeSeriesInputSpec(BaseInterfaceInputSpec):
+class OutputEncodingInputSpec(BaseInterfaceInputSpec):
+    compressOutput = traits.Bool(True, usedefault=True,
+                                 desc=('gzip-compress output images (.nii.gz); '
+                                       'if False, uncompressed .nii images are '
+                                       'written, which is faster for '
+                                       'intermediate files'))
+    compressLevel = traits.Range(low=0, high=9, value=1, usedefault=True,
+                                 desc='gzip compression level of output images')
+    outputDtype = traits.Enum('float32', 'float64', 'int16', mandatory=False,
+                              desc=('on-disk data type of output images; int16 '
+                                    'images are scaled to the int16 range. If '
+                                    'not specified, the data type of the input '
+                                    'image is used.'))
+
+def _image_ext(inputs):
+    ''' Get the output image file extension chosen by the interface inputs
+    '''
+    return '.nii.gz' if inputs.compressOutput else '.nii'
+
+def _save_kwargs(inputs):
+    ''' Get the temporalimage.save arguments chosen by the interface inputs
+    '''
+    return {'dtype': inputs.outputDtype if isdefined(inputs.outputDtype)
+                     else None,
+            'compresslevel': inputs.compressLevel}
+
+def _save_mean(meanImg_dat, ti, filename, inputs):
+    '''
+    Save a 3D mean image in the space of a temporal image, with the output
+    encoding chosen by the interface inputs
+    '''
+    from .writer import save_image
+
+    meanImg = nib.Nifti1Image(np.squeeze(meanImg_dat), ti.affine, ti.header)
+    if isdefined(inputs.outputDtype):
+        meanImg.set_data_dtype(inputs.outputDtype)
+    save_image(meanImg, filename, compresslevel=inputs.compressLevel)
+
+class ExtractTimeSeriesInputSpec(OutputEncodingInputSpec):
     timeSeriesImgFile = File(exists=True, mandatory=True,
                              desc='4D image file to be split')
     frameTimingFile = File(exists=True, mandatory=True,
@@ -21,6 +60,9 @@ class ExtractTimeSeriesInputSpec(BaseInterfaceInputSpec):
     endTime = traits.Float(mandatory=True,
                            desc=('minute into the time series image at which '
                                  'to stop, exclusive'))
+    computeDtype = traits.Enum('float64', 'float32', 'native', mandatory=False,
+                               desc=('floating point data type used for '
+                                     'computations'))
 
 class ExtractTimeSeriesOutputSpec(TraitedSpec):
     imgFile = File(exists=True,desc=('first of the two split images '
@@ -47,17 +89,24 @@ class ExtractTimeSeries(BaseInterface):
 
         _, base, _ = split_filename(timeSeriesImgFile)
 
-        ti = ti_load(timeSeriesImgFile, frameTimingFile)
+        if isdefined(self.inputs.computeDtype):
+            computeDtype = self.inputs.computeDtype
+        else:
+            computeDtype = None
+
+        ti = ti_load(timeSeriesImgFile, frameTimingFile,
+                     computeDtype=computeDtype)
         img = ti.extractTime(startTime, endTime)
 
         self.modStartTime = img.get_startTime().to('minute').magnitude
         self.modEndTime = img.get_endTime().to('minute').magnitude
 
         imgFile = base+'_'+'{:02.2f}'.format(self.modStartTime)+'to'+ \
-                                '{:02.2f}'.format(self.modEndTime)+'min.nii.gz'
+                      '{:02.2f}'.format(self.modEndTime)+'min'+ \
+                      _image_ext(self.inputs)
         timingFile = base+'_'+'{:02.2f}'.format(self.modStartTime)+'to'+ \
                                    '{:02.2f}'.format(self.modEndTime)+'.csv'
-        ti_save(img, imgFile, timingFile)
+        ti_save(img, imgFile, timingFile, **_save_kwargs(self.inputs))
 
         return runtime
 
@@ -70,7 +119,8 @@ class ExtractTimeSeries(BaseInterface):
         outputs['endTime'] = self.modEndTime
         outputs['imgFile'] = os.path.abspath(base+'_'+ \
                                '{:02.2f}'.format(self.modStartTime)+'to'+ \
-                               '{:02.2f}'.format(self.modEndTime)+'min.nii.gz')
+                               '{:02.2f}'.format(self.modEndTime)+'min'+ \
+                               _image_ext(self.inputs))
 
         outputs['timingFile'] = os.path.abspath(base+'_'+ \
                                     '{:02.2f}'.format(self.modStartTime)+'to'+ \
@@ -78,7 +128,197 @@ class ExtractTimeSeries(BaseInterface):
         return outputs
 
 
-class SplitTimeSeriesInputSpec(BaseInterfaceInputSpec):
+class ExtractTimeWindowsInputSpec(OutputEncodingInputSpec):
+    timeSeriesImgFile = File(exists=True, mandatory=True,
+                             desc='4D image file to extract time windows from')
+    frameTimingFile = File(exists=True, mandatory=True,
+                           desc=('csv, sif, or json file listing the duration '
+                                 'of each time frame in the 4D image'))
+    startTimes = traits.List(traits.Float(), minlen=1, mandatory=True,
+                             desc=('minutes into the time series image at which '
+                                   'each window begins, inclusive'))
+    endTimes = traits.List(traits.Float(), minlen=1, mandatory=True,
+                           desc=('minutes into the time series image at which '
+                                 'each window ends, exclusive'))
+    saveImages = traits.Bool(True, usedefault=True,
+                             desc='save the 4D image of each window')
+    dynamicMean = traits.Bool(False, usedefault=True,
+                              desc='save the 3D mean image of each window')
+    weights = traits.Enum(None, 'frameduration', mandatory=False,
+                          desc='one of: None, frameduration')
+    memoryLimit = traits.Int(mandatory=False,
+                             desc=('maximum number of bytes of image data to '
+                                   'read at once'))
+    maskFile = File(exists=True, mandatory=False,
+                    desc=('mask image; means are only computed within its '
+                          'bounding box, and are 0 outside of it'))
+    labelImgFile = File(exists=True, mandatory=False,
+                        desc=('label image; if specified, ROI TACs of each '
+                              'window are written to a spreadsheet'))
+    atlasIndexFile = File(desc=('npz file in which the voxel index of each '
+                                'label of the label image is cached'))
+    ROI_list = traits.List(traits.Int(), minlen=1,
+                           desc=("list of ROI indices for which TACs will be "
+                                 "computed (should match the label indices in "
+                                 "the label image)"))
+    ROI_names = traits.List(traits.String(), minlen=1,
+                            desc=("list of equal size to ROI_list that lists "
+                                  "the corresponding ROI names"))
+    additionalROIs = traits.List(traits.List(traits.Int()),
+                                 desc='list of lists of integers')
+    additionalROI_names = traits.List(traits.String(),
+                                      desc='names corresponding to additional ROIs')
+    computeDtype = traits.Enum('float64', 'float32', 'native', mandatory=False,
+                               desc=('floating point data type used for '
+                                     'computations'))
+
+class ExtractTimeWindowsOutputSpec(TraitedSpec):
+    imgFiles = traits.List(File(exists=True),
+                           desc='4D image of each window (if saveImages)')
+    timingFiles = traits.List(File(exists=True),
+                              desc=('csv file listing the duration of each '
+                                    'time frame in each window (if saveImages)'))
+    meanImgFiles = traits.List(File(exists=True),
+                               desc='3D mean image of each window (if dynamicMean)')
+    csvFiles = traits.List(File(exists=True),
+                           desc='ROI TACs of each window (if labelImgFile)')
+    startTimes = traits.List(traits.Float(), desc='possibly modified start times')
+    endTimes = traits.List(traits.Float(), desc='possibly modified end times')
+
+class ExtractTimeWindows(BaseInterface):
+    '''
+    Extract several smaller 4D (time series/dynamic) images, and/or their 3D
+    means and ROI TACs, from a 4D image, reading its time frames once, in
+    chunks of at most memoryLimit bytes
+    (see temporalimage.fused.summarize_windows).
+
+    This replaces chained ExtractTimeSeries, DynamicMean, and
+    ROI_TACs_to_spreadsheet nodes, which each load the 4D image.
+    '''
+
+    input_spec = ExtractTimeWindowsInputSpec
+    output_spec = ExtractTimeWindowsOutputSpec
+
+    def _prefixes(self):
+        _, base, _ = split_filename(self.inputs.timeSeriesImgFile)
+        return [os.path.abspath(base+'_'+'{:02.2f}'.format(modStartTime)+'to'+
+                                '{:02.2f}'.format(modEndTime))
+                for modStartTime, modEndTime in zip(self.modStartTimes,
+                                                    self.modEndTimes)]
+
+    def _run_interface(self, runtime):
+        from .fused import summarize_windows
+
+        if not len(self.inputs.startTimes)==len(self.inputs.endTimes):
+            raise ValueError(('There should be equal number of window start '
+                              'and end times'))
+        windows = [(Quantity(startTime, 'minute'), Quantity(endTime, 'minute'))
+                   for startTime, endTime in zip(self.inputs.startTimes,
+                                                 self.inputs.endTimes)]
+
+        if isdefined(self.inputs.weights):
+            weights = self.inputs.weights
+        else:
+            weights = None
+
+        if isdefined(self.inputs.memoryLimit):
+            memoryLimit = self.inputs.memoryLimit
+        else:
+            memoryLimit = None
+
+        if isdefined(self.inputs.computeDtype):
+            computeDtype = self.inputs.computeDtype
+        else:
+            computeDtype = None
+
+        if isdefined(self.inputs.maskFile):
+            maskFile = self.inputs.maskFile
+        else:
+            maskFile = None
+
+        ti = ti_load(self.inputs.timeSeriesImgFile, self.inputs.frameTimingFile,
+                     computeDtype=computeDtype)
+
+        # resolve the windows first, to name the output files
+        sliceObjs = [ti._window_frames(startTime, endTime)
+                     for startTime, endTime in windows]
+        windows = [(ti.frameStart[sliceObj][0], ti.frameEnd[sliceObj][-1])
+                   for sliceObj in sliceObjs]
+        self.modStartTimes = [startTime.to('minute').magnitude
+                              for startTime, _ in windows]
+        self.modEndTimes = [endTime.to('minute').magnitude
+                            for _, endTime in windows]
+        prefixes = self._prefixes()
+        ext = _image_ext(self.inputs)
+
+        kwargs = {}
+        if self.inputs.saveImages:
+            kwargs['imgFiles'] = [prefix+'min'+ext for prefix in prefixes]
+            kwargs['timingFiles'] = [prefix+'.csv' for prefix in prefixes]
+
+        if isdefined(self.inputs.labelImgFile):
+            if not isdefined(self.inputs.ROI_list) or \
+               not isdefined(self.inputs.ROI_names) or \
+               not len(self.inputs.ROI_list)==len(self.inputs.ROI_names):
+                raise ValueError(('ROI_list and ROI_names of equal size must '
+                                  'be specified along with labelImgFile'))
+            if isdefined(self.inputs.additionalROIs):
+                additionalROIs = self.inputs.additionalROIs
+                additionalROI_names = self.inputs.additionalROI_names
+            else:
+                additionalROIs = []
+                additionalROI_names = []
+            if not len(additionalROIs)==len(additionalROI_names):
+                raise ValueError(('There should be one name per additional '
+                                  'ROI'))
+
+            if isdefined(self.inputs.atlasIndexFile):
+                from .atlas import AtlasIndex
+                kwargs['atlas'] = AtlasIndex.cached(self.inputs.labelImgFile,
+                                                    self.inputs.atlasIndexFile)
+            else:
+                kwargs['atlas'] = self.inputs.labelImgFile
+            kwargs['labels'] = self.inputs.ROI_list
+            kwargs['composites'] = additionalROIs
+
+        summaries = summarize_windows(ti, windows,
+                                      means=self.inputs.dynamicMean,
+                                      weights=weights, mask=maskFile,
+                                      memoryLimit=memoryLimit,
+                                      **kwargs, **_save_kwargs(self.inputs))
+
+        for prefix, summary in zip(prefixes, summaries):
+            if self.inputs.dynamicMean:
+                _save_mean(summary['mean'], ti, prefix+'min_mean'+ext,
+                           self.inputs)
+            if 'tacs' in summary:
+                write_ROI_TACs(prefix+'_ROI_TACs.csv',
+                               self.inputs.ROI_names + additionalROI_names,
+                               summary['tacs'], summary['counts'])
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+
+        outputs['startTimes'] = self.modStartTimes
+        outputs['endTimes'] = self.modEndTimes
+
+        prefixes = self._prefixes()
+        ext = _image_ext(self.inputs)
+        if self.inputs.saveImages:
+            outputs['imgFiles'] = [prefix+'min'+ext for prefix in prefixes]
+            outputs['timingFiles'] = [prefix+'.csv' for prefix in prefixes]
+        if self.inputs.dynamicMean:
+            outputs['meanImgFiles'] = [prefix+'min_mean'+ext
+                                       for prefix in prefixes]
+        if isdefined(self.inputs.labelImgFile):
+            outputs['csvFiles'] = [prefix+'_ROI_TACs.csv' for prefix in prefixes]
+
+        return outputs
+
+
+class SplitTimeSeriesInputSpec(OutputEncodingInputSpec):
     timeSeriesImgFile = File(exists=True, mandatory=True,
                              desc='4D image file to be split')
     frameTimingFile = File(exists=True, mandatory=True,
@@ -87,6 +327,9 @@ class SplitTimeSeriesInputSpec(BaseInterfaceInputSpec):
     splitTime = traits.Float(mandatory=True,
                              desc=('minute into the time series image at which '
                                    'to split the 4D image'))
+    computeDtype = traits.Enum('float64', 'float32', 'native', mandatory=False,
+                               desc=('floating point data type used for '
+                                     'computations'))
 
 class SplitTimeSeriesOutputSpec(TraitedSpec):
     firstImgFile = File(exists=True,desc=('first of the two split images '
@@ -115,7 +358,13 @@ class SplitTimeSeries(BaseInterface):
         splitTime = Quantity(self.inputs.splitTime, 'minute')
         _, base, _ = split_filename(timeSeriesImgFile)
 
-        ti = ti_load(timeSeriesImgFile, frameTimingFile)
+        if isdefined(self.inputs.computeDtype):
+            computeDtype = self.inputs.computeDtype
+        else:
+            computeDtype = None
+
+        ti = ti_load(timeSeriesImgFile, frameTimingFile,
+                     computeDtype=computeDtype)
         firstImg, secondImg = ti.splitTime(splitTime)
 
         self.firstImgStart = firstImg.get_startTime().to('minute').magnitude
@@ -123,17 +372,20 @@ class SplitTimeSeries(BaseInterface):
         self.secondImgStart = secondImg.get_startTime().to('minute').magnitude
         self.secondImgEnd = secondImg.get_endTime().to('minute').magnitude
 
+        ext = _image_ext(self.inputs)
         firstImgFile = base+'_'+'{:02.2f}'.format(self.firstImgStart)+'to'+ \
-                                '{:02.2f}'.format(self.firstImgEnd)+'min.nii.gz'
+                                '{:02.2f}'.format(self.firstImgEnd)+'min'+ext
         firstTimingFile = base+'_'+'{:02.2f}'.format(self.firstImgStart)+'to'+ \
                                    '{:02.2f}'.format(self.firstImgEnd)+'.csv'
-        ti_save(firstImg, firstImgFile, firstTimingFile)
+        ti_save(firstImg, firstImgFile, firstTimingFile,
+                **_save_kwargs(self.inputs))
 
         secondImgFile = base+'_'+'{:02.2f}'.format(self.secondImgStart)+'to'+ \
-                                 '{:02.2f}'.format(self.secondImgEnd)+'min.nii.gz'
+                                 '{:02.2f}'.format(self.secondImgEnd)+'min'+ext
         secondTimingFile = base+'_'+'{:02.2f}'.format(self.secondImgStart)+'to'+\
                                     '{:02.2f}'.format(self.secondImgEnd)+'.csv'
-        ti_save(secondImg, secondImgFile, secondTimingFile)
+        ti_save(secondImg, secondImgFile, secondTimingFile,
+                **_save_kwargs(self.inputs))
 
         return runtime
 
@@ -142,12 +394,13 @@ class SplitTimeSeries(BaseInterface):
         fname = self.inputs.timeSeriesImgFile
         _, base, _ = split_filename(fname)
 
+        ext = _image_ext(self.inputs)
         outputs['firstImgFile'] = os.path.abspath(base+'_'+ \
                                '{:02.2f}'.format(self.firstImgStart)+'to'+ \
-                               '{:02.2f}'.format(self.firstImgEnd)+'min.nii.gz')
+                               '{:02.2f}'.format(self.firstImgEnd)+'min'+ext)
         outputs['secondImgFile'] = os.path.abspath(base+'_'+ \
                               '{:02.2f}'.format(self.secondImgStart)+'to'+ \
-                              '{:02.2f}'.format(self.secondImgEnd)+'min.nii.gz')
+                              '{:02.2f}'.format(self.secondImgEnd)+'min'+ext)
 
         outputs['firstTimingFile'] = os.path.abspath(base+'_'+ \
                                      '{:02.2f}'.format(self.firstImgStart)+'to'+ \
@@ -161,7 +414,7 @@ class SplitTimeSeries(BaseInterface):
 
 
 
-class DynamicMeanInputSpec(BaseInterfaceInputSpec):
+class DynamicMeanInputSpec(OutputEncodingInputSpec):
     timeSeriesImgFile = File(exists=True, mandatory=True,
                              desc='4D image file to average temporally')
     frameTimingFile = File(exists=True, mandatory=True,
@@ -175,6 +428,15 @@ class DynamicMeanInputSpec(BaseInterfaceInputSpec):
                                  'to stop computing the mean image, exclusive'))
     weights = traits.Enum(None, 'frameduration', mandatory=False,
                           desc='one of: None, frameduration')
+    memoryLimit = traits.Int(mandatory=False,
+                             desc=('maximum number of bytes of image data to '
+                                   'read at once while computing the mean'))
+    maskFile = File(exists=True, mandatory=False,
+                    desc=('mask image; the mean is only computed within its '
+                          'bounding box, and is 0 outside of it'))
+    computeDtype = traits.Enum('float64', 'float32', 'native', mandatory=False,
+                               desc=('floating point data type used for '
+                                     'computations'))
 
 class DynamicMeanOutputSpec(TraitedSpec):
     meanImgFile = File(exists=True,
@@ -204,17 +466,35 @@ class DynamicMean(BaseInterface):
 
         _, base, _ = split_filename(timeSeriesImgFile)
 
-        ti = ti_load(timeSeriesImgFile, frameTimingFile)
+        if isdefined(self.inputs.computeDtype):
+            computeDtype = self.inputs.computeDtype
+        else:
+            computeDtype = None
+
+        ti = ti_load(timeSeriesImgFile, frameTimingFile,
+                     computeDtype=computeDtype)
         extractImg = ti.extractTime(startTime, endTime)
         self.modStartTime = extractImg.get_startTime().to('minute').magnitude
         self.modEndTime = extractImg.get_endTime().to('minute').magnitude
 
-        meanImg_dat = extractImg.dynamic_mean(weights=weights)
+        if isdefined(self.inputs.memoryLimit):
+            memoryLimit = self.inputs.memoryLimit
+        else:
+            memoryLimit = None
+
+        if isdefined(self.inputs.maskFile):
+            maskFile = self.inputs.maskFile
+        else:
+            maskFile = None
+
+        meanImg_dat = extractImg.dynamic_mean(weights=weights,
+                                              memoryLimit=memoryLimit,
+                                              mask=maskFile)
 
-        meanImg = nib.Nifti1Image(np.squeeze(meanImg_dat), ti.affine, ti.header)
         meanImgFile = base+'_'+'{:02.2f}'.format(self.modStartTime)+'to'+ \
-                               '{:02.2f}'.format(self.modEndTime)+'min_mean.nii.gz'
-        nib.save(meanImg,meanImgFile)
+                               '{:02.2f}'.format(self.modEndTime)+'min_mean'+ \
+                               _image_ext(self.inputs)
+        _save_mean(meanImg_dat, ti, meanImgFile, self.inputs)
 
         return runtime
 
@@ -227,7 +507,8 @@ class DynamicMean(BaseInterface):
         outputs['endTime'] = self.modEndTime
         outputs['meanImgFile'] = os.path.abspath(base+'_'+ \
                             '{:02.2f}'.format(self.modStartTime)+'to'+ \
-                            '{:02.2f}'.format(self.modEndTime)+'min_mean.nii.gz')
+                            '{:02.2f}'.format(self.modEndTime)+'min_mean'+ \
+                            _image_ext(self.inputs))
 
         return outputs
 
@@ -239,6 +520,10 @@ class ROI_TACs_to_spreadsheetInputSpec(BaseInterfaceInputSpec):
                                     'each time frame in the 4D image'))
 
     labelImgFile = File(exists=True, desc='Label image', mandatory=True)
+    atlasIndexFile = File(desc=('npz file in which the voxel index of each '
+                                'label of the label image is cached. It is '
+                                'created (or recreated if the label image '
+                                'changed) when needed, and reused otherwise.'))
 
     ROI_list = traits.List(traits.Int(), minlen=1,
                            desc=("list of ROI indices for which stats will be "
@@ -253,6 +538,9 @@ class ROI_TACs_to_spreadsheetInputSpec(BaseInterfaceInputSpec):
                                  desc='list of lists of integers')
     additionalROI_names = traits.List(traits.String(),
                                       desc='names corresponding to additional ROIs')
+    computeDtype = traits.Enum('float64', 'float32', 'native', mandatory=False,
+                               desc=('floating point data type used for '
+                                     'computations'))
 
 class ROI_TACs_to_spreadsheetOutputSpec(TraitedSpec):
     csvFile = File(exists=True, desc='csv file')
@@ -269,8 +557,6 @@ class ROI_TACs_to_spreadsheet(BaseInterface):
     output_spec = ROI_TACs_to_spreadsheetOutputSpec
 
     def _run_interface(self, runtime):
-        import csv
-
         timeSeriesImgFile = self.inputs.timeSeriesImgFile
         labelImgFile = self.inputs.labelImgFile
         ROI_list = self.inputs.ROI_list
@@ -284,42 +570,29 @@ class ROI_TACs_to_spreadsheet(BaseInterface):
         assert(len(ROI_list)==len(ROI_names))
         assert(len(additionalROIs)==len(additionalROI_names))
 
-        image = ti_load(timeSeriesImgFile, self.inputs.frameTimingFile)
-
-        labelimage = nib.load(labelImgFile)
-        labelimage_dat = labelimage.get_fdata()
-
-        # csv file
-        wf = open(csvfile, mode='w')
-        writer = csv.writer(wf, delimiter=',',
-                            quotechar='"', quoting=csv.QUOTE_MINIMAL)
-
-        row_content = ['ROI'] + list(range(image.get_numFrames()))
-        writer.writerow(row_content)
+        if isdefined(self.inputs.computeDtype):
+            computeDtype = self.inputs.computeDtype
+        else:
+            computeDtype = None
 
-        for i, ROI in enumerate(ROI_list):
-            ROI_mask = labelimage_dat==ROI
+        image = ti_load(timeSeriesImgFile, self.inputs.frameTimingFile,
+                        computeDtype=computeDtype)
 
-            row_content = [ROI_names[i]]
-            if ROI_mask.sum()>0:
-                ROI_stat = image.roi_timeseries(mask=ROI_mask).tolist()
-                row_content.extend(ROI_stat)
-                writer.writerow(row_content)
+        if not isdefined(additionalROIs):
+            additionalROIs = []
+            additionalROI_names = []
 
-        if isdefined(additionalROIs):
-            for i, compositeROI in enumerate(additionalROIs):
-                ROI_mask = labelimage_dat==compositeROI[0]
+        if isdefined(self.inputs.atlasIndexFile):
+            from .atlas import AtlasIndex
+            labelImgFile = AtlasIndex.cached(labelImgFile,
+                                             self.inputs.atlasIndexFile)
 
-                row_content = [additionalROI_names[i]]
-                if len(compositeROI)>1:
-                    for compositeROImember in compositeROI[1:]:
-                        ROI_mask = ROI_mask | (labelimage_dat==compositeROImember)
-                if ROI_mask.sum()>0:
-                    ROI_stat = image.roi_timeseries(mask=ROI_mask).tolist()
-                    row_content.extend(ROI_stat)
-                    writer.writerow(row_content)
+        ROI_TACs, ROI_counts = image.label_timeseries(labelImgFile, ROI_list,
+                                                      additionalROIs,
+                                                      return_counts=True)
 
-        wf.close()
+        write_ROI_TACs(csvfile, ROI_names + additionalROI_names,
+                        ROI_TACs, ROI_counts)
 
         return runtime
 
@@ -0,0 +1,199 @@
+import numpy as np
+
+# TAC matrix (one row per voxel) attached from shared memory in each worker
+_workerTACs = None
+_workerSharedMemory = None
+
+def _chunk_ranges(numVoxels, chunkSize):
+    '''
+    Split voxels into consecutive chunks. Chunks only depend on the number of
+    voxels and the chunk size, not on the number of processes.
+
+    Returns:
+        ranges (list): (start, stop) of each chunk
+    '''
+    return [(start, min(start + chunkSize, numVoxels))
+            for start in range(0, numVoxels, chunkSize)]
+
+def _attach_tacs(name, shape, dtype):
+    '''
+    Attach the TAC matrix in shared memory (worker process initializer)
+
+    The attachment is closed when the worker process exits. The parent
+    process owns the shared memory block, and unlinks it.
+    '''
+    from multiprocessing.shared_memory import SharedMemory
+    from multiprocessing.util import Finalize
+    global _workerTACs, _workerSharedMemory
+
+    try:
+        # Python 3.13+: leave the block to the resource tracker of the parent
+        _workerSharedMemory = SharedMemory(name=name, track=False)
+    except TypeError:
+        _workerSharedMemory = SharedMemory(name=name)
+    _workerTACs = np.ndarray(shape, dtype=dtype, buffer=_workerSharedMemory.buf)
+    _workerTACs.flags.writeable = False
+
+    # worker processes exit without running atexit handlers, but with
+    # multiprocessing finalizers
+    Finalize(None, _detach_tacs, exitpriority=10)
+
+def _detach_tacs():
+    '''
+    Close the attachment of the TAC matrix in shared memory
+    '''
+    global _workerTACs, _workerSharedMemory
+
+    # the array must be released before its buffer can be closed
+    _workerTACs = None
+    if _workerSharedMemory is not None:
+        _workerSharedMemory.close()
+        _workerSharedMemory = None
+
+def _fit_chunk(func, chunkIndex, start, stop, args, kwargs, seed, tacs=None):
+    '''
+    Apply func to the TACs of a chunk of voxels
+
+    Returns:
+        chunkIndex (int): index of the chunk
+        results (dict): parameter values of each voxel in the chunk
+    '''
+    if tacs is None:
+        tacs = _workerTACs
+    if seed is not None:
+        kwargs = dict(kwargs, rng=np.random.default_rng([seed, chunkIndex]))
+
+    results = func(np.ascontiguousarray(tacs[start:stop].T), *args, **kwargs)
+    return chunkIndex, {name: np.asarray(values)
+                        for name, values in results.items()}
+
+def _print_progress(numDone, numChunks):
+    import sys
+    sys.stderr.write('\rFitted %d of %d voxel chunks' % (numDone, numChunks))
+    if numDone==numChunks:
+        sys.stderr.write('\n')
+    sys.stderr.flush()
+
+def map_voxels(func, tacs, args=(), kwargs={}, numProcesses=None,
+               chunkSize=1024, progress=None, seed=None):
+    '''
+    Apply a voxelwise model fit to chunks of voxels in parallel processes
+
+    The TAC matrix is copied into shared memory once, and each worker process
+    attaches to it, so that only the (start, stop) voxel range of each chunk
+    and the fit results are sent between processes.
+
+    Args:
+        func (callable): module-level function that takes a 2D matrix of TACs
+                         (one row per time frame, one column per voxel),
+                         followed by args and kwargs, and returns a dict of
+                         parameter values, one per voxel. It must be
+                         picklable, so lambdas and nested functions cannot be
+                         used.
+        tacs (numpy.ndarray): 2D matrix with one row per voxel and one column
+                              per time frame
+        args (tuple): additional positional arguments to func
+        kwargs (dict): additional keyword arguments to func
+        numProcesses (int): number of worker processes. If None, the number
+                            of CPUs is used. If 1, voxels are fit in this
+                            process.
+        chunkSize (int): number of voxels per chunk
+        progress (callable or bool): function called with the number of
+            chunks done and the total number of chunks every time a chunk is
+            done. If True, progress is printed to stderr.
+        seed (int): if not None, func is also passed rng, a
+            numpy.random.Generator seeded with seed and the chunk index, so
+            that random results (e.g., bootstrap) do not depend on the
+            number of processes or on the order in which chunks finish
+
+    Returns:
+        results (dict): parameter values of each voxel
+    '''
+    return _map_voxels(func, tacs.shape, tacs.dtype, tacs, args=args,
+                       kwargs=kwargs, numProcesses=numProcesses,
+                       chunkSize=chunkSize, progress=progress, seed=seed)
+
+def _map_voxels(func, shape, dtype, tacs, args=(), kwargs={},
+                numProcesses=None, chunkSize=1024, progress=None, seed=None):
+    '''
+    Apply a voxelwise model fit to chunks of voxels in parallel processes
+    (see map_voxels), given either the TAC matrix or a function that writes
+    it into a matrix, so that it can be written into shared memory directly
+
+    Args:
+        shape (tuple): shape of the TAC matrix (voxels by time frames)
+        dtype (numpy.dtype): data type of the TAC matrix
+        tacs (numpy.ndarray or callable): TAC matrix, or function that takes
+                                          an empty matrix (of shape and
+                                          dtype) and writes the TACs into it
+
+    Returns:
+        results (dict): parameter values of each voxel
+    '''
+    import os
+
+    if chunkSize<1:
+        raise ValueError('Chunk size should be positive')
+    if numProcesses is None:
+        numProcesses = os.cpu_count() or 1
+    if numProcesses<1:
+        raise ValueError('Number of processes should be positive')
+    if progress is True:
+        progress = _print_progress
+
+    ranges = _chunk_ranges(shape[0], chunkSize)
+    numChunks = len(ranges)
+    chunkResults = [None] * numChunks
+
+    def _done(chunkIndex, results):
+        chunkResults[chunkIndex] = results
+        if progress:
+            _done.count += 1
+            progress(_done.count, numChunks)
+    _done.count = 0
+
+    if numProcesses==1 or numChunks<=1:
+        if callable(tacs):
+            fill = tacs
+            tacs = np.empty(shape, dtype=dtype)
+            fill(tacs)
+        for chunkIndex, (start, stop) in enumerate(ranges):
+            _done(*_fit_chunk(func, chunkIndex, start, stop, args, kwargs,
+                              seed, tacs=tacs))
+    else:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        from multiprocessing.shared_memory import SharedMemory
+
+        dtype = np.dtype(dtype)
+        sharedMemory = SharedMemory(create=True,
+                                    size=max(1, int(np.prod(shape)) *
+                                                dtype.itemsize))
+        sharedTACs = None
+        try:
+            sharedTACs = np.ndarray(shape, dtype=dtype, buffer=sharedMemory.buf)
+            if callable(tacs):
+                tacs(sharedTACs)
+            else:
+                sharedTACs[...] = tacs
+            sharedTACs = None
+
+            with ProcessPoolExecutor(max_workers=min(numProcesses, numChunks),
+                                     initializer=_attach_tacs,
+                                     initargs=(sharedMemory.name, shape,
+                                               dtype)) as executor:
+                futures = [executor.submit(_fit_chunk, func, chunkIndex,
+                                           start, stop, args, kwargs, seed)
+                           for chunkIndex, (start, stop) in enumerate(ranges)]
+                for future in as_completed(futures):
+                    _done(*future.result())
+        finally:
+            # the array must be released before its buffer can be closed
+            sharedTACs = None
+            sharedMemory.close()
+            sharedMemory.unlink()
+
+    # chunks are gathered in voxel order, regardless of when they finished
+    if numChunks==0:
+        return {}
+    return {name: np.concatenate([results[name] for results in chunkResults])
+            for name in chunkResults[0]}
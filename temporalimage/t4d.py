@@ -1,8 +1,179 @@
 from nibabel.analyze import SpatialImage
+from nibabel.arrayproxy import ArrayProxy, is_proxy
 import numpy as np
-from . import unitreg, Quantity # via pint
+from .timeline import FrameTimeline
+from .timing import read_frameTiming, write_frameTiming
+from .kinetic import VoxelwiseModels
 
-class TemporalImage(SpatialImage):
+# default floating point type used for computations on temporal images that
+# do not specify their own (see set_computeDtype)
+_computeDtype = np.dtype(np.float64)
+
+def _check_computeDtype(computeDtype):
+    '''
+    Validate a compute data type specification
+
+    Args:
+        computeDtype (str or numpy.dtype): 'native', None, or a floating point
+                                           data type
+
+    Returns:
+        computeDtype (str or numpy.dtype): 'native', None, or numpy.dtype
+    '''
+    if computeDtype is None or \
+       (isinstance(computeDtype, str) and computeDtype=='native'):
+        return computeDtype
+
+    computeDtype = np.dtype(computeDtype)
+    if not issubclass(computeDtype.type, np.floating):
+        raise ValueError('Compute data type should be a floating point type '
+                         'or native')
+    return computeDtype
+
+def set_computeDtype(computeDtype):
+    '''
+    Set the floating point data type used for computations on temporal images
+    that do not specify their own compute data type
+
+    Args:
+        computeDtype (str or numpy.dtype): a floating point data type
+            (e.g., 'float32' or 'float64'), or 'native' to use the smallest
+            floating point type that can represent the data type of each
+            image (e.g., float32 for int16 images)
+    '''
+    global _computeDtype
+
+    if computeDtype is None:
+        raise ValueError('Compute data type cannot be None')
+    _computeDtype = _check_computeDtype(computeDtype)
+
+def get_computeDtype():
+    '''
+    Get the default compute data type (see set_computeDtype)
+    '''
+    return _computeDtype
+
+def _memmap_proxy(proxy, dtype):
+    '''
+    Memory-map the data of an array proxy in copy-on-write mode
+
+    Args:
+        proxy (nibabel.arrayproxy.ArrayProxy): proxy to memory-map
+        dtype (numpy.dtype): data type the memory-mapped data should have
+
+    Returns:
+        data (numpy.memmap): memory-mapped data, or None if the data cannot be
+            memory-mapped as dtype (compressed file, scaled data, or a
+            different on-disk data type)
+    '''
+    fname = proxy.file_like
+    if not isinstance(fname, str) or \
+       fname.endswith(('.gz', '.bz2', '.zst')) or \
+       not proxy.dtype==dtype or \
+       not (proxy.slope==1 and proxy.inter==0):
+        return None
+
+    # changes to the mapped data are kept in private (copied) pages, so they
+    # are neither written to disk nor visible to other images
+    return np.memmap(fname, dtype=proxy.dtype, mode='c', offset=proxy.offset,
+                     shape=proxy.shape, order=proxy.order)
+
+def _read_frames(dataobj, sliceObj, dtype=None):
+    '''
+    Read consecutive time frames of a 4D data object
+
+    Args:
+        dataobj (array-like): 4D array or array proxy
+        sliceObj (slice): time frames to read
+        dtype (numpy.dtype): data type of the output array
+
+    Returns:
+        frames (numpy.ndarray): 4D data for the specified time frames
+    '''
+    slicer = (slice(None), slice(None), slice(None), sliceObj)
+    if isinstance(dataobj, ArrayProxy) and dtype is not None:
+        # scale directly into dtype, rather than scaling into float64 and
+        # then casting, as ArrayProxy.__array__ does for the full array
+        frames = dataobj._get_scaled(dtype=dtype, slicer=slicer)
+    else:
+        frames = dataobj[slicer]
+    return np.asanyarray(frames, dtype=dtype)
+
+class _FrameSlicedProxy(object):
+    '''
+    Lazy view onto a contiguous run of time frames of a 4D array proxy
+
+    Nothing is read from disk until the data are requested, and only the
+    frames covered by the view are read. Slicing a view returns another view
+    onto the original data object, so chained extractions stay lazy.
+
+    Args:
+        dataobj (array-like): 4D nibabel ArrayProxy (or another frame sliced
+                              proxy) to take frames from
+        sliceObj (slice): time frames of dataobj to include in the view
+    '''
+
+    def __init__(self, dataobj, sliceObj):
+        if isinstance(dataobj, _FrameSlicedProxy):
+            frames = dataobj._frames[sliceObj]
+            dataobj = dataobj._dataobj
+        else:
+            frames = range(dataobj.shape[3])[sliceObj]
+
+        if not frames.step>0:
+            raise ValueError('Frame slice step must be positive')
+
+        self._dataobj = dataobj
+        self._frames = frames
+
+    @property
+    def is_proxy(self):
+        return True
+
+    @property
+    def shape(self):
+        return tuple(self._dataobj.shape[:3]) + (len(self._frames),)
+
+    @property
+    def ndim(self):
+        return 4
+
+    @property
+    def dtype(self):
+        return self._dataobj.dtype
+
+    def _frame_index(self, idx):
+        # map a frame index into this view onto the underlying data object
+        if isinstance(idx, slice):
+            frames = self._frames[idx]
+            if frames.step>0:
+                return slice(frames.start, frames.stop, frames.step)
+            return None
+        return self._frames[idx]
+
+    def __getitem__(self, slicer):
+        from nibabel.fileslice import canonical_slicers
+
+        try:
+            canonical = canonical_slicers(slicer, self.shape)
+        except ValueError:
+            canonical = None
+
+        if canonical is not None and None not in canonical:
+            frameIndex = self._frame_index(canonical[3])
+            if frameIndex is not None:
+                return self._dataobj[canonical[:3] + (frameIndex,)]
+
+        # anything beyond basic slicing (fancy indexing, np.newaxis, reversed
+        # frame order) is handled by numpy on the frames covered by the view
+        return np.asanyarray(self)[slicer]
+
+    def __array__(self, dtype=None, copy=None):
+        frameIndex = slice(self._frames.start, self._frames.stop,
+                           self._frames.step)
+        return _read_frames(self._dataobj, frameIndex, dtype)
+
+class TemporalImage(SpatialImage, VoxelwiseModels):
     '''
     Class to represent 4D image data with corresponding time frame information
 
@@ -24,11 +195,14 @@ class TemporalImage(SpatialImage):
                          saved to
         sif_header (str): First row of Scan Information File (SIF)
         json_dict (dict): PET-BIDS json dictionary
+        computeDtype (str or numpy.dtype): floating point data type used for
+            computations on this image, or 'native' (see set_computeDtype).
+            If None, the default set by set_computeDtype is used.
     '''
 
     def __init__(self, dataobj, affine, frameStart, frameEnd,
                  header=None, extra=None, file_map=None,
-                 sif_header='', json_dict={}):
+                 sif_header='', json_dict={}, computeDtype=None):
 
         super().__init__(dataobj, affine=affine, header=header,
                          extra=extra, file_map=file_map)
@@ -36,22 +210,141 @@ class TemporalImage(SpatialImage):
         if not self.ndim==4:
             raise ValueError('Image must be 4D')
 
-        if not len(frameStart)==len(frameEnd):
-            raise ValueError(('There should be equal number of frame start and '
-                              'frame end times'))
-
-        if not (frameStart.check('[time]') and frameEnd.check('[time]')):
-            raise ValueError(('Frame start and frame end should be specified '
-                              'in valid time units'))
+        self._set_timeline(FrameTimeline(frameStart, frameEnd))
 
-        if not self.shape[3]==len(frameStart):
-            raise ValueError(('4th dimension of image must match the number of '
-                              'columns in frame timing file'))
-
-        self.frameStart = frameStart
-        self.frameEnd = frameEnd
         self.sif_header = sif_header
         self.json_dict = json_dict
+        self.computeDtype = _check_computeDtype(computeDtype)
+
+        # cumulative temporal integral (see build_integral)
+        self._integral = None
+
+    def get_computeDtype(self):
+        ''' Get the floating point data type used for computations
+        '''
+        computeDtype = _computeDtype if self.computeDtype is None \
+                       else self.computeDtype
+        if isinstance(computeDtype, str):
+            # native: smallest floating point type that can represent the data
+            computeDtype = np.promote_types(self.dataobj.dtype, np.float32)
+        return computeDtype
+
+    def set_computeDtype(self, computeDtype):
+        ''' Set the floating point data type used for computations
+
+        Args:
+            computeDtype (str or numpy.dtype): floating point data type,
+                'native', or None to use the default set by set_computeDtype
+        '''
+        self.computeDtype = _check_computeDtype(computeDtype)
+        self._integral = None
+
+    def _get_fdata(self):
+        ''' Get the (cached) image data in the compute data type
+        '''
+        return self.get_fdata(dtype=self.get_computeDtype())
+
+    def get_shared_data(self):
+        '''
+        Get the image data in the compute data type without copying them,
+        for sharing with derived images
+
+        Data that are in memory are returned as is. Data of uncompressed,
+        unscaled images stored in the compute data type are memory-mapped in
+        copy-on-write mode. Otherwise, the data are loaded and cached.
+
+        Returns:
+            data (numpy.ndarray): 4D image data
+        '''
+        computeDtype = self.get_computeDtype()
+
+        if self._fdata_cache is not None and \
+           self._fdata_cache.dtype==computeDtype:
+            return self._fdata_cache
+
+        dataobj = self.dataobj
+        if isinstance(dataobj, np.ndarray) and dataobj.dtype==computeDtype:
+            return dataobj
+
+        data = None
+        if isinstance(dataobj, ArrayProxy):
+            data = _memmap_proxy(dataobj, computeDtype)
+        elif isinstance(dataobj, _FrameSlicedProxy) and \
+             isinstance(dataobj._dataobj, ArrayProxy):
+            data = _memmap_proxy(dataobj._dataobj, computeDtype)
+            if data is not None:
+                frames = dataobj._frames
+                data = data[:,:,:,frames.start:frames.stop:frames.step]
+
+        if data is None:
+            data = self._get_fdata()
+        return data
+
+    def detach(self):
+        '''
+        Give the image its own, writable copy of its data
+
+        Images extracted with view=True share the data of the image they were
+        extracted from. Detaching such an image copies its data, so that they
+        can be modified without affecting any other image.
+        '''
+        data = np.array(self._get_fdata(), copy=True)
+        self._dataobj = data
+        self._fdata_cache = data
+        # the data may now be modified, so the integral must be rebuilt
+        self._integral = None
+
+    def close(self):
+        '''
+        Close the file that the data of this image are read from, if the image
+        keeps it open (e.g., images loaded with seekIndex=True). Images
+        extracted from this image without loading their data read from the
+        same file, so their data can no longer be read either.
+        Temporal images can also be used as context managers that close the
+        image on exit.
+        '''
+        dataobj = self.dataobj
+        if isinstance(dataobj, _FrameSlicedProxy):
+            dataobj = dataobj._dataobj
+        fileobj = getattr(dataobj, 'file_like', None)
+        if fileobj is not None and not isinstance(fileobj, str) and \
+           hasattr(fileobj, 'close'):
+            fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def _data_key(self, hash_file):
+        '''
+        Identify the data of this image for result caching
+        (see temporalimage.cache.ResultCache)
+
+        Args:
+            hash_file (callable): function that returns the content hash of a
+                                  file, given its absolute path
+
+        Returns:
+            key (list): content hash of the file that the data are read from
+                        along with the time frames that are read, or hash of
+                        the data if they are not read from a file
+        '''
+        import os.path as op
+        from .cache import _hash_array
+
+        dataobj = self.dataobj
+        frames = None
+        if isinstance(dataobj, _FrameSlicedProxy):
+            frames = [dataobj._frames.start, dataobj._frames.stop,
+                      dataobj._frames.step]
+            dataobj = dataobj._dataobj
+
+        if isinstance(dataobj, ArrayProxy) and \
+           isinstance(dataobj.file_like, str):
+            return ['file', hash_file(op.abspath(dataobj.file_like)), frames]
+        return ['array', _hash_array(np.asanyarray(self.dataobj))]
 
     def get_numFrames(self):
         ''' Get number of time frames
@@ -63,15 +356,45 @@ class TemporalImage(SpatialImage):
         '''
         return np.prod(self.shape[:-1])
 
+    @property
+    def frameStart(self):
+        return self.timeline.get_frameStart()
+
+    @frameStart.setter
+    def frameStart(self, frameStart):
+        self._set_timeline(FrameTimeline(frameStart, self.frameEnd))
+
+    @property
+    def frameEnd(self):
+        return self.timeline.get_frameEnd()
+
+    @frameEnd.setter
+    def frameEnd(self, frameEnd):
+        self._set_timeline(FrameTimeline(self.frameStart, frameEnd))
+
+    def _set_timeline(self, timeline):
+        '''
+        Set the frame timing, discarding the cumulative temporal integral,
+        which depends on the frame durations
+
+        Args:
+            timeline (temporalimage.FrameTimeline): frame timing
+        '''
+        if not self.shape[3]==len(timeline):
+            raise ValueError(('4th dimension of image must match the number of '
+                              'columns in frame timing file'))
+        self.timeline = timeline
+        self._integral = None
+
     def get_frameStart(self):
         ''' Get the array of starting times for each frame
         '''
-        return self.frameStart
+        return self.timeline.get_frameStart()
 
     def get_frameEnd(self):
         ''' Get the array of ending times for each frame
         '''
-        return self.frameEnd
+        return self.timeline.get_frameEnd()
 
     def get_startTime(self):
         ''' Get the starting time of first frame
@@ -86,95 +409,112 @@ class TemporalImage(SpatialImage):
     def get_frameDuration(self):
         ''' Get the array of durations for each frame
         '''
-        # Compute the duration of each time frame
-        delta = self.frameEnd - self.frameStart
-        return delta
+        return self.timeline.get_frameDuration()
 
     def get_midTime(self):
         ''' Get the array of mid-time point for each frame
         '''
-        # Compute the time mid-way for each time frame
-        t = (self.frameStart + self.frameEnd)/2
-        return t
+        return self.timeline.get_midTime()
 
     #@unitreg.check((None, '[time]', '[time]'))
-    def extractTime(self, startTime, endTime):
+    def extractTime(self, startTime, endTime, view=False):
         '''
         Extract a 4D temporal image from a longer-duration 4D temporal image
 
         Args:
-            startTime (float): time at which to begin, inclusive
-            endTime (float): time at which to stop, exclusive
+            startTime (temporalimage.Quantity): time at which to begin, inclusive
+            endTime (temporalimage.Quantity): time at which to stop, exclusive
+            view (bool): share the data buffer of this image instead of reading
+                         the extracted frames separately (see _slice_frames)
 
         Returns:
             extractedImg (temporalimage.TemporalImage): extracted 4D temporal image
         '''
-        import warnings
-
-        if startTime >= endTime:
-            raise ValueError('Start time must be before end time')
-
-        if startTime < self.frameStart[0]:
-            startTime = self.frameStart[0]
-            warnings.warn(('Specified start time is before the start time of '
-                           'the first frame. Constraining start time to be the '
-                           'start time of the first frame.'), RuntimeWarning)
-        elif startTime > self.frameEnd[-1]:
-            raise ValueError(('Start time is beyond the time covered by the '
-                              'time series data!'))
-
-        # find the first time frame with frameStart at or shortest after the specified start time
-        startIndex = next((i for i,t in enumerate(self.frameStart) if t>=startTime),
-                          len(self.frameStart)-1)
-
-        if endTime > self.frameEnd[-1]:
-            endTime = self.frameEnd[-1]
-            warnings.warn('Specified end time is beyond the end time of the '
-                          'last frame. Constraining end time to be the end '
-                          'time of the last frame.', RuntimeWarning)
-        elif endTime < self.frameStart[0]:
-            raise ValueError(('End time is prior to the time covered by the '
-                              'time series data!'))
-
-        # find the first time frame with frameEnd shortest after the specified end time
-        endIndex = next((i for i,t in enumerate(self.frameEnd) if t>endTime),
-                        len(self.frameStart))
-
-        # another sanity check, mainly to make sure that startIndex!=endIndex
-        if not startIndex<endIndex:
-            raise ValueError('Start index must be smaller than end index')
-
-        if not self.frameStart[startIndex]==startTime:
-            warnings.warn("Specified start time " + str(startTime) + \
-                          " did not match the start time of any of the frames." +
-                          " Using " + str(self.frameStart[startIndex]) + \
-                          " as start time instead.",
-                          RuntimeWarning)
-        if not self.frameEnd[endIndex-1]==endTime:
-            warnings.warn("Specified end time " + str(endTime) + \
-                          " did not match the end time of any of the frames." +
-                          " Using " + str(self.frameEnd[endIndex-1]) + \
-                          " as end time instead.",
-                          RuntimeWarning)
-
-        sliceObj = slice(startIndex,endIndex)
-
-        extractedImg =  TemporalImage(self.get_fdata()[:,:,:,sliceObj],
-                                      self.affine,
-                                      self.frameStart[sliceObj],
-                                      self.frameEnd[sliceObj],
-                                      self.header, self.extra, self.file_map)
+        sliceObj = self._window_frames(startTime, endTime)
+
+        extractedImg = self._slice_frames(sliceObj, view=view)
 
         return extractedImg
 
+    def _window_frames(self, startTime, endTime):
+        '''
+        Find the time frames to extract for a time window
+        (see FrameTimeline.resolve_window)
+        '''
+        return self.timeline.resolve_window(startTime, endTime)
+
+    def extractTimes(self, windows, view=False):
+        '''
+        Extract several 4D temporal images, one per time window, reading the
+        data only once
+
+        Every window is resolved against the frame timing as in extractTime.
+        If the data have not been loaded into memory, the time frames spanned
+        by all windows are read in a single pass, and the extracted images
+        are views into this shared array.
+
+        Args:
+            windows (list): list of (startTime, endTime) pairs, where startTime
+                            (temporalimage.Quantity) is inclusive and endTime
+                            (temporalimage.Quantity) is exclusive
+            view (bool): share the data buffer of this image instead of reading
+                         the extracted frames (see _slice_frames)
+
+        Returns:
+            extractedImgs (list): extracted 4D temporal images
+                                  (temporalimage.TemporalImage), in the order
+                                  of the windows
+        '''
+        sliceObjs = [self._window_frames(startTime, endTime)
+                     for startTime, endTime in windows]
+        return self._slice_frames_batch(sliceObjs, view=view)
+
+    def splitTimes(self, splitTimes, view=False):
+        '''
+        Split the 4D temporal image into several consecutive 4D temporal images,
+        reading the data only once (see extractTimes)
+        Total number of frames will be preserved
+
+        Args:
+            splitTimes (list): increasing times (temporalimage.Quantity) at
+                               which to split the 4D image
+            view (bool): share the data buffer of this image instead of reading
+                         the frames of the split images (see _slice_frames)
+
+        Returns:
+            splitImgs (list): len(splitTimes)+1 split images
+                              (temporalimage.TemporalImage); each image but
+                              the first starts at (includes) a split time
+        '''
+        if len(splitTimes)==0:
+            raise ValueError('At least one split time must be specified')
+
+        splitIndices = [self._window_frames(self.frameStart[0], splitTime).stop
+                        for splitTime in splitTimes]
+
+        if not all(np.diff(splitIndices)>0):
+            raise ValueError(('Split times must be increasing and fall into '
+                              'different time frames'))
+        if splitIndices[-1]==self.shape[-1]:
+            raise ValueError(('Start time for the last of the split images '
+                              'is beyond the time covered by the time series data!'))
+
+        boundaries = [0] + splitIndices + [self.shape[-1]]
+        sliceObjs = [slice(startIndex, endIndex) for startIndex, endIndex
+                     in zip(boundaries[:-1], boundaries[1:])]
+        return self._slice_frames_batch(sliceObjs, view=view)
+
     #@unitreg.check((None, '[time]'))
-    def splitTime(self, splitTime):
+    def splitTime(self, splitTime, view=False):
         '''
         Split the 4D temporal image into two 4D temporal images
         Total number of frames will be preserved
 
         Args:
             splitTime (temporalimage.Quantity): time at which to split the 4D image
+            view (bool): share the data buffer of this image instead of reading
+                         the frames of each split image separately
+                         (see _slice_frames)
 
         Returns:
             firstImg (temporalimage.TemporalImage): first of the two split images
@@ -182,21 +522,108 @@ class TemporalImage(SpatialImage):
             secondImg (temporalimage.TemporalImage): second of the two split
                                                      images (includes splitTime)
         '''
-        firstImg = self.extractTime(self.frameStart[0],splitTime)
+        firstImg = self.extractTime(self.frameStart[0],splitTime,view=view)
         #secondImg = self.extractTime(splitTime, self.frameEnd[-1])
         if firstImg.shape[-1]==self.shape[-1]:
             raise ValueError(('Start time for the second of the split images '
                               'is beyond the time covered by the time series data!'))
 
         sliceObj = slice(firstImg.shape[-1], self.shape[-1])
-        secondImg = TemporalImage(self.get_fdata()[:,:,:,sliceObj],
-                                  self.affine,
+        secondImg = self._slice_frames(sliceObj, view=view)
+        return firstImg, secondImg
+
+    def _slice_frames(self, sliceObj, view=False):
+        '''
+        Create a temporal image from a contiguous subset of the time frames.
+
+        If the data have already been loaded into memory, the new image is a
+        view into the loaded array. Otherwise, the new image refers lazily to
+        the frames of the on-disk data, so that only those frames are read
+        when its data are requested.
+
+        With view=True, the new image always shares the data buffer of this
+        image (see get_shared_data), so that images derived from the same
+        image keep a single copy of the voxel values. Views into in-memory
+        data are read-only; use detach to give an image its own, writable
+        copy. Views into memory-mapped files are copy-on-write: modified pages
+        are copied privately and not written back to the file.
+
+        Args:
+            sliceObj (slice): time frames to keep
+            view (bool): share the data buffer of this image
+
+        Returns:
+            slicedImg (temporalimage.TemporalImage): 4D temporal image
+                                                     restricted to sliceObj
+        '''
+        if view:
+            data = self.get_shared_data()
+            dataobj = data[:,:,:,sliceObj]
+            if not isinstance(data, np.memmap):
+                dataobj.flags.writeable = False
+        elif self._fdata_cache is not None:
+            dataobj = self._fdata_cache[:,:,:,sliceObj]
+        elif is_proxy(self.dataobj):
+            dataobj = _FrameSlicedProxy(self.dataobj, sliceObj)
+        else:
+            dataobj = self.dataobj[:,:,:,sliceObj]
+
+        return self._frames_image(dataobj, sliceObj)
+
+    def _slice_frames_batch(self, sliceObjs, view=False):
+        '''
+        Create temporal images from several contiguous subsets of the time
+        frames, reading the frames spanned by all subsets only once
+
+        Args:
+            sliceObjs (list): time frames (slice) to keep in each image
+            view (bool): share the data buffer of this image
+                         (see _slice_frames)
+
+        Returns:
+            slicedImgs (list): 4D temporal images
+                               (temporalimage.TemporalImage), one per slice
+        '''
+        if view or self._fdata_cache is not None or \
+           not is_proxy(self.dataobj) or len(sliceObjs)==0:
+            # no further reads are needed
+            return [self._slice_frames(sliceObj, view=view)
+                    for sliceObj in sliceObjs]
+
+        frameRanges = [range(self.shape[-1])[sliceObj] for sliceObj in sliceObjs]
+        startIndex = min(frameRange.start for frameRange in frameRanges)
+        endIndex = max(frameRange.stop for frameRange in frameRanges)
+
+        frames = np.asarray(_FrameSlicedProxy(self.dataobj,
+                                              slice(startIndex, endIndex)),
+                            dtype=self.get_computeDtype())
+
+        return [self._frames_image(frames[:,:,:,
+                                          frameRange.start-startIndex:
+                                          frameRange.stop-startIndex],
+                                   sliceObj)
+                for frameRange, sliceObj in zip(frameRanges, sliceObjs)]
+
+    def _frames_image(self, dataobj, sliceObj):
+        '''
+        Create a temporal image with the same geometry as this image from the
+        data of a subset of the time frames
+
+        Args:
+            dataobj (array-like): 4D data of the time frames
+            sliceObj (slice): time frames of this image that dataobj holds
+
+        Returns:
+            slicedImg (temporalimage.TemporalImage): 4D temporal image
+        '''
+        slicedImg = TemporalImage(dataobj, self.affine,
                                   self.frameStart[sliceObj],
                                   self.frameEnd[sliceObj],
-                                  self.header, self.extra, self.file_map)
-        return firstImg, secondImg
+                                  self.header, self.extra, self.file_map,
+                                  computeDtype=self.computeDtype)
+        return slicedImg
 
-    def roi_timeseries(self, maskfile=None, mask=None):
+    def roi_timeseries(self, maskfile=None, mask=None, cache=None):
         '''
         Get the mean time activity curve (TAC) within a region of interest (ROI)
 
@@ -205,15 +632,24 @@ class TemporalImage(SpatialImage):
                             (mutually exclusive argument: mask)
             mask (numpy.ndarray): 3D mask data matrix consisting of bool
                                   (mutually exclusive argument: maskfile)
+            cache (temporalimage.cache.ResultCache or str or bool):
+                result cache (see temporalimage.cache.cached_result)
 
         Returns:
             timeseries (numpy.ndarray): mean time activity curve within mask
         '''
+        from .cache import cached_result
 
         # Either mask or maskfile must be specified, not both
         if not (mask is None) ^ (maskfile is None):
             raise TypeError('Either mask or maskfile must be specified')
 
+        return cached_result(self, cache, 'roi_timeseries',
+                             {'maskfile': maskfile, 'mask': mask},
+                             lambda: self._roi_timeseries(maskfile, mask),
+                             fileParams=('maskfile',))
+
+    def _roi_timeseries(self, maskfile, mask):
         if mask is None:
             from nibabel import load as nibload
             mask = nibload(maskfile).get_fdata().astype(bool)
@@ -230,303 +666,798 @@ class TemporalImage(SpatialImage):
             raise ValueError(('Mask is not of the same size as the 3D images in '
                               'temporal image!'))
 
-        timeseries = np.mean(self.get_fdata()[mask],axis=0)
+        timeseries = np.mean(self._get_fdata()[mask],axis=0)
         return timeseries
 
-    def dynamic_mean(self, weights=None):
+    def label_timeseries(self, label_img, labels, composites=None,
+                         return_counts=False, cache=None):
+        '''
+        Get the mean time activity curves (TACs) within each label of a label
+        image, as well as within composite ROIs formed by unions of labels.
+
+        All TACs are computed in a single pass over the 4D data, by summing
+        voxel values per label with a bincount over the voxel label indices,
+        instead of building and applying a mask per ROI.
+
+        If label_img is an atlas index, only the voxels of the needed labels
+        are read, and no label comparisons are made
+        (see temporalimage.atlas.AtlasIndex).
+
+        Args:
+            label_img (str or numpy.ndarray or temporalimage.atlas.AtlasIndex):
+                label image file name, 3D label data matrix, or atlas index
+            labels (list of int): labels for which to compute TACs
+            composites (list of list of int): each inner list specifies the
+                                              labels whose union forms a
+                                              composite ROI
+            return_counts (bool): also return the number of voxels in each ROI
+            cache (temporalimage.cache.ResultCache or str or bool):
+                result cache (see temporalimage.cache.cached_result)
+
+        Returns:
+            timeseries (numpy.ndarray): 2D matrix with one row per element of
+                                        labels followed by one row per element
+                                        of composites, and one column per time
+                                        frame. Rows of ROIs with no voxels are
+                                        NaN.
+            counts (numpy.ndarray): number of voxels in each ROI
+                                    (only if return_counts is True)
+        '''
+        from .cache import cached_result
+
+        if composites is None:
+            composites = []
+
+        timeseries, counts = cached_result(
+                                 self, cache, 'label_timeseries',
+                                 {'label_img': label_img, 'labels': labels,
+                                  'composites': composites},
+                                 lambda: self._label_timeseries(label_img,
+                                                                labels,
+                                                                composites),
+                                 fileParams=('label_img',))
+        if return_counts:
+            return timeseries, counts
+        return timeseries
+
+    def _label_timeseries(self, label_img, labels, composites):
+        from .atlas import AtlasIndex
+
+        if isinstance(label_img, AtlasIndex):
+            return label_img.timeseries(self, labels, composites,
+                                        return_counts=True)
+
+        if isinstance(label_img, str):
+            from nibabel import load as nibload
+            label_img = nibload(label_img).get_fdata()
+        else:
+            label_img = np.asanyarray(label_img)
+
+        if not label_img.ndim==3:
+            raise ValueError('Label image must be 3D')
+
+        if not self.shape[:-1]==label_img.shape:
+            raise ValueError(('Label image is not of the same size as the 3D '
+                              'images in temporal image!'))
+
+        # every label that is needed, either by itself or in a composite ROI
+        allLabels = np.unique(np.concatenate(
+                        [np.asarray(labels, dtype=np.float64).ravel()] +
+                        [np.asarray(c, dtype=np.float64).ravel()
+                         for c in composites]))
+        numLabels = len(allLabels)
+        if numLabels<1:
+            raise ValueError('At least one label should be specified')
+
+        # voxel-wise index into allLabels, with numLabels for voxels
+        # that do not belong to any needed label
+        labelvec = label_img.ravel(order='F')
+        labelIndex = np.searchsorted(allLabels, labelvec)
+        labelIndex[labelIndex==numLabels] = 0
+        labelIndex[allLabels[labelIndex]!=labelvec] = numLabels
+
+        labelCounts = np.bincount(labelIndex, minlength=numLabels+1)[:-1]
+
+        # single reduction over the voxel x frame matrix
+        data = self._get_fdata().reshape((-1, self.get_numFrames()), order='F')
+        labelSums = np.empty((numLabels, self.get_numFrames()))
+        for t in range(self.get_numFrames()):
+            labelSums[:,t] = np.bincount(labelIndex, weights=data[:,t],
+                                         minlength=numLabels+1)[:-1]
+
+        rows = [np.searchsorted(allLabels, [label]) for label in labels] + \
+               [np.searchsorted(allLabels, np.unique(c)) for c in composites]
+
+        sums = np.vstack([labelSums[row].sum(axis=0) for row in rows]) if rows \
+               else np.empty((0, self.get_numFrames()))
+        counts = np.array([labelCounts[row].sum() for row in rows], dtype=int)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            timeseries = sums / counts[:,np.newaxis]
+
+        return timeseries, counts
+
+    def _iter_frame_chunks(self, memoryLimit=None):
+        '''
+        Iterate over the 4D data in chunks of consecutive time frames.
+
+        Data that are already in memory are returned as views; otherwise each
+        chunk is read from the underlying data object when it is needed, so
+        that only one chunk is held in memory at a time. Chunks are read in
+        increasing frame order, so that images loaded with
+        ``keep_file_open=True`` only decompress each frame once.
+
+        Args:
+            memoryLimit (int): maximum number of bytes of image data (in the
+                               compute data type) to read at once. At least
+                               one frame is always read. If None, all frames
+                               are read at once.
+
+        Yields:
+            sliceObj (slice): time frames covered by the chunk
+            chunk (numpy.ndarray): 4D data for those time frames, in the
+                                   compute data type
+        '''
+        numFrames = self.get_numFrames()
+        computeDtype = self.get_computeDtype()
+
+        if memoryLimit is None:
+            framesPerChunk = numFrames
+        else:
+            frameBytes = self.get_numVoxels() * computeDtype.itemsize
+            framesPerChunk = int(max(1, min(numFrames, memoryLimit // frameBytes)))
+
+        for start in range(0, numFrames, framesPerChunk):
+            sliceObj = slice(start, min(start + framesPerChunk, numFrames))
+            if self._fdata_cache is not None:
+                chunk = np.asanyarray(self._fdata_cache[:,:,:,sliceObj],
+                                      dtype=computeDtype)
+            else:
+                chunk = _read_frames(self.dataobj, sliceObj, computeDtype)
+            yield sliceObj, chunk
+
+    def dynamic_mean(self, weights=None, memoryLimit=None, mask=None,
+                     cache=None):
         '''
         Compute the weighted dynamic mean of the 4D temporal image.
 
+        The mean is accumulated frame by frame, reading the image data in
+        chunks of frames, so that the full 4D data never need to be in memory.
+
         Args:
             weights (str): { None, 'frameduration' }
                 If weights=='frameduration', each frame is weighted
                 proportionally to its duration (inverse variance weighting).
+            memoryLimit (int): maximum number of bytes of image data to read
+                               at once (see _iter_frame_chunks).
+                               If None, all frames are read at once.
+            mask (str or numpy.ndarray): mask file name or 3D mask data matrix.
+                If specified, the mean is only computed within the bounding
+                box of the mask (see crop), and is 0 outside of it.
+            cache (temporalimage.cache.ResultCache or str or bool):
+                result cache (see temporalimage.cache.cached_result)
 
         Returns:
             dyn_mean (numpy.ndarray): 3D matrix
         '''
+        from .cache import cached_result
+
+        return cached_result(self, cache, 'dynamic_mean',
+                             {'weights': weights, 'mask': mask},
+                             lambda: self._dynamic_mean(weights, memoryLimit,
+                                                        mask),
+                             fileParams=('mask',))
+
+    def _dynamic_mean(self, weights, memoryLimit, mask):
+        if mask is not None:
+            croppedImg, bbox = self.crop(mask)
+            return self.uncrop(croppedImg._dynamic_mean(weights, memoryLimit,
+                                                        None),
+                               bbox)
+
+        computeDtype = self.get_computeDtype()
+
         if weights is None:
-            dyn_mean = np.average(self.get_fdata(), axis=3)
+            delta = None
         elif weights=='frameduration':
-            delta = self.get_frameDuration().magnitude
-            dyn_mean = np.average(self.get_fdata(), axis=3, weights=delta)
+            delta = self.get_frameDuration().magnitude.astype(computeDtype)
         else:
             raise ValueError('Weights should be None or frameduration')
 
+        # accumulate in frame order. numpy.average sums F-ordered data (as
+        # read from NIfTI files) in the same order, but sums C-ordered data
+        # pairwise, so results for C-ordered data can differ from it by a few
+        # units in the last place, growing with the number of frames
+        dyn_mean = np.zeros(self.shape[:3], dtype=computeDtype)
+        for sliceObj, chunk in self._iter_frame_chunks(memoryLimit):
+            for i, t in enumerate(range(sliceObj.start, sliceObj.stop)):
+                if delta is None:
+                    dyn_mean += chunk[:,:,:,i]
+                else:
+                    dyn_mean += chunk[:,:,:,i] * delta[t]
+
+        if delta is None:
+            dyn_mean /= self.get_numFrames()
+        else:
+            dyn_mean /= delta.sum()
+
         return dyn_mean
 
-    def gaussian_filter(self, sigma, **kwargs):
+    def build_integral(self, memoryLimit=None, filename=None):
         '''
-        Perform gaussian filtering of each time point.
+        Build the cumulative duration-weighted integral of the 4D temporal
+        image along the time axis, so that the area under the curve (AUC) and
+        mean image of any frame-aligned time window can be computed from two
+        3D slabs (see window_auc and window_mean) instead of a pass over the
+        frames of the window.
+
+        Slab k of the integral is the sum of frame * frame duration over the
+        first k frames, so slab 0 is zero and there are numFrames+1 slabs.
+        The integral is accumulated and stored in float64 regardless of the
+        compute data type, since windows are differences of cumulative sums.
 
         Args:
-            sigma (scalar or sequence of scalars):
-                Standard deviation for Gaussian kernel (in voxels).
-                The standard deviations of the Gaussian filter are given for
-                each axis as a sequence, or as a single number,
-                in which case it is equal for all of the first three axes.
-            kwargs (dict): any argument that scipy.ndimage.gaussian_filter takes
+            memoryLimit (int): maximum number of bytes of image data to read
+                               at once (see _iter_frame_chunks).
+                               If None, all frames are read at once.
+            filename (str): .npy file in which to persist the integral. If the
+                file exists and was built from the same data, frame timing
+                and compute data type as this image (as recorded in a
+                filename + '.key' sidecar file; see _integral_key), it is
+                memory-mapped instead of being recomputed. Otherwise, the
+                integral is written to it slab by slab, so that it never
+                needs to be held in memory. Identifying the data of an image
+                loaded from a file requires hashing that file.
 
         Returns:
-            smoothedData (numpy.ndarray): 4D matrix with smoothed values.
+            integral (numpy.ndarray): 4D array of numFrames+1 slabs
+        '''
+        import os
+
+        shape = self.shape[:3] + (self.get_numFrames()+1,)
+
+        if filename is not None:
+            keyfilename = filename + '.key'
+            key = self._integral_key()
+            if os.path.exists(filename) and os.path.exists(keyfilename):
+                with open(keyfilename, 'r') as f:
+                    storedKey = f.read().strip()
+                integral = np.load(filename, mmap_mode='r')
+                if storedKey==key and integral.shape==shape and \
+                   integral.dtype==np.float64:
+                    self._integral = integral
+                    return integral
+                del integral
+
+            # the key file is written after the integral, so that an
+            # integral is never paired with the key of another one
+            if os.path.exists(keyfilename):
+                os.remove(keyfilename)
+
+        if filename is None:
+            integral = np.empty(shape, dtype=np.float64)
+        else:
+            # write to a temporary file first, so that an interrupted build
+            # never leaves a partial integral behind
+            tmpname = filename + '.' + str(os.getpid()) + '.tmp.npy'
+            integral = np.lib.format.open_memmap(tmpname, mode='w+',
+                                                 dtype=np.float64, shape=shape)
+
+        duration = self.timeline.duration
+        cumsum = np.zeros(self.shape[:3], dtype=np.float64)
+        integral[:,:,:,0] = cumsum
+        for sliceObj, chunk in self._iter_frame_chunks(memoryLimit):
+            for i, t in enumerate(range(sliceObj.start, sliceObj.stop)):
+                cumsum += chunk[:,:,:,i] * duration[t]
+                integral[:,:,:,t+1] = cumsum
+
+        if filename is not None:
+            integral.flush()
+            del integral
+            os.replace(tmpname, filename)
+            tmpname = keyfilename + '.' + str(os.getpid()) + '.tmp'
+            with open(tmpname, 'w') as f:
+                f.write(key)
+            os.replace(tmpname, keyfilename)
+            integral = np.load(filename, mmap_mode='r')
+
+        self._integral = integral
+        return integral
+
+    def _integral_key(self):
+        '''
+        Identify the data, frame timing and compute data type that the
+        cumulative integral of this image is built from (see build_integral)
 
-        See Also:
-            scipy.ndimage.gaussian_filter : Gaussian filtering of 3D image
+        Returns:
+            key (str): hexadecimal BLAKE2b digest
+        '''
+        import json
+        from hashlib import blake2b
+        from .cache import _hash_file
+
+        description = [self._data_key(_hash_file),
+                       self.frameStart.to('sec').magnitude.tolist(),
+                       self.frameEnd.to('sec').magnitude.tolist(),
+                       str(self.get_computeDtype())]
+        return blake2b(json.dumps(description).encode(),
+                       digest_size=20).hexdigest()
+
+    def _get_integral(self):
+        if self._integral is None:
+            self.build_integral()
+        return self._integral
+
+    def window_auc(self, startTime, endTime):
         '''
+        Compute the area under the curve (AUC) image of a time window from
+        the cumulative integral (see build_integral, which is called with its
+        default arguments if the integral has not been built yet)
 
-        from scipy.ndimage import gaussian_filter
+        The window is resolved against the frame timing as in extractTime.
 
-        smoothedData = np.zeros(self.shape)
-        for t in range(self.get_numFrames()):
-            smoothedData[:,:,:,t] = gaussian_filter(self.get_fdata()[:,:,:,t],
-                                                    sigma=sigma,**kwargs)
-        return smoothedData
+        Args:
+            startTime (temporalimage.Quantity): time at which to begin, inclusive
+            endTime (temporalimage.Quantity): time at which to stop, exclusive
 
-def _csvread_frameTiming(csvfilename):
-    '''
-    Read frame timing information from csv file
-    csv file should include a column named 'Duration of time frame (<X>)' and
-    another named 'Elapsed time (<X>)', where <X> is a valid time unit
-    (i.e., min, s, sec, ms, msec, ...)
+        Returns:
+            auc (numpy.ndarray): 3D matrix, in image units times the time unit
+                                 of the frame timing (see get_frameDuration)
+        '''
+        sliceObj = self._window_frames(startTime, endTime)
+        integral = self._get_integral()
+        return integral[:,:,:,sliceObj.stop] - integral[:,:,:,sliceObj.start]
 
-    Args:
-        csvfilename (str): path to csv file containing frame timing information
+    def window_mean(self, startTime, endTime):
+        '''
+        Compute the frame duration weighted mean image of a time window from
+        the cumulative integral (see window_auc)
 
-    Returns:
-        frameStart (temporalimage.Quantity):
-            vector containing the start times of each frame
-        frameEnd (temporalimage.Quantity):
-            vector containing the end times of each frame
-    '''
-    from pandas import read_csv
+        This is equivalent to extracting the window and computing its
+        dynamic_mean with weights='frameduration', up to rounding.
 
-    frameTiming = read_csv(csvfilename)
+        Args:
+            startTime (temporalimage.Quantity): time at which to begin, inclusive
+            endTime (temporalimage.Quantity): time at which to stop, exclusive
 
-    frameEnd = frameDuration = None
-    for col in frameTiming.columns:
-        try:
-            col_trimmed, time_unit, _ = col.replace(')','(').split('(')
-            col_trimmed = col_trimmed.strip()
-            time_unit = time_unit.strip()
+        Returns:
+            dyn_mean (numpy.ndarray): 3D matrix
+        '''
+        sliceObj = self._window_frames(startTime, endTime)
+        integral = self._get_integral()
+        totalDuration = self.timeline.duration[sliceObj].sum()
+        return (integral[:,:,:,sliceObj.stop] -
+                integral[:,:,:,sliceObj.start]) / totalDuration
 
-            if col_trimmed=='Elapsed time':
-                frameEnd = Quantity(frameTiming[col].values, time_unit)
-            elif col_trimmed=='Duration of time frame':
-                frameDuration = Quantity(frameTiming[col].values, time_unit)
-        except:
-            pass
+    def _load_mask(self, mask):
+        '''
+        Load a 3D mask given as a file name or data matrix, and check that it
+        matches the image grid
+        '''
+        if isinstance(mask, str):
+            from nibabel import load as nibload
+            mask = nibload(mask).get_fdata()
+        mask = np.asanyarray(mask)
 
-        if (frameEnd is not None) and (frameDuration is not None):
-            break
+        if not self.shape[:-1]==mask.shape:
+            raise ValueError(('Mask is not of the same size as the 3D images in '
+                              'temporal image!'))
+        return mask
 
-    frameStart = frameEnd - frameDuration
+    def mask_bbox(self, mask, margin=0):
+        '''
+        Get the bounding box of the nonzero voxels of a mask
 
-    return frameStart, frameEnd
+        Args:
+            mask (str or numpy.ndarray): mask file name or 3D mask data matrix
+            margin (int or sequence of int): number of voxels to add on each
+                side of the bounding box, for each of the three axes or for
+                all of them. The bounding box is clipped to the image grid.
 
-def _csvwrite_frameTiming(frameStart, frameEnd, csvfilename, time_unit='min'):
-    '''
-    Write frame timing information to csv file
-    There will be one column named 'Duration of time frame (min)'
-    and another named 'Elapsed time (min)'
+        Returns:
+            bbox (tuple of slice): bounding box along each of the three axes
+        '''
+        mask = self._load_mask(mask)
+        if not mask.any():
+            raise ValueError('Mask should include as least one >0 voxel')
 
-    Args:
-        frameStart (temporalimage.Quantity):
-            vector containing the start times of each frame
-        frameEnd (temporalimage.Quantity):
-            vector containing the end times of each frame
-        csvfilename (str): path to output csv file
-        time_unit (str): time unit for the output csv file
-    '''
-    from pandas import DataFrame
+        margin = np.broadcast_to(np.asarray(margin, dtype=int), (3,))
+        bbox = []
+        for axis in range(3):
+            nonzero = np.flatnonzero(mask.any(axis=tuple(a for a in range(3)
+                                                         if not a==axis)))
+            bbox.append(slice(max(0, nonzero[0] - margin[axis]),
+                              min(mask.shape[axis],
+                                  nonzero[-1] + 1 + margin[axis])))
+        return tuple(bbox)
+
+    def crop(self, mask, margin=0):
+        '''
+        Crop the temporal image to the bounding box of a mask, so that
+        subsequent operations only process the voxels in the bounding box.
+        The affine of the cropped image is adjusted so that voxels keep their
+        world coordinates.
 
-    frameDuration = (frameEnd - frameStart).to(time_unit).magnitude
+        Args:
+            mask (str or numpy.ndarray): mask file name or 3D mask data matrix
+            margin (int or sequence of int): number of voxels to add on each
+                side of the bounding box (see mask_bbox)
 
-    timingData = DataFrame(data={
-        'Duration of time frame ('+time_unit+')': frameDuration,
-        'Elapsed time ('+time_unit+')': frameEnd.to(time_unit).magnitude})
-    timingData.to_csv(csvfilename, index=False)
+        Returns:
+            croppedImg (temporalimage.TemporalImage): cropped 4D temporal image
+            bbox (tuple of slice): bounding box of the cropped image in this
+                                   image (see uncrop)
+        '''
+        bbox = self.mask_bbox(mask, margin)
+        slicer = bbox + (slice(None),)
+
+        if self._fdata_cache is not None:
+            dataobj = self._fdata_cache[slicer]
+        elif is_proxy(self.dataobj):
+            # only the voxels within the bounding box are kept in memory
+            dataobj = np.asanyarray(self.dataobj[slicer])
+        else:
+            dataobj = self.dataobj[slicer]
 
-def _sifread_frameTiming(sifname):
-    '''
-    Read frame timing information from Scan Information File (SIF)
+        affine = self.affine.copy()
+        affine[:3,3] = self.affine[:3,:3] @ [b.start for b in bbox] + \
+                       self.affine[:3,3]
 
-    Args:
-        sifname (str): path to sif containing frame timing information
+        croppedImg = TemporalImage(dataobj, affine,
+                                   self.frameStart, self.frameEnd,
+                                   self.header.copy(), self.extra,
+                                   sif_header=self.sif_header,
+                                   json_dict=self.json_dict,
+                                   computeDtype=self.computeDtype)
+        return croppedImg, bbox
 
-    Returns:
-        frameStart (temporalimage.Quantity):
-            vector containing the start times of each frame
-        frameEnd (temporalimage.Quantity):
-            vector containing the end times of each frame
-        sif_header (str): first row of SIF
-    '''
-    from pandas import read_table
+    def uncrop(self, values, bbox, fill=0, out=None):
+        '''
+        Paste values computed on a cropped image (see crop) back into the
+        image grid of this image
 
-    frameTiming = read_table(sifname, sep='\s+', skiprows=1, header=None).values
+        Args:
+            values (numpy.ndarray): 3D or 4D matrix on the cropped image grid
+            bbox (tuple of slice): bounding box of the cropped image
+            fill (float): value outside the bounding box
+            out (numpy.ndarray): array on the image grid of this image to
+                                 paste values into. If None, a new array is
+                                 allocated.
 
-    # read in first line
-    with open(sifname, 'r') as f:
-        sif_header = f.readline().strip()
+        Returns:
+            uncropped (numpy.ndarray): 3D or 4D matrix on the image grid
+        '''
+        values = np.asanyarray(values)
+        shape = self.shape[:-1] + values.shape[3:]
+        if not values.shape[:3]==tuple(b.stop - b.start for b in bbox):
+            raise ValueError('Values do not match the size of the bounding box')
+
+        if out is None:
+            out = np.empty(shape, dtype=np.result_type(values, fill))
+        elif not out.shape==shape:
+            raise ValueError(('Output array must be of the same size as the '
+                              'image grid'))
+
+        out[...] = fill
+        out[bbox] = values
+        return out
+
+    def masked(self, mask, memoryLimit=None):
+        '''
+        Get a compact representation of the voxels within a mask, storing
+        only the in-mask voxels as a voxel by frame matrix in the compute data
+        type (see masked.MaskedTemporalImage)
 
-    # for SIF, we assume that the time unit is seconds
-    time_unit = 'sec'
+        The image data are read in chunks of frames, so the full 4D data are
+        never loaded into memory.
 
-    frameStart = Quantity(frameTiming[:,0], time_unit)
-    frameEnd = Quantity(frameTiming[:,1], time_unit)
+        Args:
+            mask (str or numpy.ndarray): mask file name or 3D mask data matrix
+            memoryLimit (int): maximum number of bytes of image data to read
+                               at once (see _iter_frame_chunks).
+                               If None, all frames are read at once.
 
-    return frameStart, frameEnd, sif_header
+        Returns:
+            maskedImg (temporalimage.MaskedTemporalImage): masked image
+        '''
+        from .masked import MaskedTemporalImage
 
-def _sifwrite_frameTiming(frameStart, frameEnd, sifname, sif_header=''):
-    '''
-    Write frame timing information to Scan Information File (SIF)
+        if isinstance(mask, str):
+            from nibabel import load as nibload
+            mask = nibload(mask).get_fdata()
 
-    Args:
-        frameStart (temporalimage.Quantity):
-            vector containing the start times of each frame
-        frameEnd (temporalimage.Quantity):
-            vector containing the end times of each frame
-        sifname (str): path to output SIF
-        sif_header (str): first row of SIF
-    '''
-    np.savetxt(sifname,
-               np.vstack((frameStart.to('sec').magnitude,
-                          frameEnd.to('sec').magnitude)).T,
-               fmt='%f', header=sif_header)
+        voxelIndex = self._mask_voxels(mask)
+
+        data = np.empty((len(voxelIndex), self.get_numFrames()),
+                        dtype=self.get_computeDtype())
+        for sliceObj, chunk in self._iter_frame_chunks(memoryLimit):
+            data[:,sliceObj] = chunk[np.unravel_index(voxelIndex,
+                                                      chunk.shape[:3])]
+
+        return MaskedTemporalImage(data, voxelIndex, self.shape[:-1],
+                                   self.affine, self.timeline, self.header,
+                                   sif_header=self.sif_header,
+                                   json_dict=self.json_dict)
+
+    def _grid_shape(self):
+        ''' Get the shape of the 3D images
+        '''
+        return self.shape[:-1]
+
+    def _in_image(self, voxelIndex):
+        ''' Check which voxels have TACs in this image (all of them)
+        '''
+        return np.ones(len(voxelIndex), dtype=bool)
+
+    def _voxel_tacs(self, voxelIndex, memoryLimit=None, out=None):
+        '''
+        Get the TACs of some voxels in the compute data type
+
+        If memoryLimit and out are None, the TACs are gathered from the full
+        4D data, which are loaded and kept in memory (see get_fdata).
+        Otherwise, they are gathered from chunks of time frames (see
+        _iter_frame_chunks), so that data that are not in memory are read
+        without loading all of them.
+
+        Args:
+            voxelIndex (numpy.ndarray): flat (C order) voxel indices
+            memoryLimit (int): maximum number of bytes of image data to read
+                               at once
+            out (numpy.ndarray): matrix to write the TACs into
+
+        Returns:
+            tacs (numpy.ndarray): 2D matrix with one row per voxel and one
+                                  column per time frame
+        '''
+        # gather with 3D indices, since reshaping Fortran-ordered image data
+        # to a voxel by frame matrix would copy all of it
+        coords = np.unravel_index(voxelIndex, self.shape[:-1])
+        if memoryLimit is None and out is None:
+            return self._get_fdata()[coords]
+
+        if out is None:
+            out = np.empty((len(voxelIndex), self.get_numFrames()),
+                           dtype=self.get_computeDtype())
+        for sliceObj, chunk in self._iter_frame_chunks(memoryLimit):
+            out[:,sliceObj] = chunk[coords]
+        return out
+
+    def _mask_voxels(self, mask=None):
+        '''
+        Get the flat (C order) indices of the voxels in a 3D mask
+
+        Args:
+            mask (numpy.ndarray): 3D mask data matrix consisting of bool.
+                                  If None, all voxels are included.
+
+        Returns:
+            voxelIndex (numpy.ndarray): indices of the voxels in the mask
+        '''
+        if mask is None:
+            return np.arange(self.get_numVoxels())
+
+        mask = np.asanyarray(mask).astype(bool)
+        if not self.shape[:-1]==mask.shape:
+            raise ValueError(('Mask is not of the same size as the 3D '
+                              'images in temporal image!'))
+        return np.flatnonzero(mask)
+
+    def gaussian_filter(self, sigma, out=None, dtype=None,
+                        numThreads=None, returnImage=False, memoryLimit=None,
+                        mask=None, **kwargs):
+        '''
+        Perform gaussian filtering of each time point.
+
+        Frames are filtered concurrently on a thread pool (scipy.ndimage
+        releases the GIL while filtering), and each filtered frame is written
+        directly into the output array.
+
+        Args:
+            sigma (scalar or sequence of scalars):
+                Standard deviation for Gaussian kernel (in voxels).
+                The standard deviations of the Gaussian filter are given for
+                each axis as a sequence, or as a single number,
+                in which case it is equal for all of the first three axes.
+            out (numpy.ndarray or temporalimage.writer.TemporalImageWriter):
+                4D array of the same shape as the image to store the smoothed
+                values in, or a writer of an image of the same shape to append
+                the smoothed frames to as soon as they are filtered, so that
+                only a chunk of smoothed frames is held in memory (see save).
+                If None, a new array is allocated.
+            dtype (numpy.dtype): data type of the newly allocated output array
+                                 (ignored if out is specified). If None, the
+                                 compute data type is used.
+            numThreads (int): number of threads to filter frames with.
+                              If None, use the ThreadPoolExecutor default.
+            returnImage (bool): return a TemporalImage instead of an array
+            memoryLimit (int): maximum number of bytes of input image data to
+                               read at once (see _iter_frame_chunks).
+                               If None, all frames are read at once.
+            mask (str or numpy.ndarray): mask file name or 3D mask data matrix.
+                If specified, only the bounding box of the mask, plus a margin
+                of the filter radius, is filtered (see crop). Within the
+                bounding box, the result is the same as filtering the whole
+                image; outside of it, the result is 0.
+            kwargs (dict): any argument that scipy.ndimage.gaussian_filter
+                           takes, except for output
+
+        Returns:
+            smoothedData (numpy.ndarray): 4D matrix with smoothed values.
+                If returnImage is True, a temporalimage.TemporalImage with the
+                same frame timing is returned instead. If out is a writer,
+                nothing is returned.
+
+        See Also:
+            scipy.ndimage.gaussian_filter : Gaussian filtering of 3D image
+        '''
 
-def _jsonread_frameTiming(jsonfilename):
+        from scipy.ndimage import gaussian_filter
+        from concurrent.futures import ThreadPoolExecutor
+        from .writer import TemporalImageWriter
+
+        if 'output' in kwargs:
+            raise TypeError('Use out instead of output to specify the output array')
+
+        writer = None
+        if isinstance(out, TemporalImageWriter):
+            if returnImage:
+                raise ValueError('An image cannot be returned when writing to out')
+            writer, out = out, None
+            if not writer.shape==self.shape:
+                raise ValueError('Output image must be of the same size as the '
+                                 'temporal image')
+
+        if dtype is None:
+            dtype = self.get_computeDtype()
+
+        if writer is not None:
+            smoothedData = None
+        elif out is None:
+            smoothedData = np.empty(self.shape, dtype=dtype, order='F')
+        elif not out.shape==self.shape:
+            raise ValueError('Output array must be of the same size as the '
+                             'temporal image')
+        else:
+            smoothedData = out
+
+        if mask is not None:
+            # filter the bounding box with a margin of the filter radius, so
+            # that the voxels in the bounding box see all their neighbors
+            mask = self._load_mask(mask)
+            truncate = kwargs.get('truncate', 4.0)
+            radius = [int(truncate * float(sd) + 0.5)
+                      for sd in np.broadcast_to(sigma, (3,))]
+            croppedImg, bbox = self.crop(mask, margin=radius)
+            smoothedCrop = croppedImg.gaussian_filter(
+                               sigma, dtype=dtype if writer is not None
+                                            else smoothedData.dtype,
+                               numThreads=numThreads, memoryLimit=memoryLimit,
+                               **kwargs)
+
+            innerBox = self.mask_bbox(mask)
+            innerInCrop = tuple(slice(i.start - b.start, i.stop - b.start)
+                                for i, b in zip(innerBox, bbox))
+            if writer is not None:
+                for t in range(self.get_numFrames()):
+                    writer.write(self.uncrop(smoothedCrop[innerInCrop + (t,)],
+                                             innerBox))
+            else:
+                self.uncrop(smoothedCrop[innerInCrop], innerBox,
+                            out=smoothedData)
+        else:
+            with ThreadPoolExecutor(max_workers=numThreads) as executor:
+                for sliceObj, chunk in self._iter_frame_chunks(memoryLimit):
+                    if writer is not None:
+                        output = np.empty(chunk.shape, dtype=dtype, order='F')
+                    else:
+                        output = smoothedData[:,:,:,sliceObj]
+
+                    def _filter_frame(i):
+                        gaussian_filter(chunk[:,:,:,i], sigma=sigma,
+                                        output=output[:,:,:,i], **kwargs)
+                    # wait for the whole chunk so that it can be released
+                    list(executor.map(_filter_frame, range(chunk.shape[3])))
+
+                    if writer is not None:
+                        writer.write(output)
+
+        if writer is not None:
+            return None
+
+        if returnImage:
+            header = self.header.copy()
+            header.set_data_dtype(smoothedData.dtype)
+            return TemporalImage(smoothedData, self.affine,
+                                 self.frameStart, self.frameEnd,
+                                 header, self.extra, self.file_map,
+                                 sif_header=self.sif_header,
+                                 json_dict=self.json_dict,
+                                 computeDtype=self.computeDtype)
+
+        return smoothedData
+
+def _load_seekable_gzip(filename, spacing=2**22, **kwargs):
     '''
-    Read frame timing information from PET-BIDS json sidecar
+    Load a gzipped NIfTI image through a gzip seek point index, so that
+    reading a subset of the time frames only decompresses the data between
+    the nearest seek point and the end of those frames.
+
+    The index is saved to a sidecar file (<filename>.gzidx) the first time
+    the image is loaded, and is re-used as long as it is newer than the image.
 
     Args:
-        jsonfname (str): BIDS json sidecar file name
+        filename (str): path to .nii.gz image
+        spacing (int): number of uncompressed bytes between seek points
+        kwargs (dict): any argument that nibabel's from_file_map takes
 
     Returns:
-        frameStart (temporalimage.Quantity):
-            vector containing the start times of each frame
-        frameEnd (temporalimage.Quantity):
-            vector containing the end times of each frame
-        json_dict (dict): json dictionary
+        img (nibabel.nifti1.Nifti1Image): image whose array proxy reads from
+                                          the indexed gzip file, which is kept
+                                          open (see TemporalImage.close)
     '''
-    from json import load as json_load
-    with open(jsonfilename, 'r') as f:
-        json_dict = json_load(f)
-
-    if 'Time' in json_dict:
-         try:
-             # accommodate the older format
-             #
-             # Time
-             # |__FrameTimes
-             # |  |__Values
-             # |  |__Labels: frameStart, frameEnd, frameDuration
-             # |  |__Units
-             # 
-
-             frameVals = np.array(json_dict['Time']['FrameTimes']['Values'])
-
-             col_frameStart = json_dict['Time']['FrameTimes']['Labels'].index('frameStart')
-             time_unit = json_dict['Time']['FrameTimes']['Units'][col_frameStart]
-             frameStart = Quantity(frameVals[:,col_frameStart], time_unit)
-
-
-             try:
-                 col_frameEnd = json_dict['Time']['FrameTimes']['Labels'].index('frameEnd')
-                 time_unit = json_dict['Time']['FrameTimes']['Units'][col_frameEnd]
-                 frameEnd = Quantity(frameVals[:,col_frameEnd], time_unit)
-             except:
-                 col_frameDuration = json_dict['Time']['FrameTimes']['Labels'].index('frameDuration')
-                 time_unit = json_dict['Time']['FrameTimes']['Units'][col_frameDuration]
-                 frameDuration = Quantity(frameVals[:,col_frameDuration], time_unit)
-                 frameEnd = frameStart + frameDuration
-         except:
-             # Time
-             # |__FrameTimesStartUnits
-             # |__FrameTimesStart
-             # |__FrameDurationUnits
-             # |__FrameDuration
-             try:
-                 # accommodate the intermediate PET BIDS version that allowed for
-                 # different units
-                 time_unit = json_dict['Time']['FrameTimesStartUnits']
-             except:
-                 time_unit = 's'
-                 frameStart = Quantity(np.array(json_dict['Time']['FrameTimesStart']),
-                               time_unit)
-             try:
-                 time_unit = json_dict['Time']['FrameDurationUnits']
-             except:
-                 time_unit = 's'
-                 frameDuration = Quantity(np.array(json_dict['Time']['FrameDuration']),
-                                  time_unit)
-
-                 frameEnd = frameStart + frameDuration
+    import os.path as op
+    import warnings
+    import nibabel as nib
+
+    try:
+        from indexed_gzip import IndexedGzipFile
+    except ImportError:
+        raise ImportError(('Install indexed_gzip to read gzipped images '
+                           'through a seek point index.'))
+
+    indexfilename = filename + '.gzidx'
+    if op.exists(indexfilename) and \
+       op.getmtime(indexfilename)>=op.getmtime(filename):
+        fobj = IndexedGzipFile(filename, index_file=indexfilename)
     else:
+        fobj = IndexedGzipFile(filename, spacing=spacing)
+        fobj.build_full_index()
+        try:
+            fobj.export_index(indexfilename)
+        except (IOError, OSError):
+            warnings.warn('Could not save gzip seek point index to ' +
+                          indexfilename, RuntimeWarning)
+
+    try:
+        # NIfTI-1 and NIfTI-2 are told apart by the header size
+        fobj.seek(0)
+        sizeof_hdr = np.frombuffer(fobj.read(4), dtype=np.int32)[0]
+        fobj.seek(0)
+        if sizeof_hdr in (540, np.int32(540).byteswap()):
+            klass = nib.Nifti2Image
+        else:
+            klass = nib.Nifti1Image
 
+        return klass.from_file_map(klass.make_file_map({'image': fobj}),
+                                   **kwargs)
+    except BaseException:
+        fobj.close()
+        raise
 
-        # we are working with the 2020 PET-BIDS format
-        # Tags:
-        # FrameDuration: Time duration of each frame in default unit seconds.
-        # FrameTimesStart: Start times for all frames relative to TimeZero in default unit seconds.
-        # ScanStart: in the default unit seconds.
-        # InjectionStart: in the default unit seconds.
-        time_unit = 's'
-        frameStart = Quantity(np.array(json_dict['FrameTimesStart']),
-                               time_unit)
-        frameDuration = Quantity(np.array(json_dict['FrameDuration']),
-                                 time_unit)
-        frameEnd = frameStart + frameDuration
-
-        # ScanStart: Time of start of scan with respect to TimeZero in the default unit seconds.
-        # InjectionStart: Time of start of injection with respect to TimeZero in the default unit seconds. 
-        # This corresponds to DICOM Tag (0018,1042) converted to seconds relative to TimeZero.
-
-        # In the current PET-BIDS format: TimeZero comes with the unit "hh:mm:ss" and should be equal to InjectionStart or ScanStart.
-        # Units in our format: "ScanStartUnits": "hh:mm:ss"; "InjectionStartUnits": "hh:mm:ss".
-        # TimeZero: Time zero to which all scan and/or blood measurements have been adjusted to.
-        # InjectionStart = json_dict['TimeZero']
-        # ScanStart = json_dict['TimeZero']
-
-    return frameStart, frameEnd, json_dict
-
-def _jsonwrite_frameTiming(frameStart, frameEnd,
-                           jsonfilename, json_dict={}, time_unit='sec'):
-    '''
-    Write PET-BIDS style json sidecar
-
-    Args:
-        frameStart (temporalimage.Quantity):
-            vector containing the start times of each frame
-        frameEnd (temporalimage.Quantity):
-            vector containing the end times of each frame
-        jsonfilename (str): output path
-        json_dict (dict): json dictionary
-        time_unit (str): units of time to be used in the output json
-    '''
-    #json_dict['Time'] = { 'FrameTimes': {
-    #                        'Labels': ['frameStart', 'frameEnd'],
-    #                        'Units': [time_unit, time_unit],
-    #                        'Values': np.vstack((
-    #                                  frameStart.to(time_unit).magnitude,
-    #                                  frameEnd.to(time_unit).magnitude)).T.tolist()
-    #                       } }
-
-    json_dict['Time'] = {
-        'FrameTimesStart': frameStart.to(time_unit).magnitude,
-        'FrameTimesStartUnits': time_unit,
-        'FrameDuration': (frameEnd - frameStart).to(time_unit).magnitude,
-        'FrameDurationUnits': time_unit
-    }
-
-    with open(jsonfilename, 'w') as f:
-        json.dump(json_dict, f)
-
-def load(filename, timingfilename, **kwargs):
+def load(filename, timingfilename, computeDtype=None, cache=None,
+         seekIndex=False, **kwargs):
     '''
     Load a temporal image
 
     Args:
         filename (str): path to 4D image file to load
         timingfilename (str): path to csv file containing frame timing information
+        computeDtype (str or numpy.dtype): floating point data type used for
+            computations on the image, or 'native' (see set_computeDtype).
+            If None, the default set by set_computeDtype is used.
+        cache (temporalimage.cache.DecompressedImageCache or str or bool):
+            cache (or cache directory) to load .nii.gz images through, so
+            that they are decompressed only once and memory-mapped afterwards.
+            If None, the default cache is used if it is enabled (see
+            temporalimage.cache.get_default_cache). If True, the default
+            cache is used, and must be enabled. If False, no cache is used.
+        seekIndex (bool): read .nii.gz images through a gzip seek point index
+            that is persisted in a sidecar file, so that frame-sliced reads
+            do not decompress the preceding frames (requires indexed_gzip;
+            see _load_seekable_gzip). Ignored if the image is cached. The
+            indexed file is kept open until the image is closed (see
+            TemporalImage.close).
+        kwargs (dict): any argument that nibabel.load takes
 
     Returns:
         ti (temporalimage.TemporalImage): the temporal image object
@@ -540,52 +1471,110 @@ def load(filename, timingfilename, **kwargs):
     if not op.exists(timingfilename):
         raise FileNotFoundError("No such file: '%s'" % timingfilename)
 
-    img = nibload(filename, **kwargs)
-
-    _, timingfileext = op.splitext(timingfilename)
-    if timingfileext=='.csv':
-        frameStart, frameEnd = _csvread_frameTiming(timingfilename)
-        sif_header = ''
-        json_dict = {}
-    elif timingfileext=='.sif':
-        frameStart, frameEnd, sif_header = _sifread_frameTiming(timingfilename)
-        json_dict = {}
-    elif timingfileext=='.json':
-        frameStart, frameEnd, json_dict = _jsonread_frameTiming(timingfilename)
-        sif_header = ''
+    if cache is None or cache is True:
+        from .cache import get_default_cache, CACHE_DIR_ENV
+        required = cache is True
+        cache = get_default_cache()
+        if required and cache is None:
+            raise ValueError(('The default cache is not enabled: set the %s '
+                              'environment variable to the cache directory')
+                             % CACHE_DIR_ENV)
+    elif isinstance(cache, str):
+        from .cache import DecompressedImageCache
+        cache = DecompressedImageCache(cache)
+
+    if cache and filename.endswith('.nii.gz'):
+        filename = cache.get(filename)
+
+    frameStart, frameEnd, sif_header, json_dict = \
+        read_frameTiming(timingfilename)
+
+    if seekIndex and filename.endswith('.nii.gz'):
+        img = _load_seekable_gzip(filename, **kwargs)
     else:
-        raise IOError('Timing files with extension ' + timingfileext + ' are not supported')
+        img = nibload(filename, **kwargs)
 
     ti = TemporalImage(img.dataobj, img.affine, frameStart, frameEnd,
                        header=img.header, extra=img.extra, file_map=img.file_map,
-                       sif_header=sif_header, json_dict=json_dict)
+                       sif_header=sif_header, json_dict=json_dict,
+                       computeDtype=computeDtype)
     return ti
 
-def save(img, filename, timingfilename, time_unit=None):
+def _is_unscaled(dataobj):
+    '''
+    Check whether the values of a data object are its stored values, i.e.,
+    they are not scaled by a slope and intercept
+    '''
+    if isinstance(dataobj, _FrameSlicedProxy):
+        dataobj = dataobj._dataobj
+    return getattr(dataobj, 'slope', 1)==1 and getattr(dataobj, 'inter', 0)==0
+
+def _needs_data_range(img, dtype):
+    '''
+    Check whether the data of a temporal image must be scaled to be saved as
+    dtype, as in nibabel.save: integer data types require scaling unless the
+    data are already stored as integers that fit into dtype
+    '''
+    return not issubclass(dtype.type, np.floating) and \
+           not (np.can_cast(img.dataobj.dtype, dtype) and
+                _is_unscaled(img.dataobj))
+
+def save(img, filename, timingfilename, time_unit=None, memoryLimit=None,
+         numThreads=None, dtype=None, compresslevel=1):
     '''
     Save a temporal image
 
+    NIfTI images (.nii or .nii.gz) are streamed to disk in chunks of time
+    frames (see temporalimage.writer.TemporalImageWriter), so that images
+    whose data are not in memory are never fully loaded. Other formats are
+    saved with nibabel.save.
+
     Args:
         img (temporalimage.TemporalImage): temporal 4D image to save
-        filename (str): output image file name
+        filename (str): output image file name. Images are gzip-compressed
+                        if the file name ends with .gz.
         timingfilename (str): output file name for timing information
         time_unit (str): units of time to be used in the output
+        memoryLimit (int): maximum number of bytes of image data to read at
+                           once (see TemporalImage._iter_frame_chunks).
+                           If None, all frames are read at once.
+        numThreads (int): number of threads to gzip-compress .nii.gz images
+                          with. If None, a single thread is used.
+        dtype (numpy.dtype): on-disk data type (e.g., 'float32', or 'int16'
+                             to store the data scaled to the int16 range).
+                             If None, the data type of the image header is
+                             used.
+        compresslevel (int): gzip compression level (0-9) of .nii.gz images
     '''
-    from nibabel import save as nibsave
-    import os.path as op
-
-    nibsave(img, filename)
-
-    _, timingfileext = op.splitext(timingfilename)
-    if timingfileext=='.csv':
-        _csvwrite_frameTiming(img.frameStart, img.frameEnd, timingfilename,
-                              time_unit='min' if time_unit is None else time_unit)
-    elif timingfileext=='.sif':
-        _sifwrite_frameTiming(img.frameStart, img.frameEnd, timingfilename,
-                              sif_header=img.sif_header)
-    elif timingfileext=='.json':
-        _jsonwrite_frameTiming(img.frameStart, img.frameEnd, timingfilename,
-                               json_dict=img.json_dict,
-                               time_unit='sec' if time_unit is None else time_unit)
+    from .writer import TemporalImageWriter
+
+    dtype = img.get_data_dtype() if dtype is None else np.dtype(dtype)
+
+    if filename.endswith(('.nii', '.nii.gz')):
+        dataRange = None
+        if _needs_data_range(img, dtype):
+            dataRange = (np.inf, -np.inf)
+            for _, chunk in img._iter_frame_chunks(memoryLimit):
+                dataRange = (min(dataRange[0], np.nanmin(chunk)),
+                             max(dataRange[1], np.nanmax(chunk)))
+
+        with TemporalImageWriter(filename, img.shape, img.affine,
+                                 header=img.header, dtype=dtype,
+                                 dataRange=dataRange,
+                                 compresslevel=compresslevel,
+                                 numThreads=numThreads) as writer:
+            for _, chunk in img._iter_frame_chunks(memoryLimit):
+                writer.write(chunk)
     else:
-        raise IOError('Timing files with extension ' + timingfileext + ' are not supported')
+        from nibabel import save as nibsave
+
+        if not dtype==img.get_data_dtype():
+            header = img.header.copy()
+            header.set_data_dtype(dtype)
+            img = TemporalImage(img.dataobj, img.affine, img.frameStart,
+                                img.frameEnd, header)
+        nibsave(img, filename)
+
+    write_frameTiming(img.frameStart, img.frameEnd, timingfilename,
+                      time_unit=time_unit, sif_header=img.sif_header,
+                      json_dict=img.json_dict)
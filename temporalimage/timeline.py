@@ -0,0 +1,243 @@
+import numpy as np
+
+class FrameTimeline(object):
+    '''
+    Class to represent the frame timing of a 4D temporal image
+
+    Frame start and end times are stored as float arrays in a single time unit
+    (that of frameStart), and frame durations and mid-times are computed once.
+    Time-to-frame lookups are done with binary searches on these arrays, and
+    pint Quantities are only created when requested.
+
+    Args:
+        frameStart (temporalimage.Quantity):
+            vector containing the start times of each frame
+        frameEnd (temporalimage.Quantity):
+            vector containing the end times of each frame
+    '''
+
+    def __init__(self, frameStart, frameEnd):
+        if not len(frameStart)==len(frameEnd):
+            raise ValueError(('There should be equal number of frame start and '
+                              'frame end times'))
+
+        if not (frameStart.check('[time]') and frameEnd.check('[time]')):
+            raise ValueError(('Frame start and frame end should be specified '
+                              'in valid time units'))
+
+        self._set_magnitudes(frameStart.magnitude,
+                             frameEnd.to(frameStart.units).magnitude,
+                             frameStart.units)
+
+    @classmethod
+    def _from_magnitudes(klass, start, end, unit):
+        timeline = klass.__new__(klass)
+        timeline._set_magnitudes(start, end, unit)
+        return timeline
+
+    def _set_magnitudes(self, start, end, unit):
+        self.unit = unit
+        self.start = np.array(start, dtype=np.float64, ndmin=1)
+        self.end = np.array(end, dtype=np.float64, ndmin=1)
+        self.duration = self.end - self.start
+        self.midTime = (self.start + self.end)/2
+
+        # cached arrays are shared with derived Quantities, so protect them
+        for arr in (self.start, self.end, self.duration, self.midTime):
+            arr.flags.writeable = False
+
+        # binary search is only valid if frames are in chronological order
+        self._sorted = bool(np.all(np.diff(self.start)>=0) and
+                            np.all(np.diff(self.end)>=0))
+        self._quantities = {}
+
+    def __len__(self):
+        return len(self.start)
+
+    def __getitem__(self, sliceObj):
+        '''
+        Get the timeline of a subset of the time frames
+
+        Args:
+            sliceObj (slice): time frames to keep
+
+        Returns:
+            timeline (temporalimage.FrameTimeline): timeline of the subset
+        '''
+        if not isinstance(sliceObj, slice):
+            raise TypeError('Timelines can only be indexed with slices')
+        return FrameTimeline._from_magnitudes(self.start[sliceObj],
+                                              self.end[sliceObj], self.unit)
+
+    def _quantity(self, name):
+        if name not in self._quantities:
+            from . import Quantity # via pint
+            self._quantities[name] = Quantity(getattr(self, name), self.unit)
+        return self._quantities[name]
+
+    def get_frameStart(self):
+        ''' Get the array of starting times for each frame
+        '''
+        return self._quantity('start')
+
+    def get_frameEnd(self):
+        ''' Get the array of ending times for each frame
+        '''
+        return self._quantity('end')
+
+    def get_frameDuration(self):
+        ''' Get the array of durations for each frame
+        '''
+        return self._quantity('duration')
+
+    def get_midTime(self):
+        ''' Get the array of mid-time point for each frame
+        '''
+        return self._quantity('midTime')
+
+    def to_magnitude(self, time):
+        '''
+        Convert a time to a float (array) in the unit of the timeline
+
+        Args:
+            time (temporalimage.Quantity): time (or array of times)
+
+        Returns:
+            magnitude (float or numpy.ndarray): time in the unit of the timeline
+        '''
+        return time.to(self.unit).magnitude
+
+    def time_to_frame(self, time):
+        '''
+        Find the time frame that contains a given time
+
+        Frames are taken to include their start time and exclude their end
+        time.
+
+        Args:
+            time (temporalimage.Quantity): time (or array of times)
+
+        Returns:
+            frameIndex (int or numpy.ndarray): index of the frame containing
+                                               time, or -1 if no frame does
+        '''
+        t = np.asarray(self.to_magnitude(time), dtype=np.float64)
+        if self._sorted:
+            frameIndex = np.searchsorted(self.end, t, side='right')
+            inFrame = (frameIndex<len(self)) & \
+                      (self.start[np.minimum(frameIndex, len(self)-1)]<=t)
+        else:
+            isInFrame = (self.start<=t[...,np.newaxis]) & \
+                        (self.end>t[...,np.newaxis])
+            frameIndex = isInFrame.argmax(axis=-1)
+            inFrame = isInFrame.any(axis=-1)
+        frameIndex = np.where(inFrame, frameIndex, -1)
+        return int(frameIndex) if frameIndex.ndim==0 else frameIndex
+
+    def window(self, startTime, endTime):
+        '''
+        Find the time frames that fall within a time window
+
+        Args:
+            startTime (temporalimage.Quantity): time at which to begin, inclusive
+            endTime (temporalimage.Quantity): time at which to stop, exclusive
+
+        Returns:
+            sliceObj (slice): time frames that start at or after startTime and
+                              end at or before endTime
+        '''
+        startIndex, endIndex = self._window_indices(self.to_magnitude(startTime),
+                                                    self.to_magnitude(endTime))
+        return slice(startIndex, endIndex)
+
+    def resolve_window(self, startTime, endTime):
+        '''
+        Find the time frames to extract for a time window, warning if the
+        window had to be adjusted to match the frame timing
+        (see TemporalImage.extractTime)
+
+        Args:
+            startTime (temporalimage.Quantity): time at which to begin, inclusive
+            endTime (temporalimage.Quantity): time at which to stop, exclusive
+
+        Returns:
+            sliceObj (slice): time frames within the window
+        '''
+        import warnings
+
+        timeline = self
+
+        # convert times to the timeline unit once, and compare floats
+        start = timeline.to_magnitude(startTime)
+        end = timeline.to_magnitude(endTime)
+
+        if start >= end:
+            raise ValueError('Start time must be before end time')
+
+        if start < timeline.start[0]:
+            startTime = self.get_frameStart()[0]
+            start = timeline.start[0]
+            warnings.warn(('Specified start time is before the start time of '
+                           'the first frame. Constraining start time to be the '
+                           'start time of the first frame.'), RuntimeWarning)
+        elif start > timeline.end[-1]:
+            raise ValueError(('Start time is beyond the time covered by the '
+                              'time series data!'))
+
+        if end > timeline.end[-1]:
+            endTime = self.get_frameEnd()[-1]
+            end = timeline.end[-1]
+            warnings.warn('Specified end time is beyond the end time of the '
+                          'last frame. Constraining end time to be the end '
+                          'time of the last frame.', RuntimeWarning)
+        elif end < timeline.start[0]:
+            raise ValueError(('End time is prior to the time covered by the '
+                              'time series data!'))
+
+        # find the first time frame with frameStart at or shortest after the
+        # specified start time, and the first time frame with frameEnd
+        # shortest after the specified end time
+        startIndex, endIndex = timeline._window_indices(start, end)
+
+        # another sanity check, mainly to make sure that startIndex!=endIndex
+        if not startIndex<endIndex:
+            raise ValueError('Start index must be smaller than end index')
+
+        if not timeline.start[startIndex]==start:
+            warnings.warn("Specified start time " + str(startTime) + \
+                          " did not match the start time of any of the frames." +
+                          " Using " + str(self.get_frameStart()[startIndex]) + \
+                          " as start time instead.",
+                          RuntimeWarning)
+        if not timeline.end[endIndex-1]==end:
+            warnings.warn("Specified end time " + str(endTime) + \
+                          " did not match the end time of any of the frames." +
+                          " Using " + str(self.get_frameEnd()[endIndex-1]) + \
+                          " as end time instead.",
+                          RuntimeWarning)
+
+        return slice(startIndex,endIndex)
+
+    def _window_indices(self, start, end):
+        # first time frame with frameStart at or after the start time
+        # (last frame if there is none)
+        startIndex = self._first_index(self.start, start, inclusive=True)
+        startIndex = int(min(startIndex, len(self)-1))
+
+        # first time frame with frameEnd after the end time
+        # (number of frames if there is none)
+        endIndex = int(self._first_index(self.end, end, inclusive=False))
+
+        return startIndex, endIndex
+
+    def _first_index(self, times, t, inclusive):
+        '''
+        Index of the first element of times that is >= t (inclusive) or > t
+        (not inclusive), or len(times) if there is no such element
+        '''
+        if self._sorted:
+            return np.searchsorted(times, t, side='left' if inclusive else 'right')
+
+        t = np.asarray(t)
+        after = times>=t[...,np.newaxis] if inclusive else times>t[...,np.newaxis]
+        return np.where(after.any(axis=-1), after.argmax(axis=-1), len(times))
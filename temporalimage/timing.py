@@ -0,0 +1,356 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# maximum number of parsed timing files to keep in memory (see read_frameTiming)
+TIMING_CACHE_SIZE = 4096
+
+_timingCache = OrderedDict()
+_timingCacheLock = threading.Lock()
+
+def _to_unit(values, fromUnit, toUnit):
+    '''
+    Convert an array of times between units, going through pint only if the
+    units differ
+    '''
+    if fromUnit==toUnit:
+        return values
+    from . import Quantity # via pint
+    return Quantity(values, fromUnit).to(toUnit).magnitude
+
+def _csvread_frameTiming(csvfilename):
+    '''
+    Read frame timing information from csv file
+    csv file should include a column named 'Duration of time frame (<X>)' and
+    another named 'Elapsed time (<X>)', where <X> is a valid time unit
+    (i.e., min, s, sec, ms, msec, ...)
+
+    Args:
+        csvfilename (str): path to csv file containing frame timing information
+
+    Returns:
+        frameStart (numpy.ndarray): start times of each frame
+        frameEnd (numpy.ndarray): end times of each frame
+        time_unit (str): time unit of frameStart and frameEnd
+    '''
+    import csv
+
+    with open(csvfilename, 'r', newline='') as f:
+        lines = f.read().splitlines()
+
+    header = next(csv.reader(lines[:1]))
+
+    colEnd = colDuration = None
+    for i, col in enumerate(header):
+        try:
+            col_trimmed, time_unit, _ = col.replace(')','(').split('(')
+        except ValueError:
+            continue
+        col_trimmed = col_trimmed.strip()
+        time_unit = time_unit.strip()
+
+        if col_trimmed=='Elapsed time' and colEnd is None:
+            colEnd, endUnit = i, time_unit
+        elif col_trimmed=='Duration of time frame' and colDuration is None:
+            colDuration, durationUnit = i, time_unit
+
+    if colEnd is None or colDuration is None:
+        raise ValueError(('csv file should include "Duration of time frame" '
+                          'and "Elapsed time" columns'))
+
+    frameTiming = np.loadtxt(lines[1:], delimiter=',',
+                             usecols=(colEnd, colDuration), ndmin=2,
+                             dtype=np.float64)
+
+    frameEnd = frameTiming[:,0]
+    frameDuration = _to_unit(frameTiming[:,1], durationUnit, endUnit)
+
+    return frameEnd - frameDuration, frameEnd, endUnit
+
+def _csvwrite_frameTiming(frameStart, frameEnd, csvfilename, time_unit='min'):
+    '''
+    Write frame timing information to csv file
+    There will be one column named 'Duration of time frame (min)'
+    and another named 'Elapsed time (min)'
+
+    Args:
+        frameStart (temporalimage.Quantity):
+            vector containing the start times of each frame
+        frameEnd (temporalimage.Quantity):
+            vector containing the end times of each frame
+        csvfilename (str): path to output csv file
+        time_unit (str): time unit for the output csv file
+    '''
+    import csv
+
+    frameDuration = (frameEnd - frameStart).to(time_unit).magnitude
+
+    with open(csvfilename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Duration of time frame ('+time_unit+')',
+                         'Elapsed time ('+time_unit+')'])
+        writer.writerows(zip(frameDuration.tolist(),
+                             frameEnd.to(time_unit).magnitude.tolist()))
+
+def _sifread_frameTiming(sifname):
+    '''
+    Read frame timing information from Scan Information File (SIF)
+
+    Args:
+        sifname (str): path to sif containing frame timing information
+
+    Returns:
+        frameStart (numpy.ndarray): start times of each frame
+        frameEnd (numpy.ndarray): end times of each frame
+        time_unit (str): time unit of frameStart and frameEnd
+        sif_header (str): first row of SIF
+    '''
+    with open(sifname, 'r') as f:
+        lines = f.read().splitlines()
+
+    sif_header = lines[0].strip() if lines else ''
+
+    frameTiming = np.loadtxt(lines[1:], usecols=(0,1), ndmin=2,
+                             dtype=np.float64)
+
+    # for SIF, we assume that the time unit is seconds
+    return frameTiming[:,0], frameTiming[:,1], 'sec', sif_header
+
+def _sifwrite_frameTiming(frameStart, frameEnd, sifname, sif_header=''):
+    '''
+    Write frame timing information to Scan Information File (SIF)
+
+    Args:
+        frameStart (temporalimage.Quantity):
+            vector containing the start times of each frame
+        frameEnd (temporalimage.Quantity):
+            vector containing the end times of each frame
+        sifname (str): path to output SIF
+        sif_header (str): first row of SIF
+    '''
+    # the first row is always the header (even if empty), since SIF readers
+    # skip it
+    with open(sifname, 'w') as f:
+        f.write(sif_header + '\n')
+        np.savetxt(f, np.vstack((frameStart.to('sec').magnitude,
+                                 frameEnd.to('sec').magnitude)).T, fmt='%f')
+
+def _jsonread_frameTiming(jsonfilename):
+    '''
+    Read frame timing information from PET-BIDS json sidecar
+
+    Three layouts are supported, and the layout is determined from the keys
+    that are present:
+
+    - 2020 PET-BIDS: FrameTimesStart and FrameDuration (in seconds)
+    - Time: {FrameTimesStart, FrameTimesStartUnits,
+             FrameDuration, FrameDurationUnits} (units default to seconds)
+    - Time: {FrameTimes: {Values, Labels, Units}} where Labels include
+            frameStart and either frameEnd or frameDuration
+
+    Args:
+        jsonfilename (str): BIDS json sidecar file name
+
+    Returns:
+        frameStart (numpy.ndarray): start times of each frame
+        frameEnd (numpy.ndarray): end times of each frame
+        time_unit (str): time unit of frameStart and frameEnd
+        json_dict (dict): json dictionary
+    '''
+    from json import load as json_load
+
+    with open(jsonfilename, 'r') as f:
+        json_dict = json_load(f)
+
+    timing = json_dict.get('Time')
+
+    if timing is None:
+        # we are working with the 2020 PET-BIDS format
+        # Tags:
+        # FrameDuration: Time duration of each frame in default unit seconds.
+        # FrameTimesStart: Start times for all frames relative to TimeZero in
+        #                  default unit seconds.
+        time_unit = 's'
+        frameStart = np.asarray(json_dict['FrameTimesStart'], dtype=np.float64)
+        frameDuration = np.asarray(json_dict['FrameDuration'], dtype=np.float64)
+        frameEnd = frameStart + frameDuration
+
+    elif 'FrameTimes' in timing:
+        # older format
+        #
+        # Time
+        # |__FrameTimes
+        #    |__Values
+        #    |__Labels: frameStart, frameEnd, frameDuration
+        #    |__Units
+        labels = timing['FrameTimes']['Labels']
+        units = timing['FrameTimes']['Units']
+        frameVals = np.asarray(timing['FrameTimes']['Values'],
+                               dtype=np.float64).reshape((-1, len(labels)))
+
+        col_frameStart = labels.index('frameStart')
+        time_unit = units[col_frameStart]
+        frameStart = frameVals[:,col_frameStart]
+
+        if 'frameEnd' in labels:
+            col_frameEnd = labels.index('frameEnd')
+            frameEnd = _to_unit(frameVals[:,col_frameEnd],
+                                units[col_frameEnd], time_unit)
+        else:
+            col_frameDuration = labels.index('frameDuration')
+            frameEnd = frameStart + _to_unit(frameVals[:,col_frameDuration],
+                                             units[col_frameDuration],
+                                             time_unit)
+
+    else:
+        # intermediate PET-BIDS version that allowed for different units
+        #
+        # Time
+        # |__FrameTimesStartUnits
+        # |__FrameTimesStart
+        # |__FrameDurationUnits
+        # |__FrameDuration
+        time_unit = timing.get('FrameTimesStartUnits', 's')
+        frameStart = np.asarray(timing['FrameTimesStart'], dtype=np.float64)
+        frameDuration = _to_unit(np.asarray(timing['FrameDuration'],
+                                            dtype=np.float64),
+                                 timing.get('FrameDurationUnits', 's'),
+                                 time_unit)
+        frameEnd = frameStart + frameDuration
+
+    return frameStart, frameEnd, time_unit, json_dict
+
+def _jsonwrite_frameTiming(frameStart, frameEnd,
+                           jsonfilename, json_dict={}, time_unit='sec'):
+    '''
+    Write PET-BIDS style json sidecar
+
+    Args:
+        frameStart (temporalimage.Quantity):
+            vector containing the start times of each frame
+        frameEnd (temporalimage.Quantity):
+            vector containing the end times of each frame
+        jsonfilename (str): output path
+        json_dict (dict): json dictionary
+        time_unit (str): units of time to be used in the output json
+    '''
+    from json import dump as json_dump
+
+    # do not modify the dictionary of the image being saved
+    json_dict = dict(json_dict)
+    json_dict['Time'] = {
+        'FrameTimesStart': frameStart.to(time_unit).magnitude.tolist(),
+        'FrameTimesStartUnits': time_unit,
+        'FrameDuration': (frameEnd - frameStart).to(time_unit).magnitude.tolist(),
+        'FrameDurationUnits': time_unit
+    }
+
+    with open(jsonfilename, 'w') as f:
+        json_dump(json_dict, f)
+
+def _parse_frameTiming(timingfilename):
+    '''
+    Parse a timing file according to its extension
+
+    Returns:
+        frameStart (numpy.ndarray): start times of each frame
+        frameEnd (numpy.ndarray): end times of each frame
+        time_unit (str): time unit of frameStart and frameEnd
+        sif_header (str): first row of SIF ('' for other formats)
+        json_dict (dict): json dictionary ({} for other formats)
+    '''
+    _, timingfileext = os.path.splitext(timingfilename)
+    if timingfileext=='.csv':
+        frameStart, frameEnd, time_unit = _csvread_frameTiming(timingfilename)
+        return frameStart, frameEnd, time_unit, '', {}
+    elif timingfileext=='.sif':
+        frameStart, frameEnd, time_unit, sif_header = \
+            _sifread_frameTiming(timingfilename)
+        return frameStart, frameEnd, time_unit, sif_header, {}
+    elif timingfileext=='.json':
+        frameStart, frameEnd, time_unit, json_dict = \
+            _jsonread_frameTiming(timingfilename)
+        return frameStart, frameEnd, time_unit, '', json_dict
+    else:
+        raise IOError('Timing files with extension ' + timingfileext + ' are not supported')
+
+def read_frameTiming(timingfilename):
+    '''
+    Read frame timing information from a csv, sif, or json file
+
+    Parsed files are memoized by path, modification time and size, so that
+    reading the same (unchanged) timing file again does not re-parse it.
+
+    Args:
+        timingfilename (str): path to timing file
+
+    Returns:
+        frameStart (temporalimage.Quantity):
+            vector containing the start times of each frame
+        frameEnd (temporalimage.Quantity):
+            vector containing the end times of each frame
+        sif_header (str): first row of SIF ('' for other formats)
+        json_dict (dict): json dictionary ({} for other formats)
+    '''
+    from copy import deepcopy
+    from . import Quantity # via pint
+
+    stat = os.stat(timingfilename)
+    key = (os.path.abspath(timingfilename), stat.st_mtime_ns, stat.st_size)
+
+    with _timingCacheLock:
+        parsed = _timingCache.get(key)
+        if parsed is not None:
+            _timingCache.move_to_end(key)
+
+    if parsed is None:
+        parsed = _parse_frameTiming(timingfilename)
+        with _timingCacheLock:
+            _timingCache[key] = parsed
+            while len(_timingCache)>TIMING_CACHE_SIZE:
+                _timingCache.popitem(last=False)
+
+    frameStart, frameEnd, time_unit, sif_header, json_dict = parsed
+
+    return (Quantity(frameStart.copy(), time_unit),
+            Quantity(frameEnd.copy(), time_unit),
+            sif_header, deepcopy(json_dict))
+
+def write_frameTiming(frameStart, frameEnd, timingfilename, time_unit=None,
+                      sif_header='', json_dict={}):
+    '''
+    Write frame timing information to a csv, sif, or json file
+
+    Args:
+        frameStart (temporalimage.Quantity):
+            vector containing the start times of each frame
+        frameEnd (temporalimage.Quantity):
+            vector containing the end times of each frame
+        timingfilename (str): output file name for timing information
+        time_unit (str): units of time to be used in the output
+                         (default: min for csv, sec for json; SIF is always
+                         in seconds)
+        sif_header (str): first row of SIF
+        json_dict (dict): json dictionary
+    '''
+    _, timingfileext = os.path.splitext(timingfilename)
+    if timingfileext=='.csv':
+        _csvwrite_frameTiming(frameStart, frameEnd, timingfilename,
+                              time_unit='min' if time_unit is None else time_unit)
+    elif timingfileext=='.sif':
+        _sifwrite_frameTiming(frameStart, frameEnd, timingfilename,
+                              sif_header=sif_header)
+    elif timingfileext=='.json':
+        _jsonwrite_frameTiming(frameStart, frameEnd, timingfilename,
+                               json_dict=json_dict,
+                               time_unit='sec' if time_unit is None else time_unit)
+    else:
+        raise IOError('Timing files with extension ' + timingfileext + ' are not supported')
+
+def clear_timing_cache():
+    '''
+    Forget all memoized timing files (see read_frameTiming)
+    '''
+    with _timingCacheLock:
+        _timingCache.clear()
@@ -0,0 +1,284 @@
+import os
+import numpy as np
+
+def _gzip_block(block, compresslevel):
+    '''
+    Compress a block of bytes into a complete gzip member
+    (zlib releases the GIL while compressing)
+    '''
+    import gzip
+    return gzip.compress(block, compresslevel=compresslevel, mtime=0)
+
+class _ParallelGzipWriter(object):
+    '''
+    Write-only file object that gzip-compresses fixed-size blocks of the
+    written data on a thread pool.
+
+    Each block is compressed into an independent gzip member, and members are
+    written in order, so the output is a valid (multi-member) gzip file.
+    At most two blocks per thread are pending at any time, so that memory use
+    is bounded while compression overlaps with the production of the data.
+
+    Args:
+        fileobj (file object): binary file to write compressed data to
+        compresslevel (int): gzip compression level (0-9)
+        numThreads (int): number of compression threads
+        blockSize (int): number of uncompressed bytes per gzip member
+    '''
+
+    def __init__(self, fileobj, compresslevel, numThreads, blockSize=2**22):
+        from concurrent.futures import ThreadPoolExecutor
+        from collections import deque
+
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.numThreads = numThreads
+        self.blockSize = blockSize
+
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(max_workers=numThreads)
+
+    def _submit(self, block):
+        self._pending.append(self._executor.submit(_gzip_block, block,
+                                                   self.compresslevel))
+        while len(self._pending)>2*self.numThreads:
+            self.fileobj.write(self._pending.popleft().result())
+
+    def write(self, data):
+        self._buffer += data
+        numBlocks = len(self._buffer) // self.blockSize
+        for i in range(numBlocks):
+            self._submit(bytes(self._buffer[i*self.blockSize:(i+1)*self.blockSize]))
+        del self._buffer[:numBlocks*self.blockSize]
+        return len(data)
+
+    def close(self):
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self.fileobj.write(self._pending.popleft().result())
+        finally:
+            for future in self._pending:
+                future.cancel()
+            self._executor.shutdown()
+
+def _scaling(dataRange, dtype, sourceDtype=np.float64):
+    '''
+    Get the scaling of data with a given range to an on-disk data type,
+    as chosen by nibabel when saving an array with that range
+
+    Args:
+        dataRange (tuple): (min, max) of the data
+        dtype (numpy.dtype): on-disk data type
+        sourceDtype (numpy.dtype): data type of the data
+
+    Returns:
+        slope (float): scaling slope
+        inter (float): scaling intercept
+    '''
+    from nibabel.arraywriters import make_array_writer
+
+    writer = make_array_writer(np.array(dataRange, dtype=sourceDtype), dtype,
+                               True, True)
+    return float(writer.slope), float(writer.inter)
+
+def save_image(img, filename, compresslevel=1):
+    '''
+    Save a nibabel image in a single NIfTI file, with a chosen gzip
+    compression level for .nii.gz files. The image is written to a temporary
+    file that then replaces filename.
+
+    Args:
+        img (nibabel.nifti1.Nifti1Image): image to save
+        filename (str): output image file name (.nii or .nii.gz)
+        compresslevel (int): gzip compression level (0-9)
+    '''
+    import gzip
+
+    tmpname = filename + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(tmpname, 'wb') as f:
+            if filename.endswith('.gz'):
+                with gzip.GzipFile(filename='', mode='wb',
+                                   compresslevel=compresslevel, fileobj=f,
+                                   mtime=0) as gzf:
+                    img.to_file_map(img.make_file_map({'image': gzf}))
+            else:
+                img.to_file_map(img.make_file_map({'image': f}))
+        os.replace(tmpname, filename)
+    finally:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+
+class TemporalImageWriter(object):
+    '''
+    Streaming writer of 4D NIfTI images
+
+    The image header is written first, and time frames are then appended in
+    order as they are produced (see write), so that only the frames being
+    written need to be in memory. Images with a .gz extension are
+    gzip-compressed, optionally on several threads.
+
+    The image is written to a temporary file that replaces filename when all
+    frames are written (see close), so that a partially written image is
+    never left behind under filename. Writers can be used as context managers.
+
+    Args:
+        filename (str): output image file name (.nii or .nii.gz)
+        shape (tuple): 4D shape of the image
+        affine (numpy.ndarray): 4-by-4 affine array relating array coordinates
+                                from the image data array to coordinates in some
+                                RAS+ world coordinate system
+        header (nibabel header): header with image metadata
+        dtype (numpy.dtype): on-disk data type. If None, the data type of
+                             header is used, or float32 if header is None.
+        dataRange (tuple): (min, max) of the data to be written. If dtype is
+                           an integer type, data are scaled to the range of
+                           dtype accordingly. If None, data are not scaled.
+        compresslevel (int): gzip compression level (0-9)
+        numThreads (int): number of threads to gzip-compress with. If None,
+                          data are compressed as they are written, in this
+                          thread.
+    '''
+
+    def __init__(self, filename, shape, affine, header=None, dtype=None,
+                 dataRange=None, compresslevel=1, numThreads=None):
+        import nibabel as nib
+
+        shape = tuple(int(n) for n in shape)
+        if not len(shape)==4:
+            raise ValueError('Image must be 4D')
+        if numThreads is not None and numThreads<1:
+            raise ValueError('Number of threads should be positive')
+
+        if isinstance(header, nib.Nifti2Header):
+            klass = nib.Nifti2Image
+        else:
+            klass = nib.Nifti1Image
+
+        if dtype is None:
+            dtype = np.float32 if header is None else header.get_data_dtype()
+
+        # harmonize the header with the shape and affine the same way
+        # nibabel.save does, without needing the image data
+        img = klass(np.broadcast_to(np.zeros((), dtype=np.float32), shape),
+                    affine, klass.header_class.from_header(header))
+        self.header = img.header
+        self.header.set_data_dtype(dtype)
+        self.dtype = self.header.get_data_dtype()
+
+        if dataRange is not None and \
+           not issubclass(self.dtype.type, np.floating):
+            self.slope, self.inter = _scaling(dataRange, self.dtype)
+            self.header.set_slope_inter(self.slope, self.inter)
+        else:
+            self.slope, self.inter = 1.0, 0.0
+            self.header.set_slope_inter(None, None)
+
+        self.filename = filename
+        self.shape = shape
+        self.numFramesWritten = 0
+
+        self._tmpname = filename + '.' + str(os.getpid()) + '.tmp'
+        self._file = open(self._tmpname, 'wb')
+        if filename.endswith('.gz'):
+            if numThreads is None:
+                import gzip
+                self._stream = gzip.GzipFile(filename='', mode='wb',
+                                             compresslevel=compresslevel,
+                                             fileobj=self._file, mtime=0)
+            else:
+                self._stream = _ParallelGzipWriter(self._file, compresslevel,
+                                                   numThreads)
+        else:
+            self._stream = None
+
+        self._write_header()
+
+    def _output(self):
+        return self._file if self._stream is None else self._stream
+
+    def _write_header(self):
+        from io import BytesIO
+
+        hdrfile = BytesIO()
+        self.header.write_to(hdrfile)
+        hdrBytes = hdrfile.getvalue()
+        # pad up to the data offset
+        offset = int(self.header.get_data_offset())
+        self._output().write(hdrBytes + b'\x00' * (offset - len(hdrBytes)))
+
+    def _encode(self, frames):
+        '''
+        Convert frames to the on-disk data type and byte layout
+        '''
+        if issubclass(self.dtype.type, np.integer):
+            frames = np.asarray(frames, dtype=np.float64)
+            if not (self.slope==1 and self.inter==0):
+                frames = (frames - self.inter) / self.slope
+            info = np.iinfo(self.dtype)
+            frames = np.clip(np.rint(np.nan_to_num(frames)), info.min, info.max)
+        return np.asarray(frames, dtype=self.dtype).tobytes(order='F')
+
+    def write(self, frames):
+        '''
+        Append time frames to the image
+
+        Args:
+            frames (numpy.ndarray): 3D matrix (a single time frame) or 4D
+                                    matrix of consecutive time frames
+        '''
+        frames = np.asanyarray(frames)
+        if frames.ndim==3:
+            frames = frames[...,np.newaxis]
+        if not frames.shape[:3]==self.shape[:3]:
+            raise ValueError(('Frames must be of the same size as the 3D '
+                              'images in the temporal image'))
+        if self.numFramesWritten + frames.shape[3]>self.shape[3]:
+            raise ValueError('More time frames written than specified by shape')
+
+        self._output().write(self._encode(frames))
+        self.numFramesWritten += frames.shape[3]
+
+    def close(self):
+        '''
+        Finish writing the image. All time frames must have been written.
+        '''
+        if self._file.closed:
+            return
+
+        try:
+            if not self.numFramesWritten==self.shape[3]:
+                raise ValueError(('Only %d of %d time frames were written' %
+                                  (self.numFramesWritten, self.shape[3])))
+            if self._stream is not None:
+                self._stream.close()
+            self._file.close()
+            os.replace(self._tmpname, self.filename)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        '''
+        Stop writing the image, and remove the partially written file
+        '''
+        try:
+            if self._stream is not None:
+                self._stream.close()
+        finally:
+            self._file.close()
+            if os.path.exists(self._tmpname):
+                os.remove(self._tmpname)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.close()
+        else:
+            self.abort()
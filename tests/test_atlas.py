@@ -0,0 +1,150 @@
+import temporalimage
+from temporalimage.atlas import AtlasIndex
+from .generate_test_data import generate_fake4D
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import nibabel as nib
+
+class TestAtlasIndex(unittest.TestCase):
+    def setUp(self):
+        imgfile, timingfile, _, _ = generate_fake4D()
+        self.timg = temporalimage.load(imgfile, timingfile)
+
+        self.labelimg = np.zeros(self.timg.shape[:-1], dtype=np.int16)
+        self.labelimg[:,:,4:] = 1
+        self.labelimg[:,:,8:] = 2
+        self.labelimg[:3,:,8:] = 5
+
+        self.tmpdirname = tempfile.mkdtemp()
+        self.labelfilename = os.path.join(self.tmpdirname, 'label.nii.gz')
+        nib.save(nib.Nifti1Image(self.labelimg, self.timg.affine),
+                 self.labelfilename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdirname)
+
+    def test_timeseries(self):
+        atlasIndex = AtlasIndex.from_label_image(self.labelfilename)
+        self.assertEqual(atlasIndex.labels.tolist(), [0, 1, 2, 5])
+        self.assertEqual(atlasIndex.get_counts().sum(), self.labelimg.size)
+
+        labels = [0, 1, 2, 3]
+        composites = [[1, 2], [2, 5, 7]]
+        expected, expectedCounts = self.timg.label_timeseries(
+                                        self.labelimg, labels, composites,
+                                        return_counts=True)
+        tacs, counts = self.timg.label_timeseries(atlasIndex, labels,
+                                                  composites,
+                                                  return_counts=True)
+        self.assertTrue(np.array_equal(counts, expectedCounts))
+        self.assertTrue(np.allclose(tacs, expected, equal_nan=True))
+        self.assertTrue(np.isnan(tacs[3]).all())
+
+        # masked images that contain the labels give the same TACs
+        mimg = self.timg.masked(self.labelimg>0)
+        self.assertTrue(np.allclose(atlasIndex.timeseries(mimg, [1, 5]),
+                                    np.vstack([expected[1],
+                                               self.timg.roi_timeseries(
+                                                   mask=self.labelimg==5)])))
+
+    def test_masked_partial(self):
+        labelimg = np.zeros(self.labelimg.shape, dtype=np.int16)
+        labelimg[:5] = 1
+        labelimg[8:] = 2
+        labelimg[:2] = 3
+        mask = np.zeros(self.labelimg.shape, dtype=bool)
+        mask[3:7] = True
+        mimg = self.timg.masked(mask)
+
+        # only the voxels of each label within the mask are included
+        atlasIndex = AtlasIndex.from_label_image(labelimg)
+        tacs, counts = atlasIndex.timeseries(mimg, [1, 2, 3], [[1, 2]],
+                                             return_counts=True)
+        self.assertEqual(counts.tolist(), [2 * 11 * 12, 0, 0, 2 * 11 * 12])
+        expected = self.timg.roi_timeseries(mask=(labelimg==1) & mask)
+        self.assertTrue(np.allclose(tacs[0], expected))
+        self.assertTrue(np.allclose(tacs[3], expected))
+        self.assertTrue(np.isnan(tacs[1:3]).all())
+        self.assertTrue(np.allclose(tacs[0],
+                                    mimg.roi_timeseries(mask=labelimg==1)))
+
+    def test_float32(self):
+        timg = temporalimage.load(*generate_fake4D()[:2],
+                                  computeDtype='float32')
+        atlasIndex = AtlasIndex.from_label_image(self.labelimg)
+        tacs = atlasIndex.timeseries(timg, [1, 2, 5])
+        self.assertEqual(tacs.dtype, np.float64)
+        self.assertTrue(np.array_equal(
+            tacs, timg.label_timeseries(self.labelimg, [1, 2, 5])))
+
+    def test_save_load(self):
+        atlasIndex = AtlasIndex.from_label_image(self.labelimg, labels=[1, 5],
+                                                 composites=[[1, 5]])
+        self.assertEqual(atlasIndex.labels.tolist(), [1, 5])
+
+        indexfilename = os.path.join(self.tmpdirname, 'index.npz')
+        atlasIndex.save(indexfilename)
+        loaded = AtlasIndex.load(indexfilename)
+        self.assertTrue(np.array_equal(loaded.voxelIndex, atlasIndex.voxelIndex))
+        self.assertTrue(np.array_equal(loaded.offsets, atlasIndex.offsets))
+        self.assertEqual(loaded.gridShape, self.labelimg.shape)
+        self.assertEqual(loaded.composites, [[1, 5]])
+        self.assertIsNone(loaded.affine)
+        self.assertTrue(np.allclose(loaded.timeseries(self.timg),
+                                    self.timg.label_timeseries(
+                                        self.labelimg, [1, 5], [[1, 5]])))
+
+    def test_cached(self):
+        indexfilename = os.path.join(self.tmpdirname, 'index.npz')
+        atlasIndex = AtlasIndex.cached(self.labelfilename, indexfilename)
+        self.assertTrue(os.path.isfile(indexfilename))
+        mtime = os.stat(indexfilename).st_mtime_ns
+
+        reused = AtlasIndex.cached(self.labelfilename, indexfilename)
+        self.assertEqual(os.stat(indexfilename).st_mtime_ns, mtime)
+        self.assertEqual(reused.sourceHash, atlasIndex.sourceHash)
+
+        # a different label image invalidates the index
+        self.labelimg[0,0,0] = 7
+        nib.save(nib.Nifti1Image(self.labelimg, self.timg.affine),
+                 self.labelfilename)
+        rebuilt = AtlasIndex.cached(self.labelfilename, indexfilename)
+        self.assertIn(7, rebuilt.labels.tolist())
+
+    def test_cached_options(self):
+        indexfilename = os.path.join(self.tmpdirname, 'index.npz')
+        atlasIndex = AtlasIndex.cached(self.labelfilename, indexfilename,
+                                       labels=[1, 2])
+        self.assertEqual(atlasIndex.labels.tolist(), [1, 2])
+        self.assertEqual(AtlasIndex.load(indexfilename).indexedLabels, [1, 2])
+
+        # indexes built for other labels or composites are rebuilt
+        atlasIndex = AtlasIndex.cached(self.labelfilename, indexfilename,
+                                       labels=[1, 5])
+        self.assertEqual(atlasIndex.labels.tolist(), [1, 5])
+        atlasIndex = AtlasIndex.cached(self.labelfilename, indexfilename,
+                                       composites=[[1, 5]])
+        self.assertEqual(atlasIndex.labels.tolist(), [0, 1, 2, 5])
+        self.assertEqual(atlasIndex.composites, [[1, 5]])
+
+        # an index of all labels serves any labels, and keeps its composites
+        # unless others are requested
+        mtime = os.stat(indexfilename).st_mtime_ns
+        reused = AtlasIndex.cached(self.labelfilename, indexfilename,
+                                   labels=[2])
+        self.assertEqual(reused.composites, [[1, 5]])
+        self.assertEqual(os.stat(indexfilename).st_mtime_ns, mtime)
+        rebuilt = AtlasIndex.cached(self.labelfilename, indexfilename,
+                                    composites=[[1, 2]])
+        self.assertEqual(rebuilt.composites, [[1, 2]])
+
+    def test_mismatch(self):
+        atlasIndex = AtlasIndex.from_label_image(self.labelimg[:-1])
+        self.assertRaises(ValueError, atlasIndex.timeseries, self.timg)
+
+        atlasIndex = AtlasIndex.from_label_image(
+                        nib.Nifti1Image(self.labelimg, 2 * np.eye(4)))
+        self.assertRaises(ValueError, atlasIndex.timeseries, self.timg)
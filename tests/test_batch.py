@@ -0,0 +1,124 @@
+import temporalimage
+from temporalimage.batch import read_manifest, run_batch, format_report, main
+from .generate_test_data import generate_fake4D
+import unittest
+import os
+import csv
+import shutil
+import tempfile
+import numpy as np
+import nibabel as nib
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.imgfile, self.timingfile, _, _ = generate_fake4D()
+        self.timg = temporalimage.load(self.imgfile, self.timingfile)
+
+        self.tmpdirname = tempfile.mkdtemp()
+        self.outputDir = os.path.join(self.tmpdirname, 'output')
+
+        labelimg = np.zeros(self.timg.shape[:-1], dtype=np.int16)
+        labelimg[...,4:] = 1
+        labelimg[2:5,...,8:] = 2
+        self.labelfile = os.path.join(self.tmpdirname, 'labels.nii.gz')
+        nib.save(nib.Nifti1Image(labelimg, self.timg.affine), self.labelfile)
+        self.labelimg = labelimg
+
+        self.manifest = os.path.join(self.tmpdirname, 'manifest.csv')
+        with open(self.manifest, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['id', 'image', 'timing', 'labels'])
+            writer.writerow(['sub1', self.imgfile, self.timingfile, 'labels.nii.gz'])
+            writer.writerow(['sub2', self.imgfile, self.timingfile, ''])
+
+        self.windows = [(0, 20), (10, 60)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdirname)
+
+    def test_read_manifest(self):
+        rows = read_manifest(self.manifest)
+        self.assertEqual([row['id'] for row in rows], ['sub1', 'sub2'])
+        self.assertEqual(rows[0]['labels'], self.labelfile)
+        self.assertIsNone(rows[1]['labels'])
+
+        badManifest = os.path.join(self.tmpdirname, 'bad.csv')
+        with open(badManifest, 'w') as f:
+            f.write('image\n' + self.imgfile + '\n')
+        self.assertRaises(ValueError, read_manifest, badManifest)
+
+    def _check_outputs(self, report):
+        self.assertEqual(sorted(report['done']), ['sub1', 'sub2'])
+        self.assertEqual(report['failed'], [])
+        self.assertEqual(set(report['stageTimes']),
+                         {'load', 'summarize', 'write'})
+
+        prefix = os.path.join(self.outputDir, 'sub1', 'sub1_10.00to60.00')
+        extr = temporalimage.load(prefix+'min.nii.gz', prefix+'.csv')
+        self.assertEqual(extr.get_numFrames(), 5)
+        self.assertTrue(np.allclose(extr.get_fdata(),
+                                    self.timg.get_fdata()[...,2:]))
+
+        meanImg = nib.load(prefix+'min_mean.nii.gz')
+        self.assertTrue(np.allclose(meanImg.get_fdata(),
+                                    self.timg.get_fdata()[...,2:].mean(axis=-1)))
+
+        with open(prefix+'_ROI_TACs.csv') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual([row[0] for row in rows], ['ROI', '1', '2'])
+        self.assertTrue(np.allclose(
+            np.array(rows[2][1:], dtype=float),
+            self.timg.get_fdata()[self.labelimg==2][:,2:].mean(axis=0)))
+
+        self.assertFalse(os.path.exists(os.path.join(
+            self.outputDir, 'sub2', 'sub2_10.00to60.00_ROI_TACs.csv')))
+
+    def test_run_batch(self):
+        progress = []
+        report = run_batch(self.manifest, self.outputDir, windows=self.windows,
+                           numProcesses=1,
+                           progress=lambda *args: progress.append(args))
+        self._check_outputs(report)
+        self.assertEqual(len(progress), 2)
+        self.assertGreater(report['imagesPerMinute'], 0)
+        self.assertIn('images per minute', format_report(report))
+
+        # rows that were done are skipped
+        report = run_batch(self.manifest, self.outputDir, windows=self.windows,
+                           numProcesses=1)
+        self.assertEqual(sorted(report['skipped']), ['sub1', 'sub2'])
+        self.assertEqual(report['done'], [])
+
+        # unless the options change
+        report = run_batch(self.manifest, self.outputDir, windows=self.windows,
+                           means=False, numProcesses=1)
+        self.assertEqual(sorted(report['done']), ['sub1', 'sub2'])
+
+    def test_run_batch_parallel(self):
+        # the memory budget only allows one row at a time
+        report = run_batch(self.manifest, self.outputDir, windows=self.windows,
+                           memoryLimit=2**12, memoryBudget=1, numProcesses=2)
+        self._check_outputs(report)
+
+    def test_failure(self):
+        rows = read_manifest(self.manifest)
+        rows.append({'id': 'missing', 'labels': None,
+                     'image': os.path.join(self.tmpdirname, 'missing.nii.gz'),
+                     'timing': self.timingfile})
+        report = run_batch(rows, self.outputDir, numProcesses=1)
+        self.assertEqual(report['failed'], ['missing'])
+        self.assertIn('missing', report['errors'])
+        self.assertEqual(sorted(report['done']), ['sub1', 'sub2'])
+
+        # the whole time series is a single window by default
+        self.assertTrue(os.path.exists(os.path.join(
+            self.outputDir, 'sub1', 'sub1_0.00to60.00_ROI_TACs.csv')))
+
+    def test_main(self):
+        self.assertEqual(main([self.manifest, self.outputDir,
+                               '--window', '0', '20', '--window', '10', '60',
+                               '--no-images', '--processes', '1']), 0)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.outputDir, 'sub1', 'sub1_0.00to20.00min_mean.nii.gz')))
+        self.assertFalse(os.path.exists(os.path.join(
+            self.outputDir, 'sub1', 'sub1_0.00to20.00min.nii.gz')))
@@ -0,0 +1,234 @@
+import temporalimage
+from temporalimage import DecompressedImageCache
+from temporalimage.cache import get_default_cache, CACHE_DIR_ENV, \
+                                ResultCache, get_default_result_cache, \
+                                RESULT_CACHE_DIR_ENV
+from .generate_test_data import generate_fake4D
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+import unittest
+import numpy as np
+
+class TestDecompressedImageCache(unittest.TestCase):
+    def setUp(self):
+        self.imgfile, self.timingfile, _, _ = generate_fake4D()
+        self.tmpdirname = mkdtemp()
+        self.cachedir = os.path.join(self.tmpdirname, 'cache')
+
+    def tearDown(self):
+        rmtree(self.tmpdirname)
+
+    def test_load_cached(self):
+        cache = DecompressedImageCache(self.cachedir)
+        timg = temporalimage.load(self.imgfile, self.timingfile, cache=cache)
+        ref = temporalimage.load(self.imgfile, self.timingfile, cache=False)
+
+        self.assertTrue(timg.dataobj.file_like.startswith(cache.directory))
+        self.assertTrue(np.array_equal(timg.get_fdata(), ref.get_fdata()))
+
+        # second load re-uses the decompressed file
+        cachedfile = cache.get(self.imgfile)
+        inode = os.stat(cachedfile).st_ino
+        timg2 = temporalimage.load(self.imgfile, self.timingfile,
+                                   cache=self.cachedir)
+        self.assertEqual(timg2.dataobj.file_like, cachedfile)
+        self.assertEqual(len(cache._cached_files()), 1)
+        self.assertEqual(os.stat(cachedfile).st_ino, inode)
+
+    def test_lru_eviction(self):
+        from shutil import copyfile
+        import gzip
+
+        # a second, different image
+        otherfile = os.path.join(self.tmpdirname, 'other.nii.gz')
+        with gzip.open(self.imgfile, 'rb') as fin, \
+             gzip.open(otherfile, 'wb', compresslevel=1) as fout:
+            fout.write(fin.read()[:-8] + b'\0'*8)
+
+        cache = DecompressedImageCache(self.cachedir)
+        first = cache.get(self.imgfile)
+        os.utime(first, (0, 0))
+        cache.maxSize = os.path.getsize(first)
+
+        second = cache.get(otherfile)
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
+        self.assertLessEqual(cache.get_size(), cache.maxSize)
+
+        # use times are recorded without modifying the cached images
+        mtime = os.stat(second).st_mtime_ns
+        cache.maxSize = 2 * os.path.getsize(second)
+        first = cache.get(self.imgfile)
+        self.assertEqual(cache.get(otherfile), second)
+        self.assertEqual(os.stat(second).st_mtime_ns, mtime)
+        cache.maxSize = os.path.getsize(second)
+        cache.evict()
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
+
+        # copies of an image share a cache entry
+        copied = os.path.join(self.tmpdirname, 'copy.nii.gz')
+        copyfile(otherfile, copied)
+        self.assertEqual(cache.get(copied), second)
+
+        cache.clear()
+        self.assertEqual(cache.get_size(), 0)
+
+    def test_default_cache(self):
+        self.assertIsNone(get_default_cache())
+        self.assertRaises(ValueError, temporalimage.load, self.imgfile,
+                          self.timingfile, cache=True)
+        os.environ[CACHE_DIR_ENV] = self.cachedir
+        try:
+            for cache in [None, True]:
+                timg = temporalimage.load(self.imgfile, self.timingfile,
+                                          cache=cache)
+                self.assertTrue(timg.dataobj.file_like.startswith(
+                                    os.path.abspath(self.cachedir)))
+        finally:
+            del os.environ[CACHE_DIR_ENV]
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.imgfile, self.timingfile, _, _ = generate_fake4D()
+        self.tmpdirname = mkdtemp()
+        self.cachedir = os.path.join(self.tmpdirname, 'results')
+
+    def tearDown(self):
+        rmtree(self.tmpdirname)
+
+    def test_cached_results(self):
+        from unittest import mock
+
+        cache = ResultCache(self.cachedir)
+        timg = temporalimage.load(self.imgfile, self.timingfile)
+        dyn_mean = timg.dynamic_mean(weights='frameduration', cache=cache)
+        self.assertEqual(len(cache._cached_files()), 1)
+
+        # a new image loaded from the same file is not read again
+        timg = temporalimage.load(self.imgfile, self.timingfile)
+        with mock.patch.object(temporalimage.TemporalImage, '_dynamic_mean',
+                               side_effect=AssertionError) as compute:
+            cached = timg.dynamic_mean(weights='frameduration', cache=cache)
+            self.assertFalse(compute.called)
+        self.assertTrue(np.array_equal(cached, dyn_mean))
+        self.assertIsNone(timg._fdata_cache)
+
+        # different parameters, frames or timing are different results
+        timg.dynamic_mean(cache=cache)
+        extractedImg = timg.extractTime(timg.frameStart[2], timg.frameEnd[4])
+        self.assertTrue(np.allclose(extractedImg.dynamic_mean(cache=cache),
+                                    timg.get_fdata()[...,2:5].mean(axis=3)))
+        self.assertEqual(len(cache._cached_files()), 3)
+
+        labelimg = (np.arange(12)>=6) * np.ones(timg.shape[:-1], dtype=int)
+        tacs, counts = timg.label_timeseries(labelimg, [0, 1], [[0, 1]],
+                                             return_counts=True, cache=cache)
+        cachedTacs, cachedCounts = timg.label_timeseries(
+                                       labelimg, [0, 1], [[0, 1]],
+                                       return_counts=True, cache=cache)
+        self.assertTrue(np.array_equal(cachedTacs, tacs))
+        self.assertTrue(np.array_equal(cachedCounts, counts))
+        self.assertTrue(np.array_equal(
+            timg.roi_timeseries(mask=labelimg==1, cache=cache),
+            timg.roi_timeseries(mask=labelimg==1, cache=self.cachedir)))
+        self.assertEqual(len(cache._cached_files()), 5)
+
+        # in-memory images are identified by their data
+        memImg = temporalimage.TemporalImage(timg.get_fdata(), timg.affine,
+                                             timg.frameStart, timg.frameEnd)
+        self.assertEqual(cache.key(memImg, 'dynamic_mean', {}),
+                         cache.key(memImg.extractTime(memImg.frameStart[0],
+                                                      memImg.frameEnd[-1]),
+                                   'dynamic_mean', {}))
+        memImg.get_fdata()[0,0,0,0] += 1
+        memImg = temporalimage.TemporalImage(memImg.get_fdata(), timg.affine,
+                                             timg.frameStart, timg.frameEnd)
+        self.assertNotEqual(cache.key(memImg, 'dynamic_mean', {}),
+                            cache.key(timg, 'dynamic_mean', {}))
+
+    def test_lru_eviction(self):
+        cache = ResultCache(self.cachedir)
+        timg = temporalimage.load(self.imgfile, self.timingfile)
+        first = cache.key(timg, 'test', {'i': 0})
+        cache.put(first, np.zeros(1000))
+        os.utime(cache._result_file(first), (0, 0))
+        cache.maxSize = cache.get_size()
+
+        second = cache.key(timg, 'test', {'i': 1})
+        cache.put(second, (np.ones(1000), np.arange(3)))
+        self.assertIsNone(cache.get(first))
+        result = cache.get(second)
+        self.assertIsInstance(result, tuple)
+        self.assertTrue(np.array_equal(result[1], np.arange(3)))
+
+        cache.clear()
+        self.assertEqual(cache.get_size(), 0)
+        self.assertRaises(TypeError, cache.key, timg, 'test', {'f': object()})
+
+    def test_file_param_key(self):
+        import nibabel as nib
+
+        cache = ResultCache(self.cachedir)
+        timg = temporalimage.load(self.imgfile, self.timingfile)
+        key = cache.key(timg, 'dynamic_mean', {'weights': 'frameduration'})
+
+        # strings are keyed by value, even if a file of that name exists
+        cwd = os.getcwd()
+        os.chdir(self.tmpdirname)
+        try:
+            with open('frameduration', 'w') as f:
+                f.write('not a parameter')
+            self.assertEqual(cache.key(timg, 'dynamic_mean',
+                                       {'weights': 'frameduration'}), key)
+        finally:
+            os.chdir(cwd)
+
+        # file parameters are keyed by the file contents
+        maskfiles = [os.path.join(self.tmpdirname, name)
+                     for name in ['mask1.nii', 'mask2.nii']]
+        mask = np.zeros(timg.shape[:-1])
+        mask[:5] = 1
+        for maskfile in maskfiles:
+            nib.save(nib.Nifti1Image(mask, timg.affine), maskfile)
+        keys = [cache.key(timg, 'roi_timeseries', {'maskfile': maskfile},
+                          fileParams=('maskfile',))
+                for maskfile in maskfiles]
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotEqual(keys[0], cache.key(timg, 'roi_timeseries',
+                                               {'maskfile': maskfiles[0]}))
+
+    def test_decompressed_image_key(self):
+        from unittest import mock
+        from temporalimage import cache as cachemodule
+
+        imageCache = DecompressedImageCache(os.path.join(self.tmpdirname,
+                                                         'images'))
+        cache = ResultCache(self.cachedir)
+        keys = []
+        with mock.patch.object(cachemodule, '_hash_file',
+                               wraps=cachemodule._hash_file) as hashFile:
+            for _ in range(3):
+                timg = temporalimage.load(self.imgfile, self.timingfile,
+                                          cache=imageCache)
+                keys.append(cache.key(timg, 'test', {}))
+            # the compressed and the decompressed image are hashed only once,
+            # since using the decompressed image leaves it unmodified
+            self.assertEqual(hashFile.call_count, 2)
+        self.assertEqual(len(set(keys)), 1)
+
+    def test_default_result_cache(self):
+        self.assertIsNone(get_default_result_cache())
+        timg = temporalimage.load(self.imgfile, self.timingfile)
+        self.assertRaises(ValueError, timg.dynamic_mean, cache=True)
+        os.environ[RESULT_CACHE_DIR_ENV] = self.cachedir
+        try:
+            timg.dynamic_mean()
+            self.assertEqual(len(get_default_result_cache()._cached_files()), 1)
+            timg.dynamic_mean(cache=True, weights='frameduration')
+            self.assertEqual(len(get_default_result_cache()._cached_files()), 2)
+            timg.dynamic_mean(cache=False)
+            self.assertEqual(len(get_default_result_cache()._cached_files()), 2)
+        finally:
+            del os.environ[RESULT_CACHE_DIR_ENV]
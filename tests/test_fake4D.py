@@ -8,6 +8,8 @@ import numpy as np
 class TestTemporalImageFake4D(unittest.TestCase):
     def setUp(self):
         imgfile, timingfile, timingfile_s, timingfile_sif = generate_fake4D()
+        self.imgfile = imgfile
+        self.timingfile = timingfile
         self.timg = temporalimage.load(imgfile, timingfile)
         self.timg_s = temporalimage.load(imgfile, timingfile_s)
         self.timg_sif = temporalimage.load(imgfile, timingfile_sif)
@@ -28,6 +30,26 @@ class TestTemporalImageFake4D(unittest.TestCase):
         self.assertTrue(np.allclose(np.array([5,5] + [10]*5),
                                     self.timg.get_frameDuration().to('min').magnitude))
 
+    def test_set_frameTiming(self):
+        self.timg.build_integral()
+        self.timg.frameStart = Quantity(np.array([0, 5, 10, 20, 30, 40, 55]),
+                                        'minute')
+        self.assertTrue(np.allclose(np.array([5,5] + [10]*4 + [5]),
+                                    self.timg.get_frameDuration().to('min').magnitude))
+        self.assertIsNone(self.timg._integral)
+
+        self.timg.frameEnd = Quantity(np.array([5, 10, 20, 30, 40, 50, 70]),
+                                      'minute')
+        self.assertEqual(Quantity(70,'minute'), self.timg.get_endTime())
+        self.assertEqual(Quantity(55,'minute'),
+                         self.timg.extractTime(Quantity(55,'minute'),
+                                               Quantity(70,'minute')).get_startTime())
+
+        with self.assertRaises(ValueError):
+            self.timg.frameEnd = Quantity(np.array([5, 10]), 'minute')
+        with self.assertRaises(ValueError):
+            self.timg.frameStart = Quantity(np.arange(3), 'minute')
+
     def test_get_frameStart(self):
         self.assertTrue(np.allclose(np.array([0, 5, 10, 20, 30, 40, 50]),
                                     self.timg.get_frameStart().to('min').magnitude))
@@ -113,6 +135,125 @@ class TestTemporalImageFake4D(unittest.TestCase):
         self.assertEqual(extr.get_startTime(), frameStart[2])
         self.assertEqual(extr.get_endTime(), frameEnd[-3])
 
+    def test_extractTime_lazy(self):
+        '''
+        Extraction from an image that has not been loaded yet should not load
+        it, and the extracted data should match the corresponding frames
+        '''
+        frameStart = self.timg.get_frameStart()
+        frameEnd = self.timg.get_frameEnd()
+
+        extr = self.timg.extractTime(frameStart[2], frameEnd[-2])
+        self.assertFalse(self.timg.in_memory)
+        self.assertFalse(extr.in_memory)
+        self.assertEqual(extr.shape, self.timg.shape[:3] + (4,))
+        self.assertTrue(np.allclose(extr.dataobj[1,:,2:4,-1],
+                                    self.timg.get_fdata()[1,:,2:4,5]))
+        self.assertTrue(np.allclose(extr.get_fdata(),
+                                    self.timg.get_fdata()[:,:,:,2:6]))
+
+    def test_extractTime_chained(self):
+        '''
+        Extracting from an extracted image should remain lazy
+        '''
+        frameStart = self.timg.get_frameStart()
+        frameEnd = self.timg.get_frameEnd()
+
+        extr = self.timg.extractTime(frameStart[1], frameEnd[-1])
+        extr2 = extr.extractTime(frameStart[3], frameEnd[-2])
+        self.assertFalse(extr2.in_memory)
+        self.assertEqual(extr2.get_startTime(), frameStart[3])
+        self.assertEqual(extr2.get_endTime(), frameEnd[-2])
+        self.assertTrue(np.allclose(extr2.get_fdata(),
+                                    self.timg.get_fdata()[:,:,:,3:6]))
+
+    def test_extractTime_view(self):
+        '''
+        Views share the data of the original image and are read-only until
+        detached
+        '''
+        frameStart = self.timg.get_frameStart()
+        frameEnd = self.timg.get_frameEnd()
+
+        first, second = self.timg.splitTime(frameStart[3], view=True)
+        extr = second.extractTime(frameStart[4], frameEnd[-1], view=True)
+        dat = self.timg.get_fdata()
+
+        for img in (first, second, extr):
+            self.assertTrue(np.shares_memory(img.get_fdata(), dat))
+        self.assertTrue(np.array_equal(extr.get_fdata(), dat[:,:,:,4:]))
+        self.assertRaises(ValueError, extr.get_fdata().__setitem__,
+                          (0,0,0,0), 1)
+
+        extr.detach()
+        extr.get_fdata()[0,0,0,0] = -1
+        self.assertFalse(np.shares_memory(extr.get_fdata(), dat))
+        self.assertNotEqual(dat[0,0,0,4], -1)
+
+    def test_extractTime_view_mmap(self):
+        '''
+        Views into uncompressed images are copy-on-write memory maps
+        '''
+        from tempfile import mkdtemp
+        from shutil import rmtree
+
+        tmpdirname = mkdtemp()
+        try:
+            imgfilename = os.path.join(tmpdirname, 'img.nii')
+            csvfilename = os.path.join(tmpdirname, 'timingData.csv')
+            temporalimage.save(self.timg, imgfilename, csvfilename)
+            timg = temporalimage.load(imgfilename, csvfilename)
+
+            extr = timg.extractTime(timg.get_frameStart()[2],
+                                    timg.get_endTime(), view=True)
+            self.assertIsInstance(extr.dataobj, np.memmap)
+            self.assertFalse(timg.in_memory)
+            self.assertTrue(np.array_equal(extr.get_fdata(),
+                                           self.timg.get_fdata()[:,:,:,2:]))
+
+            extr.get_fdata()[0,0,0,0] = -1
+            self.assertEqual(extr.get_fdata()[0,0,0,0], -1)
+            self.assertNotEqual(timg.get_fdata()[0,0,0,2], -1)
+            del extr, timg
+        finally:
+            rmtree(tmpdirname)
+
+    def test_seekIndex(self):
+        '''
+        Loading through a gzip seek point index
+        '''
+        try:
+            import indexed_gzip
+        except ImportError:
+            self.skipTest('indexed_gzip is not installed')
+
+        from tempfile import mkdtemp
+        from shutil import copyfile, rmtree
+
+        tmpdirname = mkdtemp()
+        try:
+            imgfilename = os.path.join(tmpdirname, 'img.nii.gz')
+            copyfile(self.imgfile, imgfilename)
+            timingfilename = os.path.join(tmpdirname, 'timingData.csv')
+            copyfile(self.timingfile, timingfilename)
+
+            with temporalimage.load(imgfilename, timingfilename,
+                                    seekIndex=True) as timg:
+                self.assertTrue(os.path.exists(imgfilename + '.gzidx'))
+            self.assertTrue(timg.dataobj.file_like.closed)
+
+            # second load re-uses the saved index
+            with temporalimage.load(imgfilename, timingfilename,
+                                    seekIndex=True) as timg:
+                extr = timg.extractTime(timg.get_frameStart()[-2],
+                                        timg.get_endTime())
+                self.assertTrue(np.array_equal(extr.get_fdata(),
+                                               self.timg.get_fdata()[:,:,:,-2:]))
+            self.assertTrue(timg.dataobj.file_like.closed)
+            del timg, extr
+        finally:
+            rmtree(tmpdirname)
+
     def test_splitTime_first(self):
         '''
         Split after first frame
@@ -125,6 +266,8 @@ class TestTemporalImageFake4D(unittest.TestCase):
         self.assertEqual(secondImg.shape[3], self.timg.shape[3]-1)
         self.assertEqual(secondImg.get_startTime(), splitTime)
         self.assertEqual(secondImg.get_endTime(), self.timg.get_endTime())
+        self.assertTrue(np.allclose(secondImg.get_fdata(),
+                                    self.timg.get_fdata()[:,:,:,1:]))
 
     def test_splitTime_last(self):
         '''
@@ -152,6 +295,46 @@ class TestTemporalImageFake4D(unittest.TestCase):
         self.assertEqual(secondImg.get_startTime(), splitTime)
         self.assertEqual(secondImg.get_endTime(), self.timg.get_endTime())
 
+    def test_extractTimes(self):
+        '''
+        Several windows should be read in a single pass and match extractTime
+        '''
+        frameStart = self.timg.get_frameStart()
+        frameEnd = self.timg.get_frameEnd()
+        windows = [(frameStart[0], frameEnd[1]), (frameStart[4], frameEnd[5]),
+                   (frameStart[1], frameEnd[-1])]
+
+        imgs = self.timg.extractTimes(windows)
+        self.assertFalse(self.timg.in_memory)
+        self.assertEqual(len(imgs), len(windows))
+        for img, (startTime, endTime) in zip(imgs, windows):
+            extr = self.timg.extractTime(startTime, endTime)
+            self.assertEqual(img.get_startTime(), startTime)
+            self.assertEqual(img.get_endTime(), endTime)
+            self.assertTrue(np.allclose(img.get_fdata(), extr.get_fdata()))
+
+        # all windows share the array read from disk
+        self.assertTrue(np.shares_memory(imgs[0].dataobj, imgs[2].dataobj))
+
+        imgs = self.timg.extractTimes(windows, view=True)
+        self.assertTrue(np.allclose(imgs[1].get_fdata(),
+                                    self.timg.get_fdata()[:,:,:,4:6]))
+
+    def test_splitTimes(self):
+        frameStart = self.timg.get_frameStart()
+        imgs = self.timg.splitTimes([frameStart[1], frameStart[3:5].mean()])
+        self.assertEqual([img.shape[3] for img in imgs], [1, 2, 4])
+        self.assertEqual(imgs[1].get_startTime(), frameStart[1])
+        self.assertEqual(imgs[2].get_startTime(), frameStart[3])
+        self.assertEqual(imgs[2].get_endTime(), self.timg.get_endTime())
+        self.assertTrue(np.allclose(np.concatenate([img.get_fdata()
+                                                    for img in imgs], axis=3),
+                                    self.timg.get_fdata()))
+
+        self.assertRaises(ValueError, self.timg.splitTimes, [])
+        self.assertRaises(ValueError, self.timg.splitTimes,
+                          [frameStart[3], frameStart[1]])
+
     def test_dynamic_mean_firstFrame(self):
         '''
         Silly test where we call dynamic mean on the first time frame and
@@ -176,14 +359,238 @@ class TestTemporalImageFake4D(unittest.TestCase):
         self.timg.dynamic_mean()
         self.timg.dynamic_mean(weights='frameduration')
 
+    def test_dynamic_mean_chunked(self):
+        '''
+        Chunked computation should reproduce numpy.average exactly for
+        F-ordered data, which numpy.average also sums frame by frame
+        '''
+        dat = self.timg.get_fdata(caching='unchanged')
+        delta = self.timg.get_frameDuration().magnitude
+        frameBytes = self.timg.get_numVoxels() * 8
+
+        for memoryLimit in [None, 1, 3*frameBytes]:
+            self.assertTrue(np.array_equal(
+                self.timg.dynamic_mean(memoryLimit=memoryLimit),
+                np.average(dat, axis=3)))
+            self.assertTrue(np.array_equal(
+                self.timg.dynamic_mean(weights='frameduration',
+                                       memoryLimit=memoryLimit),
+                np.average(dat, axis=3, weights=delta)))
+        self.assertFalse(self.timg.in_memory)
+
+    def test_dynamic_mean_many_frames(self):
+        '''
+        For C-ordered data, numpy.average sums pairwise, so the frame by frame
+        mean only agrees with it up to rounding
+        '''
+        numFrames = 40
+        rng = np.random.default_rng(0)
+        dat = np.ascontiguousarray(rng.random((10, 11, 12, numFrames)) * 100)
+        delta = rng.integers(1, 10, size=numFrames).astype(float)
+        frameEnd = np.cumsum(delta)
+        timg = temporalimage.TemporalImage(dat, np.eye(4),
+                                           Quantity(frameEnd - delta, 'min'),
+                                           Quantity(frameEnd, 'min'))
+        frameBytes = timg.get_numVoxels() * 8
+
+        for memoryLimit in [None, 3*frameBytes]:
+            np.testing.assert_array_max_ulp(
+                timg.dynamic_mean(memoryLimit=memoryLimit),
+                np.average(dat, axis=3), maxulp=numFrames)
+            np.testing.assert_array_max_ulp(
+                timg.dynamic_mean(weights='frameduration',
+                                  memoryLimit=memoryLimit),
+                np.average(dat, axis=3, weights=delta), maxulp=numFrames)
+
+    def test_window_mean(self):
+        '''
+        Window means and AUCs from the integral should match dynamic_mean
+        '''
+        frameStart = self.timg.get_frameStart()
+        frameEnd = self.timg.get_frameEnd()
+        integral = self.timg.build_integral(memoryLimit=2**14)
+        self.assertEqual(integral.shape, self.timg.shape[:3] + (8,))
+
+        for startIndex, endIndex in [(0, 7), (2, 3), (1, 5)]:
+            startTime, endTime = frameStart[startIndex], frameEnd[endIndex-1]
+            extr = self.timg.extractTime(startTime, endTime)
+            dyn_mean = extr.dynamic_mean(weights='frameduration')
+            self.assertTrue(np.allclose(self.timg.window_mean(startTime, endTime),
+                                        dyn_mean))
+            self.assertTrue(np.allclose(
+                self.timg.window_auc(startTime, endTime),
+                dyn_mean * extr.get_frameDuration().magnitude.sum()))
+
+    def test_build_integral_file(self):
+        import tempfile
+        import shutil
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'integral.npy')
+            integral = self.timg.build_integral(filename=filename)
+            self.assertTrue(os.path.exists(filename))
+            self.assertEqual(sorted(os.listdir(tmpdir)),
+                             ['integral.npy', 'integral.npy.key'])
+
+            timg = temporalimage.load(self.imgfile, self.timingfile)
+            integral2 = timg.build_integral(filename=filename)
+            self.assertIsInstance(integral2, np.memmap)
+            self.assertFalse(timg.in_memory)
+            self.assertTrue(np.array_equal(integral, integral2))
+
+            # an integral of other data or frame timing of the same shape is
+            # rebuilt
+            data = timg.get_fdata() * 2
+            other = temporalimage.TemporalImage(data, timg.affine,
+                                                timg.frameStart, timg.frameEnd)
+            self.assertTrue(np.allclose(other.build_integral(filename=filename),
+                                        2 * integral))
+            other = temporalimage.TemporalImage(data, timg.affine,
+                                                timg.frameStart / 2,
+                                                timg.frameEnd / 2)
+            self.assertTrue(np.allclose(other.build_integral(filename=filename),
+                                        integral))
+            self.assertTrue(np.allclose(timg.build_integral(filename=filename),
+                                        integral))
+
+            # modifiable data are integrated again
+            timg.detach()
+            self.assertIsNone(timg._integral)
+            timg.get_fdata()[...] = 0
+            self.assertTrue(np.array_equal(
+                timg.window_auc(timg.frameStart[0], timg.frameEnd[-1]),
+                np.zeros(timg.shape[:3])))
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_gaussian_filter(self):
         self.timg.gaussian_filter(sigma=3)
 
+    def test_gaussian_filter_options(self):
+        from scipy.ndimage import gaussian_filter
+
+        dat = self.timg.get_fdata(caching='unchanged')
+        expected = np.stack([gaussian_filter(dat[:,:,:,t], sigma=2)
+                             for t in range(self.timg.get_numFrames())],
+                            axis=-1)
+
+        smoothed = self.timg.gaussian_filter(sigma=2, numThreads=3,
+                                             memoryLimit=1)
+        self.assertTrue(np.allclose(smoothed, expected))
+
+        out = np.zeros(self.timg.shape, dtype=np.float32)
+        smoothed = self.timg.gaussian_filter(sigma=2, out=out)
+        self.assertIs(smoothed, out)
+        self.assertTrue(np.allclose(out, expected, rtol=1e-4))
+
+        smoothedImg = self.timg.gaussian_filter(sigma=2, dtype=np.float32,
+                                                returnImage=True)
+        self.assertIsInstance(smoothedImg, temporalimage.TemporalImage)
+        self.assertEqual(smoothedImg.get_data_dtype(), np.float32)
+        self.assertEqual(smoothedImg.get_endTime(), self.timg.get_endTime())
+        self.assertTrue(np.allclose(smoothedImg.get_fdata(), expected,
+                                    rtol=1e-4))
+
+    def test_crop(self):
+        mask = np.zeros(self.timg.shape[:-1], dtype=bool)
+        mask[2:5,3,4:9] = True
+        cropped, bbox = self.timg.crop(mask, margin=(1, 0, 4))
+        self.assertEqual(bbox, (slice(1, 6), slice(3, 4), slice(0, 12)))
+        self.assertEqual(cropped.shape, (5, 1, 12, 7))
+        self.assertTrue(np.allclose(cropped.get_fdata(),
+                                    self.timg.get_fdata()[bbox]))
+
+        # voxels keep their world coordinates
+        self.assertTrue(np.allclose(cropped.affine @ [0, 0, 0, 1],
+                                    self.timg.affine @ [1, 3, 0, 1]))
+
+        uncropped = self.timg.uncrop(cropped.get_fdata(), bbox)
+        self.assertEqual(uncropped.shape, self.timg.shape)
+        self.assertTrue(np.allclose(uncropped[bbox], cropped.get_fdata()))
+        self.assertTrue((uncropped[0]==0).all())
+
+        self.assertRaises(ValueError, self.timg.crop, np.zeros_like(mask))
+        self.assertRaises(ValueError, self.timg.uncrop, np.zeros((2, 2, 2)), bbox)
+
+    def test_mask_operations(self):
+        mask = np.zeros(self.timg.shape[:-1], dtype=bool)
+        mask[3:6,2:9,4:8] = True
+        bbox = self.timg.mask_bbox(mask)
+
+        dyn_mean = self.timg.dynamic_mean(weights='frameduration', mask=mask)
+        self.assertTrue(np.allclose(
+            dyn_mean[bbox], self.timg.dynamic_mean(weights='frameduration')[bbox]))
+        self.assertTrue((dyn_mean[~mask]==0).all())
+
+        smoothed = self.timg.gaussian_filter(1.5, mask=mask, mode='constant')
+        self.assertTrue(np.allclose(
+            smoothed[bbox], self.timg.gaussian_filter(1.5, mode='constant')[bbox]))
+        self.assertTrue((smoothed[~mask]==0).all())
+
     def test_roi_timeseries_silly(self):
         mask = np.ones(self.timg.shape[:-1])
         self.assertTrue(np.allclose(self.timg.roi_timeseries(mask=mask),
                                     np.mean(self.timg.get_fdata(), axis=(0,1,2))))
 
+    def test_label_timeseries(self):
+        labelimg = np.zeros(self.timg.shape[:-1])
+        labelimg[:,:,4:] = 1
+        labelimg[:,:,8:] = 2
+
+        tacs, counts = self.timg.label_timeseries(labelimg, [2, 1, 3],
+                                                  [[0, 1], [1, 2, 2]],
+                                                  return_counts=True)
+        self.assertSequenceEqual(tacs.shape, (5, self.timg.get_numFrames()))
+        self.assertSequenceEqual(counts.tolist(),
+                                 [10*11*4, 10*11*4, 0, 10*11*8, 10*11*8])
+        self.assertTrue(np.allclose(tacs[0],
+                                    self.timg.roi_timeseries(mask=labelimg==2)))
+        self.assertTrue(np.allclose(tacs[1],
+                                    self.timg.roi_timeseries(mask=labelimg==1)))
+        self.assertTrue(np.all(np.isnan(tacs[2])))
+        self.assertTrue(np.allclose(tacs[3],
+                                    self.timg.roi_timeseries(mask=labelimg<2)))
+        self.assertTrue(np.allclose(tacs[4],
+                                    self.timg.roi_timeseries(mask=labelimg>0)))
+
+    def test_computeDtype(self):
+        self.assertEqual(self.timg.get_computeDtype(), np.float64)
+        self.timg.set_computeDtype('float32')
+        self.assertEqual(self.timg.get_computeDtype(), np.float32)
+
+        extr = self.timg.extractTime(self.timg.get_frameStart()[1],
+                                     self.timg.get_endTime())
+        self.assertEqual(extr.get_computeDtype(), np.float32)
+        self.assertEqual(extr.dynamic_mean().dtype, np.float32)
+        self.assertEqual(extr.gaussian_filter(sigma=1).dtype, np.float32)
+
+        mask = np.ones(self.timg.shape[:-1])
+        tac = self.timg.roi_timeseries(mask=mask)
+        self.assertEqual(tac.dtype, np.float32)
+        self.assertEqual(self.timg._fdata_cache.dtype, np.float32)
+        self.assertTrue(np.allclose(tac, self.timg_s.roi_timeseries(mask=mask)))
+
+        # native data type of the test image is float64
+        self.timg.set_computeDtype('native')
+        self.assertEqual(self.timg.get_computeDtype(), np.float64)
+
+        self.assertRaises(ValueError, self.timg.set_computeDtype, 'int16')
+
+    def test_global_computeDtype(self):
+        try:
+            temporalimage.set_computeDtype('float32')
+            self.assertEqual(temporalimage.get_computeDtype(), np.float32)
+            self.assertEqual(self.timg.get_computeDtype(), np.float32)
+            self.assertEqual(self.timg.dynamic_mean(memoryLimit=1).dtype,
+                             np.float32)
+
+            # per-image setting takes precedence
+            self.timg.set_computeDtype('float64')
+            self.assertEqual(self.timg.get_computeDtype(), np.float64)
+        finally:
+            temporalimage.set_computeDtype('float64')
+
     def test_save(self):
         from tempfile import mkdtemp
 
@@ -0,0 +1,110 @@
+import temporalimage
+from temporalimage import Quantity, summarize_windows
+from temporalimage.atlas import AtlasIndex
+from .generate_test_data import generate_fake4D
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import nibabel as nib
+
+class TestSummarizeWindows(unittest.TestCase):
+    def setUp(self):
+        imgfile, timingfile, _, _ = generate_fake4D()
+        self.timg = temporalimage.load(imgfile, timingfile)
+        self.windows = [(Quantity(0, 'min'), Quantity(20, 'min')),
+                        (Quantity(10, 'min'), Quantity(60, 'min')),
+                        (Quantity(40, 'min'), Quantity(50, 'min'))]
+
+        self.labelimg = np.zeros(self.timg.shape[:-1], dtype=np.int16)
+        self.labelimg[...,4:] = 1
+        self.labelimg[2:5,...,8:] = 2
+
+        self.tmpdirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdirname)
+
+    def test_summaries(self):
+        mask = self.labelimg==2
+        imgFiles = [os.path.join(self.tmpdirname, 'img%d.nii.gz' % w)
+                    for w in range(len(self.windows))]
+        timingFiles = [os.path.join(self.tmpdirname, 'timing%d.csv' % w)
+                       for w in range(len(self.windows))]
+
+        summaries = summarize_windows(self.timg, self.windows,
+                                      imgFiles=imgFiles, timingFiles=timingFiles,
+                                      means=True, weights='frameduration',
+                                      mask=mask, atlas=self.labelimg,
+                                      labels=[0, 1, 2], composites=[[1, 2]],
+                                      memoryLimit=2**14)
+        self.assertEqual(len(summaries), len(self.windows))
+
+        for w, (startTime, endTime) in enumerate(self.windows):
+            extractedImg = self.timg.extractTime(startTime, endTime)
+            self.assertEqual(summaries[w]['startTime'], startTime)
+            self.assertEqual(summaries[w]['endTime'], endTime)
+
+            savedImg = temporalimage.load(imgFiles[w], timingFiles[w])
+            self.assertTrue(np.array_equal(savedImg.get_fdata(),
+                                           extractedImg.get_fdata()))
+            self.assertEqual(savedImg.get_endTime(), endTime)
+
+            self.assertTrue(np.allclose(
+                summaries[w]['mean'],
+                extractedImg.dynamic_mean(weights='frameduration', mask=mask)))
+
+            tacs, counts = extractedImg.label_timeseries(
+                               self.labelimg, [0, 1, 2], [[1, 2]],
+                               return_counts=True)
+            self.assertTrue(np.allclose(summaries[w]['tacs'], tacs))
+            self.assertTrue(np.array_equal(summaries[w]['counts'], counts))
+
+    def test_options(self):
+        # nothing but ROI TACs, from a saved atlas index
+        summaries = summarize_windows(self.timg, self.windows[1:],
+                                      atlas=AtlasIndex.from_label_image(
+                                          self.labelimg, composites=[[1, 2]]))
+        self.assertEqual(sorted(summaries[0]), ['counts', 'endTime',
+                                                'startTime', 'tacs'])
+        self.assertEqual(summaries[0]['tacs'].shape, (4, 5))
+        self.assertEqual(os.listdir(self.tmpdirname), [])
+
+        # scaled integer images are saved once their data range is known,
+        # still reading each frame of the input once
+        from unittest import mock
+        from temporalimage import t4d
+
+        imgFile = os.path.join(self.tmpdirname, 'img.nii')
+        timingFile = os.path.join(self.tmpdirname, 'timing.csv')
+        with mock.patch.object(t4d, '_read_frames',
+                               wraps=t4d._read_frames) as readFrames:
+            summaries = summarize_windows(self.timg, self.windows[:1],
+                                          imgFiles=[imgFile],
+                                          timingFiles=[timingFile], means=True,
+                                          dtype='int16', memoryLimit=2**14)
+        self.assertEqual(sum(len(range(7)[call.args[1]])
+                             for call in readFrames.call_args_list), 3)
+        self.assertEqual(sorted(os.listdir(self.tmpdirname)),
+                         ['img.nii', 'timing.csv'])
+        img = nib.load(imgFile)
+        self.assertEqual(img.get_data_dtype(), np.int16)
+        self.assertTrue(np.allclose(img.get_fdata(),
+                                    self.timg.get_fdata()[...,:3],
+                                    atol=img.dataobj.slope))
+
+        savedFile = os.path.join(self.tmpdirname, 'saved.nii')
+        temporalimage.save(self.timg.extractTime(*self.windows[0]), savedFile,
+                           timingFile, dtype='int16')
+        saved = nib.load(savedFile)
+        self.assertEqual(saved.dataobj.slope, img.dataobj.slope)
+        self.assertTrue(np.array_equal(saved.get_fdata(), img.get_fdata()))
+        self.assertTrue(np.allclose(summaries[0]['mean'],
+                                    self.timg.get_fdata()[...,:3].mean(axis=3)))
+
+        self.assertRaises(ValueError, summarize_windows, self.timg, [])
+        self.assertRaises(ValueError, summarize_windows, self.timg,
+                          self.windows, imgFiles=[imgFile])
+        self.assertRaises(ValueError, summarize_windows, self.timg,
+                          self.windows, means=True, weights='unknown')
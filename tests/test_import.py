@@ -0,0 +1,28 @@
+import os
+import sys
+import json
+import subprocess
+import unittest
+
+_IMPORT_SCRIPT = '''
+import sys, json
+import temporalimage
+print(json.dumps([m for m in ('pint', 'pandas', 'nipype',
+                              'temporalimage.nipype_wrapper')
+                  if m in sys.modules]))
+'''
+
+class TestImport(unittest.TestCase):
+    def test_no_heavy_imports(self):
+        # the unit registry and the nipype wrappers are only loaded on first
+        # access, so importing temporalimage does not import them
+        out = subprocess.check_output(
+                [sys.executable, '-c', _IMPORT_SCRIPT],
+                cwd=os.path.join(os.path.dirname(__file__), os.pardir))
+        self.assertEqual(json.loads(out.decode().strip().splitlines()[-1]), [])
+
+    def test_lazy_attributes(self):
+        import temporalimage
+        self.assertTrue(temporalimage.Quantity(1, 'minute').check('[time]'))
+        self.assertIs(temporalimage.unitreg, temporalimage.Quantity._REGISTRY)
+        self.assertRaises(AttributeError, getattr, temporalimage, 'foo')
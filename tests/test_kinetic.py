@@ -0,0 +1,176 @@
+import temporalimage
+from temporalimage import Quantity
+from temporalimage import t4d
+from temporalimage.kinetic import srtm_basis, fit_srtm, _frame_average_conv, \
+                                  running_integral
+import unittest
+from unittest import mock
+import os
+import shutil
+import tempfile
+import numpy as np
+
+def _saved_image(timg, dirname):
+    ''' Save a temporal image to disk and load it, without loading its data
+    '''
+    imgfile = os.path.join(dirname, 'img.nii')
+    timingfile = os.path.join(dirname, 'timing.csv')
+    temporalimage.save(timg, imgfile, timingfile)
+    return temporalimage.load(imgfile, timingfile, cache=False)
+
+class TestSRTM(unittest.TestCase):
+    def setUp(self):
+        durations = np.array([0.25]*4 + [0.5]*4 + [1]*4 + [5]*6 + [10]*5)
+        frameEnd = np.cumsum(durations)
+        frameStart = frameEnd - durations
+        t = (frameStart + frameEnd) / 2
+        self.refTAC = 1000 * t * np.exp(-t / 8)
+
+        # voxels with known parameters, with k2a on the basis grid
+        self.k2aRange = (0.01, 1.0)
+        self.numBasis = 41
+        k2aGrid = np.geomspace(self.k2aRange[0], self.k2aRange[1],
+                               self.numBasis)
+        self.R1 = np.array([1.0, 0.8, 1.2, 1.0])
+        self.k2a = k2aGrid[[10, 20, 15, 30]]
+        self.DVR = np.array([1.1, 1.5, 2.0, 1.25])
+        k2 = self.k2a * self.DVR
+
+        self.timg = temporalimage.TemporalImage(
+                        np.zeros((2, 2, 1, len(durations))), np.eye(4),
+                        Quantity(frameStart, 'min'), Quantity(frameEnd, 'min'))
+        conv = _frame_average_conv(self.timg.timeline, self.refTAC, self.k2a)
+        tacs = self.R1 * self.refTAC[:,np.newaxis] + (k2 - self.R1 * self.k2a) * conv
+        self.timg = temporalimage.TemporalImage(
+                        tacs.T.reshape((2, 2, 1, len(durations))), np.eye(4),
+                        Quantity(frameStart, 'min'), Quantity(frameEnd, 'min'))
+
+    def test_fit_srtm(self):
+        k2a, basis = srtm_basis(self.timg.timeline, self.refTAC,
+                                self.k2aRange, self.numBasis)
+        tacs = self.timg.get_fdata().reshape((-1, self.timg.get_numFrames())).T
+        results = fit_srtm(tacs, self.refTAC, k2a, basis)
+        self.assertTrue(np.allclose(results['R1'], self.R1))
+        self.assertTrue(np.allclose(results['DVR'], self.DVR))
+        self.assertTrue(np.allclose(results['BPND'], self.DVR - 1))
+        self.assertTrue(np.allclose(results['k2'], self.k2a * self.DVR))
+
+    def test_srtm(self):
+        maps = self.timg.srtm(self.refTAC, k2aRange=self.k2aRange,
+                              numBasis=self.numBasis)
+        self.assertEqual(maps['DVR'].shape, (2, 2, 1))
+        self.assertTrue(np.allclose(maps['DVR'].ravel(), self.DVR))
+        self.assertTrue(np.allclose(maps['R1'].ravel(), self.R1))
+
+    def test_srtm_mask_chunks(self):
+        mask = np.array([True, False, True, True]).reshape((2, 2, 1))
+        maps = self.timg.srtm(self.refTAC, mask=mask, weights=None,
+                              k2aRange=self.k2aRange, numBasis=self.numBasis,
+                              memoryLimit=1)
+        self.assertTrue(np.isnan(maps['DVR'][~mask]).all())
+        self.assertTrue(np.allclose(maps['DVR'][mask], self.DVR[mask.ravel()]))
+
+    def test_srtm_bounded_memory(self):
+        # with memoryLimit, TACs are read in chunks without loading all data
+        tmpdirname = tempfile.mkdtemp()
+        try:
+            timg = _saved_image(self.timg, tmpdirname)
+            with mock.patch.object(timg, '_get_fdata',
+                                   side_effect=AssertionError), \
+                 mock.patch.object(t4d, '_read_frames',
+                                   wraps=t4d._read_frames) as readFrames:
+                maps = timg.srtm(self.refTAC, k2aRange=self.k2aRange,
+                                 numBasis=self.numBasis, memoryLimit=100)
+            self.assertIsNone(timg._fdata_cache)
+
+            # each time frame is read once, not once per chunk of voxels
+            numFrames = timg.get_numFrames()
+            self.assertEqual(sum(len(range(numFrames)[call.args[1]])
+                                 for call in readFrames.call_args_list),
+                             numFrames)
+        finally:
+            shutil.rmtree(tmpdirname)
+        self.assertTrue(np.allclose(maps['DVR'].ravel(), self.DVR))
+
+    def test_srtm_reference(self):
+        # the reference region has a DVR of 1
+        timg = temporalimage.TemporalImage(
+                   np.tile(self.refTAC, (2, 2, 1, 1)), np.eye(4),
+                   self.timg.get_frameStart(), self.timg.get_frameEnd())
+        maps = timg.srtm(self.refTAC)
+        self.assertTrue(np.allclose(maps['DVR'], 1))
+        self.assertTrue(np.allclose(maps['R1'], 1))
+
+    def test_srtm_errors(self):
+        self.assertRaises(ValueError, self.timg.srtm, self.refTAC[:-1])
+        self.assertRaises(ValueError, self.timg.srtm, self.refTAC,
+                          weights='foo')
+        self.assertRaises(ValueError, self.timg.srtm, self.refTAC,
+                          k2aRange=(1, 0.1))
+
+class TestGraphical(unittest.TestCase):
+    setUp = TestSRTM.setUp
+
+    def test_running_integral(self):
+        timeline = self.timg.timeline
+        integral = running_integral(timeline, np.ones(len(timeline)))
+        self.assertTrue(np.allclose(integral,
+                                    self.timg.get_midTime().to('min').magnitude))
+
+        tacs = np.random.rand(len(timeline), 3)
+        self.assertTrue(np.allclose(running_integral(timeline, tacs)[:,1],
+                                    running_integral(timeline, tacs[:,1])))
+
+    def test_logan(self):
+        tStar = Quantity(30, 'min')
+        maps = self.timg.logan(self.refTAC, tStar, memoryLimit=1)
+        self.assertTrue(np.allclose(maps['DVR'].ravel(), self.DVR, rtol=0.05))
+        self.assertTrue(np.allclose(maps['BPND'], maps['DVR'] - 1))
+
+        # the reference region has a DVR of 1
+        timg = temporalimage.TemporalImage(
+                   np.tile(self.refTAC, (2, 2, 1, 1)), np.eye(4),
+                   self.timg.get_frameStart(), self.timg.get_frameEnd())
+        maps = timg.logan(self.refTAC, tStar, weights='frameduration')
+        self.assertTrue(np.allclose(maps['DVR'], 1))
+
+    def test_bounded_memory(self):
+        tStar = Quantity(30, 'min')
+        expectedLogan = self.timg.logan(self.refTAC, tStar)
+        expectedPatlak = self.timg.patlak(self.refTAC, tStar)
+
+        tmpdirname = tempfile.mkdtemp()
+        try:
+            timg = _saved_image(self.timg, tmpdirname)
+            with mock.patch.object(timg, '_get_fdata',
+                                   side_effect=AssertionError):
+                logan = timg.logan(self.refTAC, tStar, memoryLimit=100)
+                patlak = timg.patlak(self.refTAC, tStar, memoryLimit=100)
+            self.assertIsNone(timg._fdata_cache)
+        finally:
+            shutil.rmtree(tmpdirname)
+        self.assertTrue(np.allclose(logan['DVR'], expectedLogan['DVR']))
+        self.assertTrue(np.allclose(patlak['Ki'], expectedPatlak['Ki']))
+
+    def test_patlak(self):
+        # irreversible uptake: Ct = Ki * int(Cin) + V * Cin
+        Ki = np.array([0.01, 0.02, 0.05, 0.1])
+        V = np.array([0.5, 0.3, 0.2, 0.4])
+        timeline = self.timg.timeline
+        tacs = running_integral(timeline, self.refTAC)[:,np.newaxis] * Ki + \
+               self.refTAC[:,np.newaxis] * V
+        timg = temporalimage.TemporalImage(
+                   tacs.T.reshape((2, 2, 1, -1)), np.eye(4),
+                   self.timg.get_frameStart(), self.timg.get_frameEnd())
+
+        mask = np.array([True, True, False, True]).reshape((2, 2, 1))
+        maps = timg.patlak(self.refTAC, Quantity(20, 'min'), mask=mask)
+        self.assertTrue(np.allclose(maps['Ki'][mask], Ki[mask.ravel()]))
+        self.assertTrue(np.allclose(maps['intercept'][mask], V[mask.ravel()]))
+        self.assertTrue(np.isnan(maps['Ki'][~mask]).all())
+
+    def test_tStar(self):
+        self.assertRaises(ValueError, self.timg.logan, self.refTAC,
+                          self.timg.get_frameStart()[-1])
+        self.assertRaises(ValueError, self.timg.patlak, self.refTAC[1:],
+                          Quantity(20, 'min'))
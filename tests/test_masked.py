@@ -0,0 +1,92 @@
+import temporalimage
+from temporalimage import Quantity, MaskedTemporalImage
+from .generate_test_data import generate_fake4D
+import unittest
+import numpy as np
+
+class TestMaskedTemporalImage(unittest.TestCase):
+    def setUp(self):
+        imgfile, timingfile, _, _ = generate_fake4D()
+        self.timg = temporalimage.load(imgfile, timingfile)
+
+        self.mask = np.zeros(self.timg.shape[:-1], dtype=bool)
+        self.mask[2:8,3:9,1:11] = True
+        self.mimg = self.timg.masked(self.mask, memoryLimit=2**14)
+
+    def test_masked(self):
+        self.assertIsInstance(self.mimg, MaskedTemporalImage)
+        self.assertEqual(self.mimg.shape, (self.mask.sum(), 7))
+        self.assertTrue(self.mimg.data.flags.c_contiguous)
+        self.assertTrue(np.array_equal(self.mimg.get_mask(), self.mask))
+        self.assertTrue(np.allclose(self.mimg.data,
+                                    self.timg.get_fdata()[self.mask]))
+
+    def test_roi_timeseries(self):
+        roi = np.zeros_like(self.mask)
+        roi[4:6,4:6,5:7] = True
+        self.assertTrue(np.allclose(self.mimg.roi_timeseries(mask=roi),
+                                    self.timg.roi_timeseries(mask=roi)))
+
+        roi = np.zeros_like(self.mask)
+        roi[0,0,0] = True
+        self.assertRaises(ValueError, self.mimg.roi_timeseries, mask=roi)
+        self.assertRaises(TypeError, self.mimg.roi_timeseries)
+
+    def test_dynamic_mean(self):
+        dyn_mean = self.mimg.dynamic_mean(weights='frameduration')
+        self.assertEqual(dyn_mean.shape, self.mask.shape)
+        self.assertTrue(np.isnan(dyn_mean[~self.mask]).all())
+        self.assertTrue(np.allclose(
+            dyn_mean[self.mask],
+            self.timg.dynamic_mean(weights='frameduration')[self.mask]))
+
+    def test_extractTime(self):
+        frameStart = self.timg.get_frameStart()
+        frameEnd = self.timg.get_frameEnd()
+        extr = self.mimg.extractTime(frameStart[2], frameEnd[4])
+        self.assertEqual(extr.get_numFrames(), 3)
+        self.assertEqual(extr.get_startTime(), frameStart[2])
+        self.assertTrue(np.shares_memory(extr.data, self.mimg.data))
+        self.assertTrue(np.allclose(extr.data, self.mimg.data[:,2:5]))
+
+        firstImg, secondImg = self.mimg.splitTime(frameStart[3])
+        self.assertEqual(firstImg.get_numFrames(), 3)
+        self.assertEqual(secondImg.get_endTime(), self.timg.get_endTime())
+
+    def test_timing_metadata(self):
+        imgfile, _, _, timingfile_sif = generate_fake4D()
+        timg = temporalimage.load(imgfile, timingfile_sif)
+        timg.json_dict = {'TracerName': 'test'}
+        mimg = timg.masked(self.mask)
+        self.assertTrue(len(mimg.sif_header)>0)
+
+        frameStart = timg.get_frameStart()
+        firstImg, secondImg = mimg.splitTime(frameStart[3])
+        for img in [mimg.extractTime(frameStart[2], frameStart[4]),
+                    firstImg, secondImg, secondImg.to_image()]:
+            self.assertEqual(img.sif_header, timg.sif_header)
+            self.assertEqual(img.json_dict, timg.json_dict)
+
+    def test_modeling(self):
+        refTAC = self.mimg.roi_timeseries(mask=self.mask & (np.arange(12)<6))
+        maps = self.mimg.srtm(refTAC, mask=self.mask & (np.arange(12)>=3))
+        fullMaps = self.timg.srtm(refTAC, mask=self.mask & (np.arange(12)>=3))
+        self.assertTrue(np.allclose(maps['DVR'], fullMaps['DVR'],
+                                    equal_nan=True))
+
+        maps = self.mimg.logan(refTAC, Quantity(20, 'min'), memoryLimit=2**10)
+        self.assertTrue(np.isnan(maps['DVR'][~self.mask]).all())
+        self.assertTrue(np.allclose(maps['DVR'][self.mask & (np.arange(12)<6)],
+                                    1))
+
+    def test_unmask(self):
+        self.assertTrue(np.allclose(self.mimg.unmask(self.mimg.data, fill=0),
+                                    self.timg.get_fdata() * self.mask[...,np.newaxis]))
+        self.assertEqual(self.mimg.unmask(np.ones(self.mimg.get_numVoxels(),
+                                                  dtype=int), fill=0).dtype, int)
+        self.assertRaises(ValueError, self.mimg.unmask, np.ones(3))
+
+        img = self.mimg.to_image()
+        self.assertEqual(img.shape, self.timg.shape)
+        self.assertTrue(np.allclose(img.get_fdata()[self.mask],
+                                    self.timg.get_fdata()[self.mask]))
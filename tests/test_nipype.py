@@ -9,7 +9,8 @@ try:
 
     import nibabel as nib
     from temporalimage.nipype_wrapper import SplitTimeSeries, ExtractTimeSeries, \
-                                             DynamicMean, ROI_TACs_to_spreadsheet
+                                             ExtractTimeWindows, DynamicMean, \
+                                             ROI_TACs_to_spreadsheet
     from nipype.pipeline.engine import Node, Workflow
     from nipype.interfaces.utility import IdentityInterface
 
@@ -75,6 +76,117 @@ try:
             ])
             extract_time_workflow.run()
 
+        def test_nipype_extract_windows(self):
+            infosource = Node(IdentityInterface(fields=['in_file']), name="infosource")
+            infosource.iterables = ('in_file', [self.imgfilename])
+
+            extract_windows = Node(ExtractTimeWindows(frameTimingFile=self.csvfilename,
+                                                      startTimes=[0, 13, 50],
+                                                      endTimes=[10, 42, 60],
+                                                      dynamicMean=True),
+                                   name="extract_windows")
+            extract_windows_workflow = Workflow(name="extract_windows_workflow",
+                                                base_dir=self.tmpdirname)
+            extract_windows_workflow.connect([
+                (infosource, extract_windows, [('in_file','timeSeriesImgFile')])
+            ])
+            extract_windows_workflow.run()
+
+        def test_nipype_extract_windows_memory_limit(self):
+            from unittest import mock
+            from temporalimage import t4d
+
+            extract_windows = ExtractTimeWindows(timeSeriesImgFile=self.imgfilename,
+                                                 frameTimingFile=self.csvfilename,
+                                                 startTimes=[0, 13],
+                                                 endTimes=[10, 42],
+                                                 dynamicMean=True,
+                                                 memoryLimit=1)
+            with mock.patch.object(t4d, '_read_frames',
+                                   wraps=t4d._read_frames) as readFrames:
+                result = extract_windows.run(cwd=self.tmpdirname)
+
+            # the 5 frames spanned by the windows are read once, one at a time
+            numFrames = [len(range(7)[call.args[1]])
+                         for call in readFrames.call_args_list]
+            self.assertEqual(numFrames, [1] * 5)
+
+            timg = temporalimage.load(self.imgfilename, self.csvfilename)
+            extr = temporalimage.load(result.outputs.imgFiles[1],
+                                      result.outputs.timingFiles[1])
+            self.assertTrue(np.allclose(extr.get_fdata(),
+                                        timg.get_fdata()[...,3:5]))
+            self.assertTrue(np.allclose(
+                nib.load(result.outputs.meanImgFiles[1]).get_fdata(),
+                timg.get_fdata()[...,3:5].mean(axis=3)))
+
+        def test_nipype_compute_dtype(self):
+            from unittest import mock
+            from temporalimage import nipype_wrapper
+
+            interfaces = [ExtractTimeSeries(startTime=13, endTime=42),
+                          SplitTimeSeries(splitTime=10)]
+            for interface in interfaces:
+                interface.inputs.timeSeriesImgFile = self.imgfilename
+                interface.inputs.frameTimingFile = self.csvfilename
+                interface.inputs.computeDtype = 'float32'
+                with mock.patch.object(nipype_wrapper, 'ti_load',
+                                       wraps=nipype_wrapper.ti_load) as load:
+                    interface.run(cwd=self.tmpdirname)
+                self.assertEqual(load.call_args.kwargs['computeDtype'],
+                                 'float32')
+
+        def test_nipype_output_encoding(self):
+            split_time = SplitTimeSeries(timeSeriesImgFile=self.imgfilename,
+                                         frameTimingFile=self.csvfilename,
+                                         splitTime=10, compressOutput=False,
+                                         outputDtype='int16')
+            result = split_time.run(cwd=self.tmpdirname)
+            firstImgFile = result.outputs.firstImgFile
+            self.assertTrue(firstImgFile.endswith('min.nii'))
+            self.assertEqual(nib.load(firstImgFile).get_data_dtype(), np.int16)
+            self.assertTrue(np.allclose(
+                nib.load(firstImgFile).get_fdata(),
+                temporalimage.load(self.imgfilename, self.csvfilename)
+                             .get_fdata()[...,:2], rtol=1e-3))
+
+            dynamic_mean = DynamicMean(timeSeriesImgFile=self.imgfilename,
+                                       frameTimingFile=self.csvfilename,
+                                       startTime=13, endTime=42,
+                                       compressLevel=6, outputDtype='float32')
+            result = dynamic_mean.run(cwd=self.tmpdirname)
+            self.assertTrue(result.outputs.meanImgFile.endswith('min_mean.nii.gz'))
+            self.assertEqual(nib.load(result.outputs.meanImgFile)
+                                .get_data_dtype(), np.float32)
+
+        def test_nipype_extract_windows_roi_tacs(self):
+            extract_windows = ExtractTimeWindows(timeSeriesImgFile=self.imgfilename,
+                                                 frameTimingFile=self.csvfilename,
+                                                 startTimes=[0, 13], endTimes=[10, 42],
+                                                 dynamicMean=True,
+                                                 labelImgFile=self.labelfilename,
+                                                 ROI_list=[0,1,2],
+                                                 ROI_names=['a','b','c'],
+                                                 additionalROIs=[[1,2]],
+                                                 additionalROI_names=['bc'],
+                                                 compressOutput=False)
+            result = extract_windows.run(cwd=self.tmpdirname)
+            self.assertEqual(result.outputs.startTimes, [0, 20])
+            self.assertEqual(result.outputs.endTimes, [10, 40])
+            for outputFiles in [result.outputs.imgFiles,
+                                result.outputs.timingFiles,
+                                result.outputs.meanImgFiles,
+                                result.outputs.csvFiles]:
+                self.assertEqual(len(outputFiles), 2)
+                self.assertTrue(all(os.path.isfile(f) for f in outputFiles))
+            self.assertTrue(result.outputs.imgFiles[1].endswith('20.00to40.00min.nii'))
+
+            with open(result.outputs.csvFiles[1]) as f:
+                rows = f.read().splitlines()
+            self.assertEqual(rows[0], 'ROI,0,1')
+            self.assertEqual([row.split(',')[0] for row in rows[1:]],
+                             ['a', 'b', 'c', 'bc'])
+
         def test_nipype_dynamic_mean(self):
             infosource = Node(IdentityInterface(fields=['in_file']), name="infosource")
             infosource.iterables = ('in_file', [self.imgfilename])
@@ -96,7 +208,9 @@ try:
 
             dynamic_mean = Node(DynamicMean(frameTimingFile=self.csvfilename,
                                             startTime=13, endTime=42,
-                                            weights='frameduration'),
+                                            weights='frameduration',
+                                            memoryLimit=2**16,
+                                            maskFile=self.labelfilename),
                                 name="dynamic_mean")
 
             dynamic_mean_workflow = Workflow(name="dynamic_mean_workflow",
@@ -115,7 +229,8 @@ try:
                                                     ROI_list = [0,1,2],
                                                     ROI_names = ['a','b','c'],
                                                     additionalROIs = [[0,1],[1,2]],
-                                                    additionalROI_names=['ab','bc']),
+                                                    additionalROI_names=['ab','bc'],
+                                                    computeDtype='float32'),
                             name="roi_tacs")
 
             roi_tacs_workflow = Workflow(name="roi_tacs_workflow",
@@ -125,6 +240,20 @@ try:
             ])
             roi_tacs_workflow.run()
 
+        def test_nipype_roi_tacs_atlas_index(self):
+            indexfilename = os.path.join(self.tmpdirname, 'label_index.npz')
+            for _ in range(2):
+                roi_tacs = ROI_TACs_to_spreadsheet(
+                                timeSeriesImgFile=self.imgfilename,
+                                frameTimingFile=self.csvfilename,
+                                labelImgFile=self.labelfilename,
+                                atlasIndexFile=indexfilename,
+                                ROI_list=[0,1,2], ROI_names=['a','b','c'],
+                                additionalROIs=[[0,1]],
+                                additionalROI_names=['ab'])
+                roi_tacs.run(cwd=self.tmpdirname)
+                self.assertTrue(os.path.isfile(indexfilename))
+
 except ImportError:
     print('Cannot perform temporalimage.nipype tests. \
            To carry out these tests, install temporalimage using nipype option.')
@@ -0,0 +1,89 @@
+import temporalimage
+from temporalimage import Quantity
+from temporalimage.parallel import map_voxels
+import unittest
+import numpy as np
+
+def _mean_fit(tacs, scale=1):
+    return {'mean': scale * tacs.mean(axis=0), 'last': tacs[-1]}
+
+def _bootstrap_fit(tacs, rng):
+    sample = rng.integers(0, tacs.shape[0], size=tacs.shape[0])
+    return {'mean': tacs[sample].mean(axis=0)}
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.timg = temporalimage.TemporalImage(
+                        rng.random((6, 5, 4, 3)), np.eye(4),
+                        Quantity(np.array([0, 1, 2]), 'min'),
+                        Quantity(np.array([1, 2, 3]), 'min'))
+
+    def test_map_voxels(self):
+        maps = self.timg.map_voxels(_mean_fit, kwargs={'scale': 2},
+                                    numProcesses=2, chunkSize=7)
+        self.assertTrue(np.allclose(maps['mean'],
+                                    2 * self.timg.get_fdata().mean(axis=3)))
+        self.assertTrue(np.allclose(maps['last'],
+                                    self.timg.get_fdata()[...,-1]))
+
+    def test_from_file(self):
+        import os
+        import shutil
+        import tempfile
+        from unittest import mock
+
+        # TACs are written into shared memory from chunks of frames, without
+        # loading the data
+        tmpdirname = tempfile.mkdtemp()
+        try:
+            imgfile = os.path.join(tmpdirname, 'img.nii')
+            timingfile = os.path.join(tmpdirname, 'timing.csv')
+            temporalimage.save(self.timg, imgfile, timingfile)
+            timg = temporalimage.load(imgfile, timingfile, cache=False)
+            with mock.patch.object(timg, '_get_fdata',
+                                   side_effect=AssertionError):
+                maps = timg.map_voxels(_mean_fit, numProcesses=2, chunkSize=7,
+                                       memoryLimit=1000)
+            self.assertIsNone(timg._fdata_cache)
+        finally:
+            shutil.rmtree(tmpdirname)
+        self.assertTrue(np.allclose(maps['mean'],
+                                    self.timg.get_fdata().mean(axis=3)))
+
+    def test_mask(self):
+        mask = self.timg.get_fdata()[...,0]>0.5
+        maps = self.timg.map_voxels(_mean_fit, mask=mask, numProcesses=1)
+        self.assertTrue(np.isnan(maps['mean'][~mask]).all())
+        self.assertTrue(np.allclose(maps['mean'][mask],
+                                    self.timg.get_fdata()[mask].mean(axis=1)))
+
+    def test_deterministic(self):
+        maps1 = self.timg.map_voxels(_bootstrap_fit, numProcesses=1,
+                                     chunkSize=10, seed=42)
+        maps2 = self.timg.map_voxels(_bootstrap_fit, numProcesses=3,
+                                     chunkSize=10, seed=42)
+        self.assertTrue(np.array_equal(maps1['mean'], maps2['mean']))
+
+    def test_progress(self):
+        calls = []
+        tacs = np.random.rand(25, 3)
+        results = map_voxels(_mean_fit, tacs, numProcesses=2, chunkSize=10,
+                             progress=lambda done, total: calls.append((done, total)))
+        self.assertEqual(calls, [(1, 3), (2, 3), (3, 3)])
+        self.assertTrue(np.allclose(results['mean'], tacs.mean(axis=1)))
+
+        self.assertRaises(ValueError, map_voxels, _mean_fit, tacs, chunkSize=0)
+
+    def test_fill_error(self):
+        from temporalimage.parallel import _map_voxels
+
+        def fill(tacs):
+            tacs[...] = 0
+            raise RuntimeError('fill failed')
+
+        # the error of the fill function is not hidden by releasing the
+        # shared memory
+        with self.assertRaisesRegex(RuntimeError, 'fill failed'):
+            _map_voxels(_mean_fit, (25, 3), np.float64, fill, numProcesses=2,
+                        chunkSize=10)
@@ -0,0 +1,56 @@
+from temporalimage import Quantity, FrameTimeline
+import unittest
+import numpy as np
+
+class TestFrameTimeline(unittest.TestCase):
+    def setUp(self):
+        self.timeline = FrameTimeline(
+            Quantity(np.array([0,  5, 10, 20, 30, 40, 50]), 'minute'),
+            Quantity(np.array([300, 600, 1200, 1800, 2400, 3000, 3600]), 'sec'))
+
+    def test_len(self):
+        self.assertEqual(len(self.timeline), 7)
+
+    def test_unit_normalization(self):
+        self.assertTrue(np.allclose(self.timeline.end,
+                                    [5, 10, 20, 30, 40, 50, 60]))
+        self.assertTrue(np.allclose(self.timeline.duration, [5,5] + [10]*5))
+        self.assertTrue(np.allclose(
+            self.timeline.get_midTime().to('min').magnitude,
+            [2.5, 7.5, 15, 25, 35, 45, 55]))
+
+    def test_cached_quantities(self):
+        self.assertIs(self.timeline.get_frameDuration(),
+                      self.timeline.get_frameDuration())
+        self.assertRaises(ValueError, self.timeline.start.__setitem__, 0, 1)
+
+    def test_time_to_frame(self):
+        self.assertEqual(self.timeline.time_to_frame(Quantity(0, 'min')), 0)
+        self.assertEqual(self.timeline.time_to_frame(Quantity(5, 'min')), 1)
+        self.assertEqual(self.timeline.time_to_frame(Quantity(59.9, 'min')), 6)
+        self.assertEqual(self.timeline.time_to_frame(Quantity(60, 'min')), -1)
+        self.assertSequenceEqual(self.timeline.time_to_frame(
+                                    Quantity(np.array([-1, 900, 1500]), 's')
+                                 ).tolist(), [-1, 2, 3])
+
+    def test_window(self):
+        self.assertEqual(self.timeline.window(Quantity(5, 'min'),
+                                              Quantity(50, 'min')),
+                         slice(1, 6))
+        self.assertEqual(self.timeline.window(Quantity(5.1, 'min'),
+                                              Quantity(49.9, 'min')),
+                         slice(2, 5))
+
+    def test_unsorted(self):
+        timeline = FrameTimeline(Quantity(np.array([10, 0, 5]), 'min'),
+                                 Quantity(np.array([20, 5, 10]), 'min'))
+        self.assertEqual(timeline.time_to_frame(Quantity(7, 'min')), 2)
+        self.assertEqual(timeline.window(Quantity(0, 'min'),
+                                         Quantity(10, 'min')),
+                         slice(0, 0))
+
+    def test_slice(self):
+        sub = self.timeline[2:5]
+        self.assertEqual(len(sub), 3)
+        self.assertEqual(sub.get_frameStart()[0], Quantity(10, 'min'))
+        self.assertEqual(sub.get_frameEnd()[-1], Quantity(40, 'min'))
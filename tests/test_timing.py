@@ -0,0 +1,110 @@
+from temporalimage import Quantity
+from temporalimage import timing
+import unittest
+import os
+import json
+import tempfile
+import shutil
+import numpy as np
+
+class TestTiming(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.frameStart = Quantity(np.array([0, 0.25, 0.5, 1, 2, 5, 10]), 'min')
+        self.frameEnd = Quantity(np.array([0.25, 0.5, 1, 2, 5, 10, 20]), 'min')
+        timing.clear_timing_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        timing.clear_timing_cache()
+
+    def _roundtrip(self, ext, **kwargs):
+        filename = os.path.join(self.tmpdir, 'timing' + ext)
+        timing.write_frameTiming(self.frameStart, self.frameEnd, filename,
+                                 **kwargs)
+        frameStart, frameEnd, sif_header, json_dict = \
+            timing.read_frameTiming(filename)
+        self.assertTrue(np.allclose(frameStart.to('min').magnitude,
+                                    self.frameStart.magnitude))
+        self.assertTrue(np.allclose(frameEnd.to('min').magnitude,
+                                    self.frameEnd.magnitude))
+        return sif_header, json_dict
+
+    def test_csv(self):
+        self._roundtrip('.csv')
+        self._roundtrip('.csv', time_unit='sec')
+
+    def test_csv_extra_columns(self):
+        filename = os.path.join(self.tmpdir, 'timing.csv')
+        with open(filename, 'w') as f:
+            f.write('Frame,Elapsed time (min),Note,Duration of time frame (s)\n'
+                    '1,1,a,60\n2,3,b,120\n')
+        frameStart, frameEnd, _, _ = timing.read_frameTiming(filename)
+        self.assertTrue(np.allclose(frameStart.to('min').magnitude, [0, 1]))
+        self.assertTrue(np.allclose(frameEnd.to('min').magnitude, [1, 3]))
+
+    def test_sif(self):
+        # the first frame should not be lost when there is no header
+        self.assertEqual(self._roundtrip('.sif'), ('', {}))
+        header = '01/01/2000 00:00:00 7 4 1 test'
+        self.assertEqual(self._roundtrip('.sif', sif_header=header)[0], header)
+
+    def test_json(self):
+        json_dict = {'TracerName': 'PiB'}
+        _, json_dict_read = self._roundtrip('.json', json_dict=json_dict)
+        self.assertEqual(json_dict_read['TracerName'], 'PiB')
+
+    def test_json_formats(self):
+        start = self.frameStart.to('s').magnitude.tolist()
+        duration = (self.frameEnd - self.frameStart).to('s').magnitude.tolist()
+        end = self.frameEnd.to('min').magnitude.tolist()
+        json_dicts = [
+            {'FrameTimesStart': start, 'FrameDuration': duration},
+            {'Time': {'FrameTimesStart': start, 'FrameDuration': duration}},
+            {'Time': {'FrameTimesStart': start, 'FrameTimesStartUnits': 's',
+                      'FrameDuration': duration, 'FrameDurationUnits': 's'}},
+            {'Time': {'FrameTimes': {'Labels': ['frameStart', 'frameEnd'],
+                                     'Units': ['s', 'min'],
+                                     'Values': list(zip(start, end))}}},
+            {'Time': {'FrameTimes': {'Labels': ['frameStart', 'frameDuration'],
+                                     'Units': ['s', 's'],
+                                     'Values': list(zip(start, duration))}}}]
+        for i, json_dict in enumerate(json_dicts):
+            filename = os.path.join(self.tmpdir, 'timing%d.json' % i)
+            with open(filename, 'w') as f:
+                json.dump(json_dict, f)
+            frameStart, frameEnd, _, _ = timing.read_frameTiming(filename)
+            self.assertTrue(np.allclose(frameStart.to('min').magnitude,
+                                        self.frameStart.magnitude))
+            self.assertTrue(np.allclose(frameEnd.to('min').magnitude,
+                                        self.frameEnd.magnitude))
+
+    def test_unsupported_extension(self):
+        filename = os.path.join(self.tmpdir, 'timing.txt')
+        self.assertRaises(IOError, timing.write_frameTiming,
+                          self.frameStart, self.frameEnd, filename)
+        open(filename, 'w').close()
+        self.assertRaises(IOError, timing.read_frameTiming, filename)
+
+    def test_memoization(self):
+        filename = os.path.join(self.tmpdir, 'timing.json')
+        timing.write_frameTiming(self.frameStart, self.frameEnd, filename,
+                                 json_dict={'TracerName': 'PiB'})
+        frameStart, _, _, json_dict = timing.read_frameTiming(filename)
+        self.assertEqual(len(timing._timingCache), 1)
+
+        # results are copies, so modifying them does not affect the cache
+        frameStart[0] = Quantity(1, 'hour')
+        json_dict['TracerName'] = 'FDG'
+        frameStart, _, _, json_dict = timing.read_frameTiming(filename)
+        self.assertEqual(len(timing._timingCache), 1)
+        self.assertEqual(frameStart[0].magnitude, 0)
+        self.assertEqual(json_dict['TracerName'], 'PiB')
+
+        # modified files are parsed again
+        timing.write_frameTiming(self.frameStart, self.frameEnd, filename,
+                                 json_dict={'TracerName': 'FDG'})
+        st = os.stat(filename)
+        os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        _, _, _, json_dict = timing.read_frameTiming(filename)
+        self.assertEqual(json_dict['TracerName'], 'FDG')
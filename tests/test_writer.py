@@ -0,0 +1,122 @@
+import temporalimage
+from temporalimage.writer import TemporalImageWriter
+from temporalimage.timing import write_frameTiming
+from .generate_test_data import generate_fake4D
+import unittest
+import os
+import gzip
+import shutil
+import tempfile
+import numpy as np
+import nibabel as nib
+
+class TestTemporalImageWriter(unittest.TestCase):
+    def setUp(self):
+        imgfile, timingfile, _, _ = generate_fake4D()
+        self.timg = temporalimage.load(imgfile, timingfile)
+        self.tmpdirname = tempfile.mkdtemp()
+        self.csvfilename = os.path.join(self.tmpdirname, 'timingData.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdirname)
+
+    def test_save_streaming(self):
+        for name, numThreads in [('img.nii', None), ('img.nii.gz', None),
+                                 ('img_mt.nii.gz', 3)]:
+            imgfilename = os.path.join(self.tmpdirname, name)
+            temporalimage.save(self.timg, imgfilename, self.csvfilename,
+                               memoryLimit=2**12, numThreads=numThreads)
+            img = nib.load(imgfilename)
+            self.assertEqual(img.shape, self.timg.shape)
+            self.assertTrue(np.allclose(img.affine, self.timg.affine))
+            self.assertTrue(np.array_equal(img.get_fdata(),
+                                           self.timg.get_fdata()))
+        self.assertEqual(sorted(os.listdir(self.tmpdirname)),
+                         ['img.nii', 'img.nii.gz', 'img_mt.nii.gz',
+                          'timingData.csv'])
+
+    def test_save_encoding(self):
+        imgfilename = os.path.join(self.tmpdirname, 'img.nii.gz')
+        temporalimage.save(self.timg, imgfilename, self.csvfilename,
+                           dtype='float32', compresslevel=9)
+        img = nib.load(imgfilename)
+        self.assertEqual(img.get_data_dtype(), np.float32)
+        self.assertTrue(np.allclose(img.get_fdata(), self.timg.get_fdata()))
+        with gzip.open(imgfilename) as f:
+            f.read()
+
+        temporalimage.save(self.timg, imgfilename, self.csvfilename,
+                           dtype=np.int16, memoryLimit=2**12)
+        img = nib.load(imgfilename)
+        self.assertEqual(img.get_data_dtype(), np.int16)
+        self.assertTrue(np.allclose(img.get_fdata(), self.timg.get_fdata(),
+                                    atol=img.dataobj.slope))
+
+    def test_parallel_gzip(self):
+        # small blocks, so that the image is written as many gzip members
+        imgfilename = os.path.join(self.tmpdirname, 'img.nii.gz')
+        with TemporalImageWriter(imgfilename, self.timg.shape,
+                                 self.timg.affine, dtype=np.float64,
+                                 numThreads=4) as writer:
+            writer._stream.blockSize = 1000
+            for t in range(self.timg.get_numFrames()):
+                writer.write(self.timg.get_fdata()[...,t])
+
+        with gzip.open(imgfilename) as f:
+            self.assertEqual(len(f.read()),
+                             352 + self.timg.get_fdata().nbytes)
+
+        write_frameTiming(self.timg.frameStart, self.timg.frameEnd,
+                          self.csvfilename)
+        timg = temporalimage.load(imgfilename, self.csvfilename, cache=False)
+        self.assertTrue(np.array_equal(timg.get_fdata(), self.timg.get_fdata()))
+
+        try:
+            import indexed_gzip
+        except ImportError:
+            self.skipTest('indexed_gzip is not installed')
+        with temporalimage.load(imgfilename, self.csvfilename, cache=False,
+                                seekIndex=True) as timg:
+            self.assertTrue(np.array_equal(timg.extractTime(timg.frameStart[3],
+                                                            timg.frameEnd[5])
+                                               .get_fdata(),
+                                           self.timg.get_fdata()[...,3:6]))
+
+    def test_scaled_int16(self):
+        imgfilename = os.path.join(self.tmpdirname, 'img.nii')
+        data = self.timg.get_fdata() + 0.25
+        with TemporalImageWriter(imgfilename, self.timg.shape,
+                                 self.timg.affine, dtype=np.int16,
+                                 dataRange=(data.min(), data.max())) as writer:
+            writer.write(data[...,:3])
+            writer.write(data[...,3:])
+
+        img = nib.load(imgfilename)
+        self.assertEqual(img.get_data_dtype(), np.int16)
+        self.assertTrue(np.allclose(img.get_fdata(), data,
+                                    atol=img.dataobj.slope))
+
+    def test_incomplete(self):
+        imgfilename = os.path.join(self.tmpdirname, 'img.nii.gz')
+        writer = TemporalImageWriter(imgfilename, self.timg.shape,
+                                     self.timg.affine)
+        writer.write(self.timg.get_fdata()[...,0])
+        self.assertRaises(ValueError, writer.write,
+                          self.timg.get_fdata()[:-1,...,0])
+        self.assertRaises(ValueError, writer.close)
+        self.assertEqual(os.listdir(self.tmpdirname), [])
+
+    def test_gaussian_filter(self):
+        imgfilename = os.path.join(self.tmpdirname, 'img.nii.gz')
+        mask = np.zeros(self.timg.shape[:-1], dtype=bool)
+        mask[3:6,3:6,3:9] = True
+        for kwargs in [{}, {'mask': mask}]:
+            with TemporalImageWriter(imgfilename, self.timg.shape,
+                                     self.timg.affine, dtype=np.float64,
+                                     numThreads=2) as writer:
+                self.assertIsNone(self.timg.gaussian_filter(
+                                      1.5, out=writer, memoryLimit=2**13,
+                                      **kwargs))
+            self.assertTrue(np.allclose(
+                nib.load(imgfilename).get_fdata(),
+                self.timg.gaussian_filter(1.5, **kwargs)))